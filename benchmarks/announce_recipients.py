@@ -0,0 +1,70 @@
+"""
+Memory taken by announce recipients: list of ints vs RecipientSet.
+
+    python benchmarks/announce_recipients.py [users count ...]
+"""
+import pathlib
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'src'))
+
+from plugins.Announce.recipients import RecipientSet  # noqa: E402
+
+
+DEFAULT_USERS_COUNTS = (1_000_000, 10_000_000)
+
+
+def get_user_ids(count: int) -> range:
+    # Telegram user ids are big enough to be separate int objects
+    first_id = random.randint(10 ** 8, 10 ** 9)
+    return range(first_id, first_id + count * 3, 3)
+
+
+def measure(build) -> tuple[object, float, float]:
+    """
+    Returns built object, traced memory in MB and build time in seconds.
+    """
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    built = build()
+    spent_s = time.perf_counter() - started_at
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    return built, memory_mb, spent_s
+
+
+def benchmark(count: int) -> None:
+    user_ids = get_user_ids(count)
+
+    ids_list, list_mb, list_s = measure(lambda: list(user_ids))
+    del ids_list
+
+    recipients, array_mb, array_s = measure(lambda: RecipientSet.from_iterable(user_ids))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = pathlib.Path(tmp_dir) / 'recipients.ids'
+
+        _, _, save_s = measure(lambda: recipients.save(path))
+        del recipients
+
+        mapped, mapped_mb, open_s = measure(lambda: RecipientSet.open(path))
+        _, _, seek_s = measure(lambda: mapped.seek_after(user_ids[count // 2]))
+        mapped.close()
+
+        print(
+            f'{count:>12,} users | '
+            f'list: {list_mb:8.1f} MB ({list_s:.2f} s) | '
+            f'array: {array_mb:7.1f} MB ({array_s:.2f} s) | '
+            f'mmap: {mapped_mb:5.2f} MB (open {open_s * 1000:.1f} ms, seek {seek_s * 1000:.2f} ms) | '
+            f'file: {path.stat().st_size / 1024 / 1024:.1f} MB, '
+            f'saved in {save_s:.2f} s'
+        )
+
+
+if __name__ == '__main__':
+    for users_count in [int(arg) for arg in sys.argv[1:]] or DEFAULT_USERS_COUNTS:
+        benchmark(users_count)
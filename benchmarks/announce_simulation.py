@@ -0,0 +1,207 @@
+"""
+Announce throughput against simulated Telegram.
+
+The real announce path (AnnounceEngine with its rate controller, AnnouncePayload and
+ScheduledSendClient with the outbound send scheduler) sends to a fake Pyrogram client,
+so nothing leaves the process. The fake answers after configurable latency, raises
+errors by a given mix and enforces its own rate limit with FloodWait, like Telegram does.
+DB is replaced by a synthetic users table, which counts UPDATE queries.
+
+    python benchmarks/announce_simulation.py --users 3000 --latency-ms 50 --blocked 0.1
+    python benchmarks/announce_simulation.py --telegram-rate 1000 --max-rate 1000 --bot-rate 1000
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+SRC_PATH = pathlib.Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_PATH))
+
+# settings are read from environment on import, mandatory ones aren't used by simulation
+MANDATORY_ENVS = {
+    'API_ID': '0',
+    'API_HASH': 'simulation',
+    'BOT_TOKEN': '0:simulation',
+    'DB_PASSWORD': 'simulation',
+    'SMP_APP_ID': 'simulation',
+    'SMP_APP_SECRET': 'simulation',
+    'SUPPORT_CHAT_URL': 'simulation',
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=3000, help='size of synthetic users table')
+    parser.add_argument('--seed', type=int, default=1)
+    # fake Telegram
+    parser.add_argument('--latency-ms', type=float, default=50, help='mean latency of a send')
+    parser.add_argument('--latency-jitter-ms', type=float, default=20, help='standard deviation of latency')
+    parser.add_argument('--blocked', type=float, default=0.05, help='share of users who blocked the bot')
+    parser.add_argument('--deactivated', type=float, default=0.01, help='share of deleted users')
+    parser.add_argument('--flood', type=float, default=0, help='share of sends failed with FloodWait at random')
+    parser.add_argument('--flood-wait-s', type=int, default=3, help='value of FloodWait')
+    parser.add_argument('--telegram-rate', type=float, default=30, help='messages per second, more get FloodWait')
+    # bot
+    parser.add_argument('--rate', type=float, default=25, help='initial announce rate')
+    parser.add_argument('--max-rate', type=float, default=30, help='max announce rate')
+    parser.add_argument('--bot-rate', type=float, default=30, help='global rate of send scheduler')
+    parser.add_argument('--senders', type=int, default=10, help='concurrent senders of announce')
+    parser.add_argument('--bookkeeping-batch-size', type=int, default=5000)
+    return parser.parse_args()
+
+
+def configure_settings(args: argparse.Namespace) -> None:
+    for name, value in MANDATORY_ENVS.items():
+        os.environ.setdefault(name, value)
+
+    os.environ.update({
+        'ANNOUNCE_BOOKKEEPING_BATCH_SIZE': str(args.bookkeeping_batch_size),
+        'ANNOUNCE_BOOKKEEPING_INTERVAL_S': '1',
+        'ANNOUNCE_MAX_RATE': str(args.max_rate),
+        'ANNOUNCE_RATE': str(args.rate),
+        'ANNOUNCE_WORKERS': str(args.senders),
+        'SEND_GLOBAL_BURST': str(max(1, int(args.bot_rate))),
+        'SEND_GLOBAL_RATE': str(args.bot_rate),
+        'SEND_PLATFORM_METRICS_DATA': 'false',
+    })
+
+
+async def simulate(args: argparse.Namespace) -> None:
+    # imported after settings are configured
+    from pyrogram import errors, raw, Client
+
+    from common.models import AnnounceJobStats
+    from common.sender import outbound_scheduler, sending_priority, ScheduledSendClient, SendPriority, TokenBucket
+    from plugins.Announce.engine import AnnounceEngine, AnnounceOutcome
+    from plugins.Announce.payload import AnnouncePayload, AnnouncePayloadKind
+    from plugins.Announce.rate import AdaptiveAnnounceRate
+    from plugins.Announce.recipients import RecipientSet
+
+    class SyntheticUsersTable:
+        """
+        Users to announce with predefined fate, and DB writes of announce outcomes.
+        """
+
+        def __init__(self, size: int, blocked_share: float, deactivated_share: float, seed: int):
+            randomizer = random.Random(seed)
+            first_id = randomizer.randint(10 ** 8, 10 ** 9)
+            self.user_ids = RecipientSet.from_iterable(range(first_id, first_id + size * 3, 3))
+
+            self.blocked_ids = set()
+            self.deactivated_ids = set()
+            for user_id in self.user_ids:
+                if (chance := randomizer.random()) < blocked_share:
+                    self.blocked_ids.add(user_id)
+                elif chance < blocked_share + deactivated_share:
+                    self.deactivated_ids.add(user_id)
+            self.user_ids.cursor = 0
+
+            self.queries = 0
+            self.updated_rows = 0
+
+        async def record(self, outcome: AnnounceOutcome, user_ids: list[int]) -> None:
+            # the same as `record_announce_outcomes`: one UPDATE per batch, failed sends aren't recorded
+            if outcome in (AnnounceOutcome.success, AnnounceOutcome.blocked):
+                self.queries += 1
+                self.updated_rows += len(user_ids)
+
+    class FakeTelegram(Client):
+        """
+        Telegram side of the client: invoke() never goes to network.
+        """
+
+        def __init__(self, table: SyntheticUsersTable):
+            super().__init__('announce_simulation', api_id=0, api_hash='simulation',
+                             bot_token='0:simulation', in_memory=True, no_updates=True)
+            self.table = table
+            self.randomizer = random.Random(args.seed)
+            self.limit = TokenBucket(rate=args.telegram_rate, capacity=max(1.0, args.telegram_rate))
+            self.floods = 0
+            self.delivered = 0
+
+        async def resolve_peer(self, peer_id):
+            return raw.types.InputPeerUser(user_id=peer_id, access_hash=0)
+
+        async def invoke(self, query, *_args, **_kwargs):
+            latency_s = self.randomizer.gauss(args.latency_ms, args.latency_jitter_ms) / 1000
+            await asyncio.sleep(max(0.0, latency_s))
+
+            if self.limit.get_wait_s(time.monotonic()) > 0 or self.randomizer.random() < args.flood:
+                self.floods += 1
+                raise errors.FloodWait(value=args.flood_wait_s)
+            self.limit.tokens -= 1
+
+            user_id = query.peer.user_id
+            if user_id in self.table.blocked_ids:
+                raise errors.UserIsBlocked()
+            if user_id in self.table.deactivated_ids:
+                raise errors.InputUserDeactivated()
+
+            self.delivered += 1
+
+    class FakeTelegramClient(ScheduledSendClient, FakeTelegram):
+        """
+        Sends pass through the real send scheduler before reaching fake Telegram.
+        """
+
+    tracemalloc.start()
+    table = SyntheticUsersTable(args.users, args.blocked, args.deactivated, args.seed)
+    table_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.reset_peak()
+
+    client = FakeTelegramClient(table)
+    payload = AnnouncePayload(kind=AnnouncePayloadKind.text, text='Simulated announcement')
+    latencies_s = []
+
+    async def announce_to_user(user_id: int) -> None:
+        started_at = time.perf_counter()
+        try:
+            with sending_priority(SendPriority.announce):
+                await payload.send(client=client, user_id=user_id)
+        finally:
+            latencies_s.append(time.perf_counter() - started_at)
+
+    job_stats = AnnounceJobStats(total=len(table.user_ids))
+    rate_controller = AdaptiveAnnounceRate()
+    engine = AnnounceEngine(
+        job_id='simulation',
+        recipients=table.user_ids,
+        send=announce_to_user,
+        record=table.record,
+        job_stats=job_stats,
+        rate_controller=rate_controller,
+    )
+
+    started_at = time.perf_counter()
+    await engine.run()
+    spent_s = time.perf_counter() - started_at
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies_ms = sorted(latency_s * 1000 for latency_s in latencies_s)
+    percentiles = statistics.quantiles(latencies_ms, n=100) if len(latencies_ms) > 1 else latencies_ms * 99
+    print(
+        f'users:            {job_stats.total:,} '
+        f'(success {job_stats.success:,}, blocked {job_stats.blocked:,}, failed {job_stats.failed:,})\n'
+        f'time:             {spent_s:.1f} s\n'
+        f'throughput:       {job_stats.sent / spent_s:.1f} msg/s '
+        f'(final rate {rate_controller.rate:.1f}, best {rate_controller.best_rate or 0:.1f} msg/s)\n'
+        f'send latency:     p50 {percentiles[49]:.1f} ms, p99 {percentiles[98]:.1f} ms, '
+        f'max {latencies_ms[-1] if latencies_ms else 0:.1f} ms\n'
+        f'flood waits:      {client.floods:,} from Telegram, {rate_controller.flood_waits:,} reached engine, '
+        f'{outbound_scheduler.flood_waits:,} seen by send scheduler\n'
+        f'memory:           users table {table_mb:.1f} MB, peak during announce {peak_bytes / 1024 / 1024:.1f} MB\n'
+        f'DB writes:        {table.queries:,} queries, {table.updated_rows:,} rows'
+    )
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    configure_settings(arguments)
+    asyncio.run(simulate(arguments))
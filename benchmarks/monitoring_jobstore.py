@@ -0,0 +1,247 @@
+"""
+Size of monitoring jobs in Redis job store and latency of get_jobs().
+
+The same number of subscriptions is stored in each format of monitoring jobs,
+as APScheduler's RedisJobStore stores them, under separate keys of the given Redis
+(monitoring jobs of the bot aren't touched, if it's the same Redis):
+    subscription  job per subscription with pickled Message, MonitoringModule and message handler
+    account       job per watched account with pickled MonitoringModule and message handler
+    compact       job per watched account with handler name and account fields only
+
+Monitoring modules connect to DB on import (and used to start the monitoring scheduler),
+so job functions, message handler and bot module are stood in here, with the same signatures
+and texts. Texts are read from bot config given by --config, otherwise they're synthetic,
+of --text-length characters each.
+
+    python benchmarks/monitoring_jobstore.py --subscriptions 100000 --redis-host localhost
+    python benchmarks/monitoring_jobstore.py --subscriptions 100000 --subscribers-per-account 3
+    python benchmarks/monitoring_jobstore.py --subscriptions 100000 --config configs/creoscan.yaml
+"""
+import argparse
+import dataclasses
+import datetime
+import math
+import os
+import pathlib
+import pickle
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import yaml
+
+SRC_PATH = pathlib.Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_PATH))
+
+# settings are read from environment on import, mandatory ones aren't used by benchmark
+MANDATORY_ENVS = {
+    'API_ID': '0',
+    'API_HASH': 'benchmark',
+    'BOT_TOKEN': '0:benchmark',
+    'DB_PASSWORD': 'benchmark',
+    'SMP_APP_ID': 'benchmark',
+    'SMP_APP_SECRET': 'benchmark',
+    'SUPPORT_CHAT_URL': 'benchmark',
+}
+
+FORMATS = ('subscription', 'account', 'compact')
+
+# texts of monitoring module: fields of Module, BotModule and MonitoringModule
+MODULE_TEXTS = (
+    'current_module_text', 'help_command_text', 'unknown_command_text', 'unhandled_error_text', 'wrong_input_text',
+    'command', 'description', 'friendly_name', 'icon', 'introduction_text', 'pending_text', 'header_text',
+    'footer_text', 'result_text',
+)
+MONITORING_MODULE_TEXTS = (
+    'instagram_media_type_choice_text', 'subscribe_confirmation_text', 'subscribe_text',
+    'monitoring_requests_exceed_error_text', 'my_monitoring_command', 'my_monitoring_active_introduction_text',
+    'my_monitoring_not_active_introduction_text', 'pause_monitoring_text', 'restart_monitoring_text',
+    'delete_confirmation_text', 'delete_text', 'edit_my_monitoring_text', 'create_monitoring_button',
+    'return_button', 'my_monitoring_button', 'button_selected', 'button_unselected', 'subscribe_button',
+    'stories_button', 'posts_button', 'reels_button',
+)
+
+# stand-in of MonitoringModule, it's defined when bot config is read, see `benchmark`
+MonitoringModule = None
+
+
+# stand-ins with signatures of monitoring job function of each format, kwargs of jobs are checked against them
+async def start_subscription_monitoring(message_handler, message, module, social_network, nickname, media_type):
+    pass
+
+
+async def start_account_monitoring(message_handler, module, social_network, nickname, media_type):
+    pass
+
+
+async def start_monitoring(handler, social_network, nickname, media_type):
+    pass
+
+
+async def send_monitoring_message_to_user(chat_id, message, media=None):
+    pass
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscriptions', type=int, default=100_000)
+    parser.add_argument('--subscribers-per-account', type=int, default=1,
+                        help='subscriptions sharing one watched account, for account and compact formats')
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--repeat', type=int, default=3, help='get_jobs() calls per format')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS,
+                        help='formats to measure, old ones take a few GB of memory at 100k subscriptions')
+    parser.add_argument('--batch-size', type=int, default=1000, help='jobs written to Redis per pipeline')
+    parser.add_argument('--config', type=pathlib.Path, help='bot config with texts of monitoring module')
+    parser.add_argument('--text-length', type=int, default=200, help='length of synthetic texts without --config')
+    return parser.parse_args()
+
+
+def configure_settings(args: argparse.Namespace) -> None:
+    for name, value in MANDATORY_ENVS.items():
+        os.environ.setdefault(name, value)
+
+    os.environ.update({
+        'REDIS_HOST': args.redis_host,
+        'REDIS_PORT': str(args.redis_port),
+        'SEND_PLATFORM_METRICS_DATA': 'false',
+    })
+
+    # bot config is read on import from `configs/creoscan.yaml` of working directory
+    config_path = pathlib.Path(tempfile.mkdtemp(prefix='monitoring_jobstore_')) / 'configs' / 'creoscan.yaml'
+    config_path.parent.mkdir()
+    if args.config:
+        shutil.copy(args.config, config_path)
+    else:
+        config_path.write_text(yaml.safe_dump({
+            'monitoring': {name: 'x' * args.text_length for name in (*MODULE_TEXTS, *MONITORING_MODULE_TEXTS)},
+        }))
+    os.chdir(config_path.parent.parent)
+
+
+def benchmark(args: argparse.Namespace) -> None:
+    # imported after settings are configured
+    from apscheduler.job import Job
+    from apscheduler.jobstores.redis import RedisJobStore
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.util import datetime_to_utc_timestamp
+    from pyrogram import enums
+    from pyrogram.types import Chat, Message, User
+
+    from models import BotModule
+    from plugins.Monitoring.scheduler import monitoring_check_scheduler
+    from plugins.Monitoring.schemas import MonitoredAccount
+
+    # pickled by reference, so it's defined in this module
+    global MonitoringModule
+    MonitoringModule = dataclasses.make_dataclass(
+        'MonitoringModule',
+        [(name, str, dataclasses.field(init=False)) for name in MONITORING_MODULE_TEXTS],
+        bases=(BotModule,),
+        namespace={'__module__': __name__},
+    )
+    module = MonitoringModule('monitoring')
+
+    # the scheduler isn't started, it's only needed to restore jobs
+    scheduler = BackgroundScheduler()
+
+    def get_kwargs(job_format: str, account: MonitoredAccount, user_id: int) -> dict:
+        kwargs = {
+            'social_network': account.social_network,
+            'nickname': account.nickname,
+            'media_type': account.media_type,
+        }
+        match job_format:
+            case 'subscription':
+                user = User(id=user_id, is_bot=False, first_name='Benchmark', username=f'user{user_id}')
+                message = Message(
+                    id=user_id % 10000,
+                    from_user=user,
+                    chat=Chat(id=user_id, type=enums.ChatType.PRIVATE, first_name='Benchmark'),
+                    date=datetime.datetime.now(),
+                    text=f'https://www.instagram.com/{account.nickname}/',
+                )
+                return {**kwargs, 'message_handler': send_monitoring_message_to_user, 'module': module,
+                        'message': message}
+            case 'account':
+                return {**kwargs, 'message_handler': send_monitoring_message_to_user, 'module': module}
+        return {**kwargs, 'handler': module.name}
+
+    def fill_store(store: RedisJobStore, job_format: str) -> int:
+        """
+        Writes jobs as `RedisJobStore.add_job` does, by batches. Returns total size of pickled jobs.
+        """
+        jobs_count = (args.subscriptions if job_format == 'subscription'
+                      else math.ceil(args.subscriptions / args.subscribers_per_account))
+        func = {
+            'subscription': start_subscription_monitoring,
+            'account': start_account_monitoring,
+        }.get(job_format, start_monitoring)
+        size = 0
+        pipe = store.redis.pipeline()
+        for ind in range(jobs_count):
+            account = MonitoredAccount(social_network='instagram', nickname=f'account_{ind}',
+                                       media_type=module.posts_button)
+            user_id = 10 ** 8 + ind
+            trigger = monitoring_check_scheduler.get_trigger(account)
+            job = Job(
+                scheduler,
+                id=f'monitoring-{account.key}-{user_id}' if job_format == 'subscription'
+                else f'monitoring-{account.key}',
+                func=func,
+                trigger=trigger,
+                executor='default',
+                args=(),
+                kwargs=get_kwargs(job_format, account, user_id),
+                name=f'Monitoring for {account.key}',
+                misfire_grace_time=None,
+                coalesce=True,
+                max_instances=1,
+                next_run_time=trigger.get_next_fire_time(None, datetime.datetime.now(datetime.timezone.utc)),
+            )
+
+            state = pickle.dumps(job.__getstate__(), store.pickle_protocol)
+            size += len(state)
+            pipe.hset(store.jobs_key, job.id, state)
+            pipe.zadd(store.run_times_key, {job.id: datetime_to_utc_timestamp(job.next_run_time)})
+            if ind % args.batch_size == args.batch_size - 1:
+                pipe.execute()
+        pipe.execute()
+        return size
+
+    print(f'{"format":<14}{"jobs":>10}{"pickled MB":>12}{"Redis MB":>10}{"per job B":>11}'
+          f'{"get_jobs() s":>14}{"per job us":>12}')
+    for job_format in args.formats:
+        store = RedisJobStore(
+            jobs_key=f'benchmark.{job_format}.apscheduler.jobs',
+            run_times_key=f'benchmark.{job_format}.apscheduler.run_times',
+            host=args.redis_host,
+            port=args.redis_port,
+        )
+        store.start(scheduler, job_format)
+        store.remove_all_jobs()
+        try:
+            size = fill_store(store, job_format)
+            redis_size = store.redis.memory_usage(store.jobs_key, samples=0) or 0
+
+            timings = []
+            for _ in range(args.repeat):
+                started_at = time.perf_counter()
+                jobs = store.get_all_jobs()
+                timings.append(time.perf_counter() - started_at)
+            latency_s = statistics.median(timings)
+
+            print(f'{job_format:<14}{len(jobs):>10,}{size / 1024 / 1024:>12.1f}{redis_size / 1024 / 1024:>10.1f}'
+                  f'{size / len(jobs):>11,.0f}{latency_s:>14.2f}{latency_s / len(jobs) * 10 ** 6:>12.1f}')
+        finally:
+            store.remove_all_jobs()
+            store.shutdown()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    configure_settings(arguments)
+    benchmark(arguments)
@@ -0,0 +1,222 @@
+import collections
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Hashable, Optional
+
+from pyrogram.types import Message
+
+import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
+from models import Module
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class AdmissionModule(Module):
+    busy_text: str = field(init=False, default=(
+        'Сейчас слишком много запросов 🙈\n'
+        'Попробуй отправить ссылку еще раз через {wait_s} сек.'))
+
+
+admission_module = AdmissionModule('admission')
+
+
+class AdmissionController:
+    """
+    Decides whether a new user request can be put to the queue of media requests.
+
+    Request is rejected early if any of the limits is hit:
+    - number of already queued requests (`max_queue_depth`)
+    - estimated wait time for a new request (`max_wait_s`)
+    - number of requests queued by the same user (`max_user_queued`)
+
+    Wait time is estimated from the live drain rate, i.e. the number of
+    requests completed during the last `drain_window_s` seconds. If queued requests
+    are not completed for the whole window, the queue is taken as stalled,
+    and the estimate gets worse the longer nothing is completed.
+
+    Each admitted request is known by its key, so it's removed from the queue once,
+    even if both the handler and the job it scheduled try to release it.
+    """
+
+    def __init__(self, name: str,
+                 max_queue_depth: int = settings.ADMISSION_MAX_QUEUE_DEPTH,
+                 max_wait_s: int = settings.ADMISSION_MAX_WAIT_S,
+                 max_user_queued: int = settings.ADMISSION_MAX_USER_QUEUED,
+                 drain_window_s: int = settings.ADMISSION_DRAIN_WINDOW_S):
+        self.name = name
+        self.max_queue_depth = max_queue_depth
+        self.max_wait_s = max_wait_s
+        self.max_user_queued = max_user_queued
+        self.drain_window_s = drain_window_s
+
+        # stats
+        self.accepted = 0
+        self.rejected = 0
+
+        self._queued = collections.Counter()  # user_id -> number of queued requests
+        self._admitted: dict[Hashable, int] = {}  # request key -> user_id
+        self._completed_at = collections.deque()  # monotonic timestamps of completed requests
+        self._started_at = time.monotonic()
+        self._drained_at = self._started_at  # last completion, or admission to the empty queue
+
+        register_measurement_source(self.get_measurements)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._queued.values())
+
+    @property
+    def drain_rate(self) -> float:
+        """
+        Number of requests completed per second during the last window.
+        If nothing was completed and nothing is queued, assume that jobs are started
+        one by one with `PENDING_DELAY` between them. If nothing was completed while
+        requests are queued, assume that one request is completed per time the queue
+        is already waiting.
+        """
+        now = time.monotonic()
+        while self._completed_at and self._completed_at[0] < now - self.drain_window_s:
+            self._completed_at.popleft()
+
+        if not self._completed_at:
+            if not self._queued:
+                return 1 / settings.PENDING_DELAY
+            return 1 / max(now - self._drained_at, settings.PENDING_DELAY)
+
+        window_s = min(self.drain_window_s, now - self._started_at)
+        return len(self._completed_at) / max(window_s, settings.PENDING_DELAY)
+
+    def estimate_wait_s(self, queue_depth: Optional[int] = None) -> float:
+        if queue_depth is None:
+            queue_depth = self.queue_depth
+        return queue_depth / self.drain_rate
+
+    def admit(self, user_id: int, request_key: Hashable) -> Optional[int]:
+        """
+        Puts user request to the queue.
+        Returns None if request is admitted, otherwise number of seconds after which
+        the user should retry.
+        """
+        queue_depth = self.queue_depth
+        drain_rate = self.drain_rate
+
+        # number of requests that should leave the queue before the new one fits the limits
+        excess = max(
+            queue_depth + 1 - self.max_queue_depth,
+            queue_depth + 1 - math.floor(self.max_wait_s * drain_rate),
+            # we don't know position of user's requests in the queue, so wait for the whole queue
+            queue_depth if self._queued[user_id] >= self.max_user_queued else 0,
+        )
+
+        if excess > 0:
+            self.rejected += 1
+            retry_after_s = math.ceil(excess / drain_rate)
+            log.info('Request of user #%s to %s is rejected: %s queued (%s by user), %.2f req/s, retry in %s sec',
+                     user_id, self.name, queue_depth, self._queued[user_id], drain_rate, retry_after_s)
+            return retry_after_s
+
+        if not queue_depth:
+            self._drained_at = time.monotonic()
+        self._queued[user_id] += 1
+        self._admitted[request_key] = user_id
+        self.accepted += 1
+        return None
+
+    def release(self, request_key: Hashable, completed: bool = True) -> None:
+        """
+        Removes user request from the queue, requests which are already released are skipped.
+        Only completed requests are taken into account for drain rate.
+        """
+        if (user_id := self._admitted.pop(request_key, None)) is None:
+            return
+
+        if self._queued[user_id] > 1:
+            self._queued[user_id] -= 1
+        else:
+            self._queued.pop(user_id, None)
+
+        if completed:
+            self._drained_at = time.monotonic()
+            self._completed_at.append(self._drained_at)
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        return get_service_measurements(self.name, {
+            MeasurementLabelTypeValue.admission_accepted: self.accepted,
+            MeasurementLabelTypeValue.admission_queue_depth: self.queue_depth,
+            MeasurementLabelTypeValue.admission_rejected: self.rejected,
+        })
+
+
+instagram_admission_controller = AdmissionController('instagram')
+tiktok_admission_controller = AdmissionController('tiktok')
+
+
+def get_request_key(message: Message) -> tuple[int, int]:
+    # the same message is passed from handler to the job it schedules
+    return message.chat.id, message.id
+
+
+class HandleAdmissionDecorator:
+    """
+    Decorator to reject user request if the queue is overloaded.
+    Should wrap a handler which puts user request to the queue.
+    """
+    def __init__(self, controller: AdmissionController):
+        self._controller = controller
+
+    def __call__(self, func):
+        async def wrapped_func(*args, **kwargs):
+            message = next(filter(lambda arg: isinstance(arg, Message), args), None)
+
+            # skip calls without Message object
+            if not message or not message.from_user:
+                return await func(*args, **kwargs)
+
+            user_id = message.from_user.id
+            request_key = get_request_key(message)
+
+            if (retry_after_s := self._controller.admit(user_id, request_key)) is not None:
+                await message.reply(
+                    text=admission_module.busy_text.format(wait_s=retry_after_s),
+                    reply_to_message_id=message.id,
+                )
+                return
+
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                # request wasn't queued, or the job will find it released already
+                self._controller.release(request_key, completed=False)
+                raise
+
+        return wrapped_func
+
+
+class ReleaseAdmissionDecorator:
+    """
+    Decorator to remove user request from the queue when the job is finished.
+    Should wrap a job function which is scheduled by the admitted handler.
+    """
+    def __init__(self, controller: AdmissionController):
+        self._controller = controller
+
+    def __call__(self, func):
+        async def wrapped_func(*args, **kwargs):
+            message = next(filter(lambda arg: isinstance(arg, Message), (*args, *kwargs.values())), None)
+
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                if message and message.from_user:
+                    self._controller.release(get_request_key(message))
+
+        return wrapped_func
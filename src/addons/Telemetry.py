@@ -2,7 +2,7 @@ import aiohttp
 import enum
 import logging
 from dataclasses import asdict, dataclass, field, fields, InitVar
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
 from pyrogram.types import (
     CallbackQuery,
@@ -67,6 +67,45 @@ class EventLabelUserActionTypeValue(AutoNameEnum):
 
 class MeasurementLabelTypeValue(AutoNameEnum):
     total_registrations = enum.auto()
+    # admission control
+    admission_accepted = enum.auto()
+    admission_queue_depth = enum.auto()
+    admission_rejected = enum.auto()
+    # updates dispatcher
+    dispatcher_active_users = enum.auto()
+    dispatcher_dropped_updates = enum.auto()
+    dispatcher_pending_updates = enum.auto()
+    dispatcher_worker_handled_updates = enum.auto()
+    dispatcher_worker_utilization = enum.auto()  # percents of time spent in handlers
+    # third-party API answers cache
+    answer_cache_hits = enum.auto()
+    answer_cache_misses = enum.auto()
+    answer_cache_refreshed = enum.auto()
+    answer_cache_size = enum.auto()
+    # media relay cache
+    media_relay_cache_files = enum.auto()
+    media_relay_cache_hits = enum.auto()
+    media_relay_cache_misses = enum.auto()
+    media_relay_cache_shared_downloads = enum.auto()
+    media_relay_cache_size_mb = enum.auto()
+    # monitoring checks of watched accounts
+    monitoring_avg_delivery_ms = enum.auto()  # of monitoring results to a subscriber
+    monitoring_avg_lag_ms = enum.auto()  # from when check was due to when it started
+    monitoring_checks = enum.auto()
+    monitoring_delivered_items = enum.auto()
+    monitoring_duplicate_items = enum.auto()  # already sent media skipped by watermarks
+    monitoring_expected_lag_ms = enum.auto()  # wait of a check due now, under provider quota
+    monitoring_max_delivery_ms = enum.auto()
+    monitoring_max_lag_ms = enum.auto()
+    monitoring_queue_depth = enum.auto()
+    monitoring_session_restarts = enum.auto()  # of bot session, seen by monitoring
+    # outbound send scheduler
+    sender_avg_wait_ms = enum.auto()
+    sender_flood_wait_s = enum.auto()  # time left until the end of current flood wait
+    sender_flood_waits = enum.auto()
+    sender_max_wait_ms = enum.auto()
+    sender_queue_depth = enum.auto()
+    sender_sent = enum.auto()
 
 
 class TelemetryEventName(AutoNameEnum):
@@ -77,6 +116,7 @@ class TelemetryEventName(AutoNameEnum):
     tgbot_account_event = enum.auto()
     tgbot_account_measurement = enum.auto()
     tgbot_external_api_event = enum.auto()
+    tgbot_service_measurement = enum.auto()  # internal state of bot components: queues, caches
     tgbot_user_action_event = enum.auto()  # all user interactions: buttons, menus
 
 
@@ -109,6 +149,11 @@ class TelemetryMeasurementLabels(TelemetryLabels):
     measurement_type: MeasurementLabelTypeValue
 
 
+@dataclass
+class ServiceMeasurementLabels(TelemetryMeasurementLabels):
+    component: str  # name of bot component the measurement belongs to, e.g. 'instagram'
+
+
 @dataclass
 class AccountEventLabels(TelemetryEventLabels):
     event_type: EventLabelAccountActionTypeValue
@@ -209,6 +254,41 @@ async def send_telemetry(telemetry_data: TelemetryEvent | TelemetryMeasurement)
         log.exception('Failed to send to PlatformMetrics: %s', exc)
 
 
+# Bot components register callables here, each of them returns a list of
+# actual measurements. Sources are collected periodically by `send_service_stats` job.
+_measurement_sources: list[Callable[[], list[TelemetryMeasurement]]] = []
+
+
+def register_measurement_source(source: Callable[[], list[TelemetryMeasurement]]) -> None:
+    _measurement_sources.append(source)
+
+
+def get_service_measurements(component: str, values: dict) -> list[TelemetryMeasurement]:
+    """
+    Shortcut to build measurements of one component from
+    `{MeasurementLabelTypeValue: value}` mapping.
+    """
+    return [
+        TelemetryMeasurement(
+            event_name=TelemetryEventName.tgbot_service_measurement,
+            event_labels=ServiceMeasurementLabels(measurement_type=measurement_type, component=component),
+            value=round(value),
+        ) for measurement_type, value in values.items()
+    ]
+
+
+async def send_registered_measurements() -> None:
+    for source in _measurement_sources:
+        try:
+            measurements = source()
+        except Exception as exc:
+            log.exception('Failed to collect measurements from %s: %s', source, exc)
+            continue
+
+        for measurement in measurements:
+            await send_telemetry(measurement)
+
+
 class SendUserActionEventDecorator:
     """
     Decorator to send telemetry from Bot module
@@ -0,0 +1,40 @@
+import logging
+
+from rich.logging import RichHandler
+
+import settings
+from common.sender import ScheduledSendClient
+from plugins.Announce.worker import AnnounceWorker
+
+
+async def run_worker(client: ScheduledSendClient) -> None:
+    async with client:
+        await AnnounceWorker(client).run()
+
+
+def main() -> None:
+    """
+    Separate process sending announcements along with the bot,
+    it doesn't handle updates, the bot does.
+    """
+    logging.basicConfig(level=settings.LOG_LEVEL,
+                        format='%(name)s - %(message)s',
+                        handlers=[RichHandler(rich_tracebacks=True)])
+    logging.getLogger('asyncio_redis').setLevel(logging.WARNING)
+    logging.getLogger('pyrogram').setLevel(logging.WARNING)
+
+    client = ScheduledSendClient(
+        f'{settings.BOT_NAME}_announce_worker',
+        api_id=settings.API_ID,
+        api_hash=settings.API_HASH,
+        bot_token=settings.BOT_TOKEN,
+        in_memory=True,
+        no_updates=True,
+    )
+
+    logging.getLogger(__name__).info('Starting announce worker of %s...', settings.BOT_NAME)
+    client.run(run_worker(client))
+
+
+if __name__ == '__main__':
+    main()
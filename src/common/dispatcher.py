@@ -0,0 +1,245 @@
+import asyncio
+import collections
+import inspect
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import pyrogram
+from pyrogram.dispatcher import Dispatcher
+from pyrogram.handlers import RawUpdateHandler
+
+import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class DispatcherWorkerStats:
+    handled: int = field(default=0)
+    busy_s: float = field(default=0)  # time spent in handlers since last measurement
+    busy_since: Optional[float] = field(default=None)  # start of the handler which is running now
+    measured_at: float = field(default_factory=time.monotonic)
+
+    def pop_utilization(self) -> float:
+        """
+        Returns share of time (in percents) the worker spent in handlers since
+        the previous call.
+        """
+        now = time.monotonic()
+        busy_s = self.busy_s
+        if self.busy_since is not None:
+            busy_s += now - self.busy_since
+            self.busy_since = now
+
+        utilization = 100 * busy_s / (now - self.measured_at) if now > self.measured_at else 0
+
+        self.busy_s = 0
+        self.measured_at = now
+        return min(utilization, 100)
+
+
+class UserOrderedDispatcher(Dispatcher):
+    """
+    Replaces default Pyrogram dispatcher.
+
+    Default dispatcher feeds all updates to a pool of workers from a single queue, so
+    updates of one user can be handled concurrently and out of order, and a few slow
+    handlers occupy all the workers.
+
+    Here each user has a bounded mailbox with pending updates. Worker takes a user whose
+    mailbox is not empty, handles one update and puts the user back to the end of ready
+    queue. So updates of different users are handled in parallel (`Client.workers` at most),
+    while updates of a user are handled strictly one by one.
+    """
+
+    def __init__(self, client: pyrogram.Client, mailbox_size: int = settings.DISPATCHER_MAILBOX_SIZE):
+        super().__init__(client)
+        self.mailbox_size = mailbox_size
+
+        # stats
+        self.dropped = 0
+        self.workers_stats: list[DispatcherWorkerStats] = []
+
+        self._mailboxes: dict[int, collections.deque] = {}
+        self._scheduled_users: set[int] = set()  # users which are in ready queue or being handled
+        self._ready_users: asyncio.Queue = asyncio.Queue()
+        self._router_task: Optional[asyncio.Task] = None
+
+        register_measurement_source(self.get_measurements)
+
+    async def start(self):
+        if self.client.no_updates:
+            return
+
+        self._router_task = self.loop.create_task(self._route_updates())
+
+        for _ in range(self.client.workers):
+            self.locks_list.append(asyncio.Lock())
+            self.workers_stats.append(DispatcherWorkerStats())
+            self.handler_worker_tasks.append(
+                self.loop.create_task(self._user_worker(self.locks_list[-1], self.workers_stats[-1]))
+            )
+
+        log.info('Started %s user ordered HandlerTasks', self.client.workers)
+
+    async def stop(self):
+        if self.client.no_updates:
+            return
+
+        # stop receiving updates first, then workers
+        self.updates_queue.put_nowait(None)
+        await self._router_task
+
+        for _ in self.handler_worker_tasks:
+            self._ready_users.put_nowait(None)
+        for task in self.handler_worker_tasks:
+            await task
+
+        self.handler_worker_tasks.clear()
+        self.workers_stats.clear()
+        self.groups.clear()
+        self._mailboxes.clear()
+        self._scheduled_users.clear()
+
+        log.info('Stopped %s user ordered HandlerTasks', self.client.workers)
+
+    async def _route_updates(self):
+        while True:
+            packet = await self.updates_queue.get()
+
+            if packet is None:
+                break
+
+            user_id = self._get_update_user_id(*packet)
+            mailbox = self._mailboxes.setdefault(user_id, collections.deque())
+
+            if len(mailbox) >= self.mailbox_size:
+                self.dropped += 1
+                log.warning('Mailbox of user #%s is full (%s updates), update is dropped', user_id, len(mailbox))
+                continue
+
+            mailbox.append(packet)
+
+            if user_id not in self._scheduled_users:
+                self._scheduled_users.add(user_id)
+                self._ready_users.put_nowait(user_id)
+
+    async def _user_worker(self, lock: asyncio.Lock, stats: DispatcherWorkerStats):
+        while True:
+            user_id = await self._ready_users.get()
+
+            if user_id is None:
+                break
+
+            mailbox = self._mailboxes[user_id]
+            packet = mailbox.popleft()
+
+            stats.busy_since = time.monotonic()
+            try:
+                await self._handle_packet(packet, lock)
+            finally:
+                stats.busy_s += time.monotonic() - stats.busy_since
+                stats.busy_since = None
+                stats.handled += 1
+
+                if mailbox:
+                    # let other users go first
+                    self._ready_users.put_nowait(user_id)
+                else:
+                    del self._mailboxes[user_id]
+                    self._scheduled_users.discard(user_id)
+
+    async def _handle_packet(self, packet: tuple, lock: asyncio.Lock):
+        """
+        Same as the body of Pyrogram's `Dispatcher.handler_worker`.
+        """
+        try:
+            update, users, chats = packet
+            parser = self.update_parsers.get(type(update), None)
+
+            parsed_update, handler_type = (
+                await parser(update, users, chats)
+                if parser is not None
+                else (None, type(None))
+            )
+
+            async with lock:
+                for group in self.groups.values():
+                    for handler in group:
+                        args = None
+
+                        if isinstance(handler, handler_type):
+                            try:
+                                if await handler.check(self.client, parsed_update):
+                                    args = (parsed_update,)
+                            except Exception as exc:
+                                log.exception(exc)
+                                continue
+
+                        elif isinstance(handler, RawUpdateHandler):
+                            args = (update, users, chats)
+
+                        if args is None:
+                            continue
+
+                        try:
+                            if inspect.iscoroutinefunction(handler.callback):
+                                await handler.callback(self.client, *args)
+                            else:
+                                await self.loop.run_in_executor(
+                                    self.client.executor,
+                                    handler.callback,
+                                    self.client,
+                                    *args
+                                )
+                        except pyrogram.StopPropagation:
+                            raise
+                        except pyrogram.ContinuePropagation:
+                            continue
+                        except Exception as exc:
+                            log.exception(exc)
+
+                        break
+        except pyrogram.StopPropagation:
+            pass
+        except Exception as exc:
+            log.exception(exc)
+
+    @staticmethod
+    def _get_update_user_id(update, users, chats) -> int:
+        """
+        Extracts id of the user (or chat) the raw update belongs to.
+        Updates without sender share the same mailbox with zero id.
+        """
+        # callback queries, inline queries, etc.
+        if user_id := getattr(update, 'user_id', None):
+            return user_id
+
+        if message := getattr(update, 'message', None):
+            for peer in (getattr(message, 'from_id', None), getattr(message, 'peer_id', None)):
+                for peer_id_field in ('user_id', 'chat_id', 'channel_id'):
+                    if peer_id := getattr(peer, peer_id_field, None):
+                        return peer_id
+
+        return 0
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        measurements = get_service_measurements('dispatcher', {
+            MeasurementLabelTypeValue.dispatcher_active_users: len(self._mailboxes),
+            MeasurementLabelTypeValue.dispatcher_dropped_updates: self.dropped,
+            MeasurementLabelTypeValue.dispatcher_pending_updates: sum(len(m) for m in self._mailboxes.values()),
+        })
+        for ind, stats in enumerate(self.workers_stats):
+            measurements.extend(get_service_measurements(f'dispatcher-worker-{ind}', {
+                MeasurementLabelTypeValue.dispatcher_worker_handled_updates: stats.handled,
+                MeasurementLabelTypeValue.dispatcher_worker_utilization: stats.pop_utilization(),
+            }))
+        return measurements
@@ -1,7 +1,8 @@
 import datetime
 import enum
 import logging
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
+from typing import Optional
 
 import settings
 
@@ -37,9 +38,46 @@ class MessagePreferences:
     link_preview: bool = field(default=True)
 
 
+class AnnounceSegmentKind(AutoNameEnum):
+    all = enum.auto()
+    utm = enum.auto()  # users came by utm campaign, value is utm
+    registered = enum.auto()  # users registered within the last days, value is days
+    paid = enum.auto()  # users by paid requests count, value is range like `1-9` or `100-`
+
+
+@dataclass
+class AnnounceSegment:
+    """
+    Part of users an announce is sent to.
+    """
+    kind: str = field(default=AnnounceSegmentKind.all.value)
+    value: str = field(default='')
+
+    @property
+    def code(self) -> str:
+        # short enough for callback data
+        return f'{self.kind}:{self.value}'
+
+    @classmethod
+    def from_code(cls, code: str) -> 'AnnounceSegment':
+        kind, _, value = code.partition(':')
+        return cls(kind=kind, value=value)
+
+
 @dataclass
 class AnnouncePreferences(MessagePreferences):
-    pack_length: float = field(default=settings.ANNOUNCE_PACK_LENGTH)
+    segment: AnnounceSegment = field(default_factory=AnnounceSegment)
+
+    def __post_init__(self):
+        # restore nested dataclass after deserialization
+        if isinstance(self.segment, dict):
+            self.segment = AnnounceSegment(**self.segment)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'AnnouncePreferences':
+        # preferences saved by previous versions may have fields which were removed since (e.g. pack_length)
+        names = {preference.name for preference in fields(cls)}
+        return cls(**{name: value for name, value in data.items() if name in names})
 
 
 @dataclass
@@ -62,20 +100,53 @@ class AnnounceJobStats:
     def spent_time_m(self) -> int:
         return self.spent_time_s // 60
 
-    @property
-    def rate(self) -> int:
-        rate = 60 * (self.sent / self.spent_time_s) if self.spent_time_s else 0
-        return round(rate, 2)
-
     @property
     def sent(self) -> int:
         return self.success + self.blocked + self.failed
 
-    @property
-    def eta(self) -> datetime.datetime:
-        return datetime.datetime.now() + datetime.timedelta(
-            seconds=((self.total - self.sent) // self.rate if self.rate else 0)
-        )
+
+@dataclass
+class AnnounceJobState:
+    """
+    Persisted state of announce job, it's enough to resume the job after restart.
+    """
+    job_id: str
+    chat_id: int  # chat with announce message and stats message
+    message_id: int
+    stats_message_id: int
+    preferences: AnnouncePreferences
+    stats: AnnounceJobStats  # start time and total, progress is kept by shards
+
+    shards: int = field(default=0)  # set when recipients are saved, so shards can be run
+    is_finished: bool = field(default=False)  # all shards are done or the job is cancelled
+
+    def __post_init__(self):
+        # restore nested dataclasses after deserialization
+        if isinstance(self.preferences, dict):
+            self.preferences = AnnouncePreferences.from_dict(self.preferences)
+        if isinstance(self.stats, dict):
+            self.stats = AnnounceJobStats(**self.stats)
+
+
+@dataclass
+class AnnounceShardState:
+    """
+    Persisted progress of one shard of announce job, shards are run by different workers.
+    """
+    job_id: str
+    shard: int
+    stats: AnnounceJobStats = field(default_factory=AnnounceJobStats)
+
+    # recipients are announced in order of user_id
+    cursor: int = field(default=0)  # all recipients up to this user_id are done
+    done_ids: list[int] = field(default_factory=list)  # done recipients after cursor
+    rate: float = field(default=0)  # current messages per second
+    best_rate: Optional[float] = field(default=None)
+    is_finished: bool = field(default=False)
+
+    def __post_init__(self):
+        if isinstance(self.stats, dict):
+            self.stats = AnnounceJobStats(**self.stats)
 
 
 class UserRoleBit(enum.IntEnum):
@@ -103,6 +174,15 @@ class ThirdPartyAPIMediaType(enum.IntEnum):
     audio = 3
 
 
+class MediaSendStrategy(AutoNameEnum):
+    """
+    Defines how media is sent to Telegram.
+    """
+    url = 'url'  # Telegram downloads media by URL
+    relay = 'relay'  # bot downloads media and uploads it to Telegram
+    document = 'document'  # same as relay, but media is sent as a file
+
+
 class ThirdPartyAPISource(AutoNameEnum):
     """
     Defines available media types from third party APIs.
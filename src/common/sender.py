@@ -0,0 +1,311 @@
+import asyncio
+import contextlib
+import contextvars
+import enum
+import functools
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+import pyrogram
+from pyrogram import errors, raw
+
+import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
+
+log = logging.getLogger(__name__)
+
+
+class SendPriority(enum.IntEnum):
+    """
+    The lower value, the sooner message is sent.
+    """
+    interactive = 0  # replies to users
+    monitoring = 1
+    announce = 2
+    status = 3  # progress reports, e.g. announce status edits
+
+
+# priority of sends performed in the current task, interactive by default
+send_priority: contextvars.ContextVar[SendPriority] = contextvars.ContextVar(
+    'send_priority', default=SendPriority.interactive)
+
+
+@contextlib.contextmanager
+def sending_priority(priority: SendPriority) -> Iterator[None]:
+    token = send_priority.set(priority)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+@dataclass
+class TokenBucket:
+    rate: float  # tokens per second
+    capacity: float
+    tokens: float = field(default=0)
+    updated_at: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.tokens = self.capacity
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait_s(self, now: float) -> float:
+        """
+        Returns time until the next token is available.
+        """
+        self.refill(now)
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def reserve(self, now: float) -> float:
+        """
+        Takes a token in advance (balance may become negative)
+        and returns time the caller has to wait for it.
+        """
+        wait_s = self.get_wait_s(now)
+        self.tokens -= 1
+        return wait_s
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class SendPriorityStats:
+    sent: int = field(default=0)
+    waited_s: float = field(default=0)  # total waiting time of sends since last measurement
+    max_wait_s: float = field(default=0)
+    measured_sends: int = field(default=0)
+
+    def add(self, wait_s: float) -> None:
+        self.sent += 1
+        self.measured_sends += 1
+        self.waited_s += wait_s
+        self.max_wait_s = max(self.max_wait_s, wait_s)
+
+    def pop_wait_ms(self) -> tuple[float, float]:
+        """
+        Returns average and max waiting time since the previous call.
+        """
+        avg_wait_ms = 1000 * self.waited_s / self.measured_sends if self.measured_sends else 0
+        max_wait_ms = 1000 * self.max_wait_s
+
+        self.waited_s = 0
+        self.max_wait_s = 0
+        self.measured_sends = 0
+        return avg_wait_ms, max_wait_ms
+
+
+class OutboundSendScheduler:
+    """
+    Single gate for all messages sent by the bot.
+
+    Telegram limits bots to ~30 messages per second in total and ~1 message per second
+    per chat, otherwise FloodWait is raised. Each send waits for a token of its chat bucket,
+    then for a token of the global bucket. Global tokens are given to waiting sends
+    by priority: interactive replies go before monitoring, monitoring before announces.
+
+    FloodWait of an interactive send pauses all sends for the given time, FloodWait
+    of a monitoring send pauses monitoring sends only, then the send is retried.
+    Waits longer than `max_flood_wait_s` are not retried, the error is raised to the caller.
+    Announce and status sends are neither retried nor pause other sends: announce pauses
+    and adapts its rate to each flood wait itself, status callers skip the report instead.
+    """
+
+    def __init__(self, global_rate: float = settings.SEND_GLOBAL_RATE,
+                 global_burst: int = settings.SEND_GLOBAL_BURST,
+                 chat_rate: float = settings.SEND_CHAT_RATE,
+                 chat_burst: int = settings.SEND_CHAT_BURST,
+                 flood_retries: int = settings.SEND_FLOOD_RETRIES,
+                 max_flood_wait_s: int = settings.SEND_MAX_FLOOD_WAIT_S,
+                 max_chat_buckets: int = settings.SEND_MAX_CHAT_BUCKETS):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.flood_retries = flood_retries
+        self.max_flood_wait_s = max_flood_wait_s
+        self.max_chat_buckets = max_chat_buckets
+
+        # stats
+        self.flood_waits = 0
+        self.priority_stats = {priority: SendPriorityStats() for priority in SendPriority}
+
+        self._global_bucket = TokenBucket(rate=global_rate, capacity=global_burst)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._flood_wait_until = 0.0  # monotonic time
+        self._priority_flood_wait_until = {priority: 0.0 for priority in SendPriority}
+
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []  # heap of (priority, seq, future)
+        self._waiters_seq = itertools.count()
+        self._chat_waiters = 0  # sends waiting for chat tokens
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+
+        register_measurement_source(self.get_measurements)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters) + self._chat_waiters
+
+    @property
+    def flood_wait_s(self) -> float:
+        return max(0.0, self._flood_wait_until - time.monotonic())
+
+    async def send(self, chat_id: int, func: Callable[[], Awaitable[Any]],
+                   priority: SendPriority = SendPriority.interactive) -> Any:
+        """
+        Performs `func` (a call to Telegram API) when limits allow.
+        """
+        for attempt in itertools.count():
+            started_at = time.monotonic()
+            await self._acquire(chat_id, priority)
+            self.priority_stats[priority].add(time.monotonic() - started_at)
+
+            try:
+                return await func()
+            except errors.FloodWait as exc:
+                self.flood_waits += 1
+                if priority in (SendPriority.announce, SendPriority.status):
+                    raise
+
+                if priority == SendPriority.interactive:
+                    self.pause(exc.value)
+                else:
+                    self.pause(exc.value, priority=priority)
+
+                if attempt >= self.flood_retries or exc.value > self.max_flood_wait_s:
+                    raise
+
+                log.warning('Flood wait of %s sec on sending to %s, retrying...', exc.value, chat_id)
+
+    def pause(self, wait_s: float, priority: Optional[SendPriority] = None) -> None:
+        """
+        Stops sends of `priority` (all sends by default) for `wait_s` seconds.
+        """
+        if priority is None:
+            self._flood_wait_until = max(self._flood_wait_until, time.monotonic() + wait_s)
+        else:
+            self._priority_flood_wait_until[priority] = max(
+                self._priority_flood_wait_until[priority], time.monotonic() + wait_s)
+
+    async def _acquire(self, chat_id: int, priority: SendPriority) -> None:
+        if (pause_s := self._priority_flood_wait_until[priority] - time.monotonic()) > 0:
+            await asyncio.sleep(pause_s)
+
+        if chat_wait_s := self._get_chat_bucket(chat_id).reserve(time.monotonic()):
+            self._chat_waiters += 1
+            try:
+                await asyncio.sleep(chat_wait_s)
+            finally:
+                self._chat_waiters -= 1
+
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._waiters_seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _pump(self) -> None:
+        """
+        Gives global tokens to waiting sends, the most prioritized first.
+        """
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            if wait_s := max(self._flood_wait_until - now, self._global_bucket.get_wait_s(now)):
+                await asyncio.sleep(wait_s)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # waiting send was cancelled
+                continue
+
+            self._global_bucket.tokens -= 1
+            future.set_result(None)
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        if not (bucket := self._chat_buckets.get(chat_id)):
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                self._prune_chat_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate=self.chat_rate, capacity=self.chat_burst)
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        # full bucket is the same as a new one
+        now = time.monotonic()
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.is_full(now):
+                del self._chat_buckets[chat_id]
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        measurements = get_service_measurements('sender', {
+            MeasurementLabelTypeValue.sender_flood_wait_s: self.flood_wait_s,
+            MeasurementLabelTypeValue.sender_flood_waits: self.flood_waits,
+            MeasurementLabelTypeValue.sender_queue_depth: self.queue_depth,
+        })
+        for priority, stats in self.priority_stats.items():
+            avg_wait_ms, max_wait_ms = stats.pop_wait_ms()
+            measurements.extend(get_service_measurements(f'sender-{priority.name}', {
+                MeasurementLabelTypeValue.sender_avg_wait_ms: avg_wait_ms,
+                MeasurementLabelTypeValue.sender_max_wait_ms: max_wait_ms,
+                MeasurementLabelTypeValue.sender_sent: stats.sent,
+            }))
+        return measurements
+
+
+outbound_scheduler = OutboundSendScheduler()
+
+
+class ScheduledSendClient(pyrogram.Client):
+    """
+    Pyrogram client which passes all outgoing messages through `outbound_scheduler`,
+    so every send path (replies, monitoring, announces) shares Telegram limits.
+    Priority of sends is taken from `send_priority` context variable.
+    """
+    scheduled_queries = (
+        raw.functions.messages.EditMessage,
+        raw.functions.messages.ForwardMessages,
+        raw.functions.messages.SendMedia,
+        raw.functions.messages.SendMessage,
+        raw.functions.messages.SendMultiMedia,
+    )
+
+    async def invoke(self, query, *args, **kwargs):
+        if not isinstance(query, self.scheduled_queries):
+            return await super().invoke(query, *args, **kwargs)
+
+        # flood waits are handled by scheduler instead of sleeping inside the session
+        kwargs['sleep_threshold'] = 0
+
+        return await outbound_scheduler.send(
+            chat_id=self._get_query_chat_id(query),
+            func=functools.partial(super().invoke, query, *args, **kwargs),
+            priority=send_priority.get(),
+        )
+
+    @staticmethod
+    def _get_query_chat_id(query) -> int:
+        peer = getattr(query, 'peer', None) or getattr(query, 'to_peer', None)
+        for peer_id_field in ('user_id', 'chat_id', 'channel_id'):
+            if peer_id := getattr(peer, peer_id_field, None):
+                return peer_id
+        return 0
@@ -1,7 +1,6 @@
 import asyncio
 import datetime
 import logging
-import re
 import time
 from random import randint
 
@@ -79,15 +78,9 @@ async def perform_func_with_error_handling(func, *args, **kwargs):
     #   log.exception('Failed to parse message: %s', exc.MESSAGE)
     except errors.FloodWait as exc:
         # Telegram says: [420 FLOOD_WAIT_X] - A wait of 37 seconds is required (caused by "messages.EditMessage")
-        # TODO parse
-        log.warning('Flood control: %s | %s | %s', exc.MESSAGE, exc.CODE, exc.NAME)
-        log.warning('Flood control exc: %s -- %s', str(exc), dir(exc))
-        # DEBUG
-        try:
-            log.warning('Flood control parsed: %s', re.findall('[0-9]+', str(exc))[-1:])
-        except Exception:
-            pass
-        await _save_global_flood_delay(delay=settings.TELEGRAM_FLOOD_CONTROL_PAUSE_S)
+        # the wait is parsed by Pyrogram into exc.value
+        log.warning('Flood control: wait of %s sec is required | %s', exc.value, exc.MESSAGE)
+        await _save_global_flood_delay(delay_s=exc.value or settings.TELEGRAM_FLOOD_CONTROL_PAUSE_S)
         await _pause_announce()
         await notify_admin('Telegram flood warning')
 
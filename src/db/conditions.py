@@ -0,0 +1,42 @@
+import datetime
+from typing import Optional
+
+import settings
+from common.models import AnnounceSegment, AnnounceSegmentKind
+
+
+def get_announce_conditions(segment: Optional[AnnounceSegment] = None) -> tuple[str, list]:
+    """
+    Returns SQL conditions of users to announce and their positional values.
+    Users to announce are covered by partial index `users_announce_idx`,
+    segments have partial indexes with the same predicate, e.g. GIN index of utm,
+    so Postgres combines them instead of scanning the table.
+    """
+    conditions = [
+        'blocked = false',
+        'announce_allowed = true',
+        '(last_announced IS NULL OR last_announced < $1)',
+    ]
+    values: list = [
+        datetime.datetime.now() - datetime.timedelta(hours=settings.ANNOUNCE_DELAY_BETWEEN_ANNOUNCES_H),
+    ]
+
+    def add_condition(condition: str, value) -> None:
+        values.append(value)
+        conditions.append(condition.format(f'${len(values)}'))
+
+    # segment kind is kept as plain string
+    kind, segment_value = (AnnounceSegmentKind(segment.kind), segment.value) if segment else (AnnounceSegmentKind.all, '')
+    match kind:
+        case AnnounceSegmentKind.utm:
+            # `@>` is supported by GIN index, `= ANY(utm)` isn't
+            add_condition('utm @> {}::text[]', [segment_value])
+        case AnnounceSegmentKind.registered:
+            add_condition('created_at >= {}', datetime.datetime.now() - datetime.timedelta(days=int(segment_value)))
+        case AnnounceSegmentKind.paid:
+            min_count, _, max_count = segment_value.partition('-')
+            add_condition('paid_requests_count >= {}', int(min_count))
+            if max_count:
+                add_condition('paid_requests_count <= {}', int(max_count))
+
+    return ' AND '.join(conditions), values
@@ -1,16 +1,30 @@
 import asyncio
 import datetime
 import logging
+from typing import AsyncIterator, Optional
 
 import tortoise
 from tortoise import Tortoise
-from tortoise.expressions import Q
 
 import settings
+from common.models import AnnounceSegment
+from db.conditions import get_announce_conditions
 from db.models import Users
 
 log = logging.getLogger(__name__)
 
+USERS_INDEXES_SQL = '''
+    CREATE INDEX IF NOT EXISTS users_announce_idx ON users (user_id) INCLUDE (last_announced)
+    WHERE blocked = false AND announce_allowed = true;
+    -- announce segments
+    CREATE INDEX IF NOT EXISTS users_announce_utm_idx ON users USING GIN (utm)
+    WHERE blocked = false AND announce_allowed = true;
+    CREATE INDEX IF NOT EXISTS users_announce_created_at_idx ON users (created_at)
+    WHERE blocked = false AND announce_allowed = true;
+    CREATE INDEX IF NOT EXISTS users_announce_paid_requests_count_idx ON users (paid_requests_count)
+    WHERE blocked = false AND announce_allowed = true;
+'''
+
 
 class DatabaseConnector:
     def __init__(self):
@@ -24,6 +38,8 @@ class DatabaseConnector:
         # Generate the schema
         # safe=True - generate schema if not exists in db
         await Tortoise.generate_schemas(safe=True)
+        # indexes which can't be described by model
+        await Tortoise.get_connection('default').execute_script(USERS_INDEXES_SQL)
 
     def _sync_init(self):
         loop = asyncio.new_event_loop()
@@ -64,12 +80,21 @@ class DatabaseConnector:
     async def user_toggle_block(self, user_id: int, state: bool = True) -> None:
         await Users.filter(user_id=user_id).update(blocked=state)
 
-    async def user_was_announced(self, user_id: int, date: datetime.datetime = None) -> None:
+    async def user_was_announced(self, user_id: int, date: Optional[datetime.datetime] = None) -> None:
         if not date:
             date = tortoise.timezone.now()
 
         await Users.filter(user_id=user_id).update(last_announced=date)
 
+    async def users_toggle_block(self, user_ids: list[int], state: bool = True) -> None:
+        await self._execute_query('UPDATE users SET blocked = $1 WHERE user_id = ANY($2)', [state, user_ids])
+
+    async def users_were_announced(self, user_ids: list[int], date: Optional[datetime.datetime] = None) -> None:
+        if not date:
+            date = tortoise.timezone.now()
+
+        await self._execute_query('UPDATE users SET last_announced = $1 WHERE user_id = ANY($2)', [date, user_ids])
+
     async def get_users_count(self) -> int:
         return await Users.filter(blocked=False).all().count()
 
@@ -79,13 +104,49 @@ class DatabaseConnector:
     async def get_user(self, user_id: int) -> Users:
         return await Users.filter(user_id=user_id).first()
 
-    async def get_user_ids_for_announce(self) -> list[int]:
-        users = await Users.filter(Q(blocked=False) &
-                                   Q(announce_allowed=True) &
-                                   Q(Q(last_announced=None) | Q(last_announced__lt=datetime.datetime.now() -
-                                                                                   datetime.timedelta(
-                                                                                       hours=settings.ANNOUNCE_DELAY_BETWEEN_ANNOUNCES_H)))).all()
-        return [user.user_id for user in users]
+    @staticmethod
+    async def _execute_query(query: str, values: list) -> None:
+        # set-based queries, Tortoise builds `IN (...)` with a parameter per value instead
+        await Tortoise.get_connection('default').execute_query(query, values)
+
+    async def get_users_count_for_announce(self, segment: Optional[AnnounceSegment] = None) -> int:
+        conditions, values = get_announce_conditions(segment)
+        rows = await Tortoise.get_connection('default').execute_query_dict(
+            f'SELECT count(*) AS users_count FROM users WHERE {conditions}', values)
+        return rows[0]['users_count']
+
+    async def iterate_user_ids_for_announce(
+            self, segment: Optional[AnnounceSegment] = None, after_user_id: int = 0,
+            batch_size: int = settings.ANNOUNCE_RECIPIENTS_BATCH_SIZE) -> AsyncIterator[int]:
+        """
+        Streams ids of users to announce, ordered by user_id.
+        Only ids are fetched, by pages with keyset pagination (`user_id > last fetched id`),
+        so memory doesn't depend on number of users.
+        """
+        conditions, values = get_announce_conditions(segment)
+        query = (f'SELECT user_id FROM users WHERE {conditions} AND user_id > ${len(values) + 1} '
+                 f'ORDER BY user_id LIMIT {int(batch_size)}')
+
+        while True:
+            rows = await Tortoise.get_connection('default').execute_query_dict(query, [*values, after_user_id])
+            user_ids = [row['user_id'] for row in rows]
+
+            for user_id in user_ids:
+                yield user_id
+
+            if len(user_ids) < batch_size:
+                return
+            after_user_id = user_ids[-1]
+
+    async def get_utm_campaigns_for_announce(self, limit: int) -> list[str]:
+        """
+        The most popular utm campaigns among users to announce.
+        """
+        conditions, values = get_announce_conditions()
+        rows = await Tortoise.get_connection('default').execute_query_dict(
+            f'SELECT utm_campaign FROM users, unnest(utm) AS utm_campaign WHERE {conditions} '
+            f'GROUP BY utm_campaign ORDER BY count(*) DESC LIMIT {int(limit)}', values)
+        return [row['utm_campaign'] for row in rows]
 
 
 database_connector = DatabaseConnector()
@@ -4,6 +4,7 @@ from typing import Any, List
 
 from pyrogram.types import Message
 
+import settings
 from exceptions import (
     AccountIsPrivate,
     AccountNotExist,
@@ -12,6 +13,7 @@ from exceptions import (
 )
 from models import Module
 
+from .cache import answer_cache
 from .clients import (
     BaseThirdPartyAPIClient,
     InstagramRapidAPIClient,
@@ -43,6 +45,9 @@ class BaseHelper:
     """
     _search_results = None  # cache for obtained search results
 
+    # how long search results can be reused by other requests, also limited by media URLs expiration
+    cache_max_ttl_s = settings.ANSWER_CACHE_MAX_TTL_S
+
     clients = (
         InstagramRapidAPIClient,
         TikTokRapidAPIClient,
@@ -75,6 +80,10 @@ class BaseHelper:
     @property
     async def search_results(self) -> List[Any]:
         # update results if there is no cache
+        if not self._search_results:
+            cache_key = (self._search_method, *self.keyword)
+            self._search_results = answer_cache.get(cache_key)
+
         if not self._search_results:
             # probably iterator would be better here, but we need to know if exception is raised
             # at the beginning of loop
@@ -84,12 +93,40 @@ class BaseHelper:
                 if self._search_results:
                     break  # if we obtained data, do not continue w/ other clients
 
+            # answer is truthy even without items, empty answer may be transient, so it isn't cached
+            if self._search_results and self._search_results.items:
+                answer_cache.save(
+                    key=cache_key,
+                    answer=self._search_results,
+                    refresh=self._get_refresh_func(),
+                    max_ttl_s=self.cache_max_ttl_s,
+                )
+
         if not self._search_results:
             # all providers failed to get data
             raise EmptyResultsException(f'No results for {self.keyword}')
 
         return self._search_results
 
+    def _get_refresh_func(self):
+        """
+        Returns coroutine function to repeat the search in background,
+        i.e. without any replies to user.
+        """
+        clients = self.suitable_clients
+        search_method = self._search_method
+        keyword = self.keyword
+
+        async def refresh() -> Any:
+            for client in clients:
+                try:
+                    if (result := await getattr(client(), search_method)(*keyword)) and result.items:
+                        return result
+                except (EmptyResultsException, ThirdPartyApiException) as exc:
+                    log.debug('Failed to refresh `%s` with %s: %s', search_method, client.api_provider_name, exc)
+
+        return refresh
+
     async def _search_with_helper(self, client: BaseThirdPartyAPIClient) -> List[Any]:
         try:
             search_method = getattr(client(), self._search_method)
@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Hashable, Optional
+
+import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
+from common.models import ThirdPartyAPIClientAnswer
+from helpers.cdn import get_answer_ttl_s
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    answer: ThirdPartyAPIClientAnswer
+    refresh: Callable[[], Awaitable[Optional[ThirdPartyAPIClientAnswer]]]  # re-requests the answer
+    max_ttl_s: float
+    expires_at: float = field(default=0)
+    was_hit: bool = field(default=False)  # whether the answer was used since it was saved
+
+
+class ThirdPartyAPIAnswerCache:
+    """
+    In-memory cache of third-party API answers.
+
+    Media URLs in answers are signed by CDN and expire, so each answer is kept
+    until its first URL expires (minus safety margin), but no longer than `max_ttl_s`
+    given on save (e.g. stories are changed much more often than their URLs expire).
+
+    Answers which are close to expiration are refreshed in background if they were
+    used since the last refresh, others are left to expire. Up to `refresh_concurrency`
+    answers are refreshed at once.
+    """
+
+    def __init__(self, size: int = settings.ANSWER_CACHE_SIZE,
+                 default_ttl_s: int = settings.ANSWER_CACHE_DEFAULT_TTL_S,
+                 refresh_ahead_s: int = settings.ANSWER_CACHE_REFRESH_AHEAD_S,
+                 refresh_concurrency: int = settings.ANSWER_CACHE_REFRESH_CONCURRENCY):
+        self.size = size
+        self.default_ttl_s = default_ttl_s
+        self.refresh_ahead_s = refresh_ahead_s
+        self.refresh_concurrency = refresh_concurrency
+
+        # stats
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+
+        self._answers: collections.OrderedDict[Hashable, CachedAnswer] = collections.OrderedDict()  # LRU first
+
+        register_measurement_source(self.get_measurements)
+
+    def get(self, key: Hashable) -> Optional[ThirdPartyAPIClientAnswer]:
+        if not (cached := self._answers.get(key)) or cached.expires_at < time.time():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        cached.was_hit = True
+        self._answers.move_to_end(key)
+        return cached.answer
+
+    def save(self, key: Hashable, answer: ThirdPartyAPIClientAnswer,
+             refresh: Callable[[], Awaitable[Optional[ThirdPartyAPIClientAnswer]]], max_ttl_s: float) -> None:
+        cached = CachedAnswer(answer=answer, refresh=refresh, max_ttl_s=max_ttl_s)
+        self._set_expiration(cached)
+
+        self._answers[key] = cached
+        self._answers.move_to_end(key)
+        while len(self._answers) > self.size:
+            self._answers.popitem(last=False)
+
+    async def refresh_expiring(self) -> None:
+        now = time.time()
+        expiring = []
+
+        for key, cached in list(self._answers.items()):
+            if cached.expires_at - now > self.refresh_ahead_s:
+                continue
+
+            if not cached.was_hit:
+                if cached.expires_at < now:
+                    self._answers.pop(key, None)
+                continue
+
+            expiring.append((key, cached))
+
+        semaphore = asyncio.Semaphore(self.refresh_concurrency)
+
+        async def _refresh_with_limit(key: Hashable, cached: CachedAnswer) -> None:
+            async with semaphore:
+                await self._refresh(key, cached)
+
+        await asyncio.gather(*(_refresh_with_limit(key, cached) for key, cached in expiring))
+
+    async def _refresh(self, key: Hashable, cached: CachedAnswer) -> None:
+        try:
+            answer = await cached.refresh()
+        except Exception as exc:
+            log.warning('Failed to refresh cached answer for %s: %s', key, exc)
+            answer = None
+
+        if not answer or not answer.items:
+            # keep the old answer until it expires
+            if cached.expires_at < time.time():
+                self._answers.pop(key, None)
+            return
+
+        cached.answer = answer
+        cached.was_hit = False
+        self._set_expiration(cached)
+        self.refreshed += 1
+        log.debug('Refreshed cached answer for %s, expires in %s sec', key, cached.expires_at - time.time())
+
+    def _set_expiration(self, cached: CachedAnswer) -> None:
+        ttl_s = min(get_answer_ttl_s(cached.answer, self.default_ttl_s), cached.max_ttl_s)
+        cached.expires_at = time.time() + ttl_s
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        return get_service_measurements('answer_cache', {
+            MeasurementLabelTypeValue.answer_cache_hits: self.hits,
+            MeasurementLabelTypeValue.answer_cache_misses: self.misses,
+            MeasurementLabelTypeValue.answer_cache_refreshed: self.refreshed,
+            MeasurementLabelTypeValue.answer_cache_size: len(self._answers),
+        })
+
+
+answer_cache = ThirdPartyAPIAnswerCache()
@@ -0,0 +1,50 @@
+import datetime
+import logging
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import settings
+from common.models import ThirdPartyAPIClientAnswer
+
+log = logging.getLogger(__name__)
+
+
+def get_url_expires_at(url: str) -> Optional[datetime.datetime]:
+    """
+    CDN media URLs are signed and stop working after some time.
+    Expiration time is a part of URL query:
+        Instagram: https://scontent.cdninstagram.com/v/t51.2885-15/...jpg?...&oe=64A7C53F&...
+            (`oe` is hex unix timestamp)
+        TikTok: https://v16-webapp.tiktok.com/.../?...&expire=1688644151&...
+            (`expire` or `x-expires` is unix timestamp)
+    Returns None if URL has no expiration mark.
+    """
+    query = parse_qs(urlsplit(url).query)
+
+    try:
+        if oe := query.get('oe'):
+            return datetime.datetime.fromtimestamp(int(oe[0], 16))
+        for key in ('x-expires', 'expire'):
+            if expires := query.get(key):
+                return datetime.datetime.fromtimestamp(int(expires[0]))
+    except (ValueError, OverflowError, OSError) as exc:
+        log.warning('Failed to parse expiration time of %s: %s', url, exc)
+
+    return None
+
+
+def get_url_ttl_s(url: str, default_ttl_s: float, margin_s: float = settings.CDN_URL_EXPIRY_MARGIN_S) -> float:
+    """
+    Returns number of seconds URL can be safely cached for,
+    i.e. time until URL expiration minus safety margin.
+    """
+    if not (expires_at := get_url_expires_at(url)):
+        return default_ttl_s
+    return max((expires_at - datetime.datetime.now()).total_seconds() - margin_s, 0)
+
+
+def get_answer_ttl_s(answer: ThirdPartyAPIClientAnswer, default_ttl_s: float) -> float:
+    """
+    Answer can be cached until the first of its media URLs expires.
+    """
+    return min((get_url_ttl_s(item.media_url, default_ttl_s) for item in answer.items), default=default_ttl_s)
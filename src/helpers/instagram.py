@@ -1,5 +1,6 @@
 import logging
 
+import settings
 from exceptions import WrongInputException
 from .base import BaseHelper
 
@@ -8,6 +9,7 @@ log = logging.getLogger(__name__)
 
 class InstagramUserStoriesParserHelper(BaseHelper):
     _search_method = 'get_instagram_user_stories'
+    cache_max_ttl_s = settings.ANSWER_CACHE_FEED_MAX_TTL_S
 
     @property
     def keyword(self):
@@ -32,6 +34,7 @@ class InstagramUserStoriesParserHelper(BaseHelper):
 
 class InstagramSelectedUserStoryParserHelper(BaseHelper):
     _search_method = 'get_instagram_selected_story'
+    cache_max_ttl_s = settings.ANSWER_CACHE_FEED_MAX_TTL_S
 
     @property
     def keyword(self):
@@ -0,0 +1,152 @@
+import asyncio
+import collections
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import aiohttp
+
+import settings
+from common.models import MediaSendStrategy, ThirdPartyAPIMediaItem, ThirdPartyAPIMediaType
+from helpers.cdn import get_url_ttl_s
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+@dataclass
+class MediaProbe:
+    content_length: Optional[int] = field(default=None)  # None if CDN didn't tell
+    content_type: str = field(default='')
+    send_strategy: MediaSendStrategy = field(default=MediaSendStrategy.url)
+
+
+class MediaProber:
+    """
+    Checks size and type of media files on CDN before sending them to Telegram,
+    so the way of sending is chosen in advance instead of finding it out from errors:
+    - small files of supported types are sent by URL (Telegram downloads them itself)
+    - files too big to be sent by URL are relayed, i.e. downloaded and uploaded by the bot
+    - files of unsupported types are relayed and sent as documents,
+      generic or missing content type (CDN default) is taken as the type of media item
+
+    Media items of one result are probed concurrently. Probes are cached by URL
+    until the URL expires.
+    """
+    url_content_types = {
+        ThirdPartyAPIMediaType.photo: ('image/jpeg', 'image/png'),
+        ThirdPartyAPIMediaType.video: ('video/mp4',),
+        ThirdPartyAPIMediaType.audio: ('audio/mpeg', 'audio/mp4', 'audio/x-m4a'),
+    }
+    # aiohttp reports missing Content-Type as application/octet-stream
+    generic_content_types = ('', 'application/octet-stream', 'binary/octet-stream')
+
+    def __init__(self, cache_size: int = settings.MEDIA_PROBE_CACHE_SIZE,
+                 cache_ttl_s: int = settings.MEDIA_PROBE_CACHE_TTL_S,
+                 concurrency: int = settings.MEDIA_PROBE_CONCURRENCY,
+                 timeout_s: float = settings.MEDIA_PROBE_TIMEOUT_S):
+        self.cache_size = cache_size
+        self.cache_ttl_s = cache_ttl_s
+        self.concurrency = concurrency
+        self.timeout_s = timeout_s
+
+        # url -> (probe, monotonic expiration time), LRU first
+        self._cache: collections.OrderedDict[str, tuple[MediaProbe, float]] = collections.OrderedDict()
+
+    def open_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout_s))
+
+    async def probe_items(self, items: list[ThirdPartyAPIMediaItem]) -> list[MediaProbe]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.open_session() as session:
+            async def _probe_with_limit(item: ThirdPartyAPIMediaItem) -> MediaProbe:
+                async with semaphore:
+                    return await self.probe_item(item, session=session)
+
+            return list(await asyncio.gather(*(_probe_with_limit(item) for item in items)))
+
+    async def probe_item(self, item: ThirdPartyAPIMediaItem, session: aiohttp.ClientSession) -> MediaProbe:
+        if cached := self._get_cached(item.media_url):
+            return cached
+
+        try:
+            content_length, content_type = await self._request_metadata(item.media_url, session)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            # let Telegram try to fetch it, as it was before probing
+            log.warning('Failed to probe %s: %s', item.media_url, exc)
+            return MediaProbe()
+
+        probe = MediaProbe(
+            content_length=content_length,
+            content_type=content_type,
+            send_strategy=self._get_send_strategy(item.media_type, content_length, content_type),
+        )
+        log.debug('Probed %s: %s', item.media_url, probe)
+
+        self._save_cached(item.media_url, probe)
+        return probe
+
+    @staticmethod
+    async def _request_metadata(url: str, session: aiohttp.ClientSession) -> tuple[Optional[int], str]:
+        async with session.head(url, allow_redirects=True) as res:
+            if res.status == 200:
+                return res.content_length, res.content_type
+
+        # some CDNs don't support HEAD, so request the first byte only
+        async with session.get(url, headers={'Range': 'bytes=0-0'}) as res:
+            res.raise_for_status()
+            content_length = None
+            if content_range := res.headers.get('Content-Range'):
+                # bytes 0-0/12345
+                total = content_range.rsplit('/', 1)[-1]
+                content_length = int(total) if total.isdigit() else None
+            elif res.status == 200:
+                content_length = res.content_length
+            return content_length, res.content_type
+
+    def _get_send_strategy(self, media_type: ThirdPartyAPIMediaType,
+                           content_length: Optional[int], content_type: str) -> MediaSendStrategy:
+        if content_length is None:
+            return MediaSendStrategy.url
+
+        if content_length > settings.MEDIA_RELAY_MAX_FILE_MB * MB:
+            # too big to relay, nothing to do but try by URL
+            return MediaSendStrategy.url
+
+        if (content_type not in self.generic_content_types
+                and content_type not in self.url_content_types.get(media_type, ())):
+            return MediaSendStrategy.document
+
+        if media_type == ThirdPartyAPIMediaType.photo:
+            if content_length > settings.TELEGRAM_MAX_PHOTO_SIZE_MB * MB:
+                return MediaSendStrategy.document
+            if content_length > settings.TELEGRAM_MAX_URL_PHOTO_SIZE_MB * MB:
+                return MediaSendStrategy.relay
+        elif content_length > settings.TELEGRAM_MAX_URL_FILE_SIZE_MB * MB:
+            return MediaSendStrategy.relay
+
+        return MediaSendStrategy.url
+
+    def _get_cached(self, url: str) -> Optional[MediaProbe]:
+        if not (cached := self._cache.get(url)):
+            return None
+
+        probe, expires_at = cached
+        if expires_at < time.monotonic():
+            del self._cache[url]
+            return None
+
+        self._cache.move_to_end(url)
+        return probe
+
+    def _save_cached(self, url: str, probe: MediaProbe) -> None:
+        self._cache[url] = (probe, time.monotonic() + get_url_ttl_s(url, default_ttl_s=self.cache_ttl_s))
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+media_prober = MediaProber()
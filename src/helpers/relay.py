@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import contextlib
+import hashlib
+import logging
+import pathlib
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
+from common.models import ThirdPartyAPIMediaType
+
+log = logging.getLogger(__name__)
+
+
+class MediaRelayCache:
+    """
+    Bounded on-disk LRU cache of media files downloaded from CDN.
+
+    It's used to relay media to Telegram when Telegram can't fetch it by URL:
+    file is streamed to disk by chunks (i.e. it's never loaded to memory entirely)
+    and uploaded from there.
+
+    Files are keyed by URL path without query, so re-signed URLs of the same media
+    hit the same file. Concurrent requests of the same media share one download.
+    Files which are being downloaded or uploaded at the moment are never evicted,
+    so the cache may exceed its size until they're released.
+    """
+    default_suffixes = {
+        ThirdPartyAPIMediaType.photo: '.jpg',
+        ThirdPartyAPIMediaType.video: '.mp4',
+        ThirdPartyAPIMediaType.audio: '.mp3',
+    }
+
+    def __init__(self, path: str = settings.MEDIA_RELAY_CACHE_DIR,
+                 max_size_mb: int = settings.MEDIA_RELAY_CACHE_MAX_MB,
+                 max_file_size_mb: int = settings.MEDIA_RELAY_MAX_FILE_MB,
+                 chunk_size_kb: int = settings.MEDIA_RELAY_CHUNK_SIZE_KB):
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_file_size = max_file_size_mb * 1024 * 1024
+        self.chunk_size = chunk_size_kb * 1024
+
+        # stats
+        self.hits = 0
+        self.misses = 0
+        self.shared_downloads = 0
+
+        self._path = pathlib.Path(path)
+        self._files: collections.OrderedDict[str, int] = collections.OrderedDict()  # name -> size, LRU first
+        self._pinned: collections.Counter[str] = collections.Counter()  # name -> number of opens in progress
+        self._downloads: dict[str, asyncio.Task] = {}  # name -> download in progress
+
+        self._load()
+        register_measurement_source(self.get_measurements)
+
+    @property
+    def size(self) -> int:
+        return sum(self._files.values())
+
+    @contextlib.asynccontextmanager
+    async def open(self, url: str,
+                   media_type: ThirdPartyAPIMediaType = ThirdPartyAPIMediaType.unknown) -> AsyncIterator[str]:
+        """
+        Yields path to the downloaded media file.
+        File is kept in cache until the context is exited.
+        """
+        name = self._get_file_name(url, media_type)
+
+        if name in self._files:
+            self.hits += 1
+            self._files.move_to_end(name)
+        elif name in self._downloads:
+            self.shared_downloads += 1
+        else:
+            self.misses += 1
+
+        # pinned before download, so the file isn't evicted before this coroutine wakes up
+        self._pinned[name] += 1
+        try:
+            if name not in self._files:
+                if name not in self._downloads:
+                    self._downloads[name] = asyncio.create_task(self._download(url, name))
+                    self._downloads[name].add_done_callback(lambda _: self._downloads.pop(name, None))
+                await asyncio.shield(self._downloads[name])
+
+            yield str(self._path / name)
+        finally:
+            self._pinned[name] -= 1
+            if not self._pinned[name]:
+                del self._pinned[name]
+            self._evict()
+
+    async def _download(self, url: str, name: str) -> None:
+        part_path = self._path / f'{name}.part'
+        size = 0
+
+        log.debug('Relaying %s to %s', url, part_path)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as res:
+                    res.raise_for_status()
+
+                    with open(part_path, 'wb') as file:
+                        async for chunk in res.content.iter_chunked(self.chunk_size):
+                            size += len(chunk)
+                            if size > self.max_file_size:
+                                raise ValueError(f'Media {url} exceeds {self.max_file_size} bytes')
+                            # disk writes don't block the event loop
+                            await asyncio.to_thread(file.write, chunk)
+
+            part_path.rename(self._path / name)
+        except Exception:
+            part_path.unlink(missing_ok=True)
+            raise
+
+        self._files[name] = size
+        self._evict()
+
+    def _evict(self) -> None:
+        size = self.size
+        for name in list(self._files):
+            if size <= self.max_size:
+                break
+            if name in self._pinned:
+                continue
+
+            size -= self._files.pop(name)
+            (self._path / name).unlink(missing_ok=True)
+            log.debug('Evicted %s from media relay cache', name)
+
+    def _load(self) -> None:
+        """
+        Restores cache index from disk, the oldest files go first.
+        """
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        # remove partially downloaded files
+        for part_path in self._path.glob('*.part'):
+            part_path.unlink(missing_ok=True)
+
+        for file_path in sorted(self._path.iterdir(), key=lambda p: p.stat().st_mtime):
+            if file_path.is_file():
+                self._files[file_path.name] = file_path.stat().st_size
+
+        self._evict()
+        log.debug('Loaded %s files (%s bytes) to media relay cache', len(self._files), self.size)
+
+    @classmethod
+    def _get_file_name(cls, url: str, media_type: ThirdPartyAPIMediaType) -> str:
+        url_path = urlsplit(url).path
+        suffix = pathlib.PurePosixPath(url_path).suffix or cls.default_suffixes.get(media_type, '')
+        return hashlib.sha1(url_path.encode()).hexdigest() + suffix
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        return get_service_measurements('media_relay_cache', {
+            MeasurementLabelTypeValue.media_relay_cache_files: len(self._files),
+            MeasurementLabelTypeValue.media_relay_cache_hits: self.hits,
+            MeasurementLabelTypeValue.media_relay_cache_misses: self.misses,
+            MeasurementLabelTypeValue.media_relay_cache_shared_downloads: self.shared_downloads,
+            MeasurementLabelTypeValue.media_relay_cache_size_mb: self.size / 1024 / 1024,
+        })
+
+
+media_relay_cache = MediaRelayCache()
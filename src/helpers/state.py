@@ -23,9 +23,17 @@ class StashKeys(AutoNameEnum):
 class RedisConnector:
     _connection = None
     _skippable_keys = [
+        '-state',  # announce job and shard states
+        'announce_best_rate',
+        'announce_jobs',
         'conversation',
         'flood_wait_until',
         'hashtags_cloud',
+        'monitoring_data',
+        'monitoring_last',
+        'monitoring_polling',
+        'monitoring_subscribers',
+        'monitoring_watermark',
         'user_paid_requests',
         'user_requests',
     ]
@@ -75,5 +83,23 @@ class RedisConnector:
             key = key.value
         await self.delete_data(key=f'{user_id}_{key}')
 
+    # keyed records (hashes) with each field saved as JSON, and sets
+    async def get_fields(self, key: str) -> dict[str, Any]:
+        fields = await (await self.connection).hgetall_asdict(key)
+        return {name: json.loads(value) for name, value in fields.items()}
+
+    async def save_fields(self, key: str, fields: dict[str, Any]) -> None:
+        await (await self.connection).hmset(key, {
+            name: json.dumps(value, default=str) for name, value in fields.items()})
+
+    async def get_members(self, key: str) -> set[str]:
+        return await (await self.connection).smembers_asset(key)
+
+    async def add_members(self, key: str, members: list[str]) -> None:
+        await (await self.connection).sadd(key, members)
+
+    async def remove_members(self, key: str, members: list[str]) -> None:
+        await (await self.connection).srem(key, members)
+
 
 redis_connector = RedisConnector()
@@ -1,4 +1,7 @@
+import asyncio
+import contextlib
 import logging
+from typing import Optional
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from pyrogram import Client, errors
@@ -6,20 +9,29 @@ from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo, InputMedia
 
 import exceptions
 import settings
+from addons.Admission import (
+    instagram_admission_controller,
+    tiktok_admission_controller,
+    ReleaseAdmissionDecorator,
+)
 from addons.Telemetry import (
+    send_registered_measurements,
     send_telemetry,
     MeasurementLabelTypeValue,
     TelemetryEventName,
     TelemetryMeasurement,
     TelemetryMeasurementLabels, )
-from common.models import ThirdPartyAPIMediaType
+from common.models import MediaSendStrategy, ThirdPartyAPIMediaItem, ThirdPartyAPIMediaType
 from db.connector import database_connector
 from helpers.base import api_adapter_module, BaseHelper
+from helpers.probe import media_prober
+from helpers.relay import media_relay_cache
 from models import BotModule
-from utils import chunks
 
 log = logging.getLogger(__name__)
 
+InputMedia = InputMediaPhoto | InputMediaVideo | InputMediaAudio
+
 # init scheduler with redis storage for user jobs
 scheduler = AsyncIOScheduler()
 scheduler.start()
@@ -46,6 +58,18 @@ async def send_user_stats():
         ))
 
 
+async def send_service_stats():
+    """
+    Send Measurements collected from bot components (queues, caches, etc.)
+    """
+    if not settings.SEND_PLATFORM_METRICS_DATA:
+        log.debug('Skip sending service stats')
+        return
+
+    await send_registered_measurements()
+
+
+@ReleaseAdmissionDecorator(instagram_admission_controller)
 async def get_user_instagram_media(
         client: Client,
         helper_class: BaseHelper,
@@ -68,46 +92,128 @@ async def get_user_instagram_media(
     except exceptions.WrongInputException:
         await message.reply(text=module.wrong_input_text, reply_to_message_id=message.id)
     else:
-        # collect all media links
-        media_content = []
-        for media in helper_data.items:
-            match media.media_type:
-                case ThirdPartyAPIMediaType.photo:
-                    media_content.append(InputMediaPhoto(media=media.media_url))
-                case ThirdPartyAPIMediaType.video:
-                    media_content.append(InputMediaVideo(media=media.media_url))
-                case ThirdPartyAPIMediaType.audio:
-                    media_content.append(InputMediaAudio(media=media.media_url))
-        # send media
-        # add counter to keep media count in case of exceptions occur
-        sent_counter = 0
+        await _reply_media_pipeline(message=message, items=helper_data.items, module=module)
+
+        # reply with result text
+        await message.reply_text(text=module.result_text)
+
+
+async def _reply_media_pipeline(message: Message, items: list[ThirdPartyAPIMediaItem], module: BotModule) -> None:
+    """
+    Sends media by media groups as soon as they are ready.
+
+    Items are prepared (probed and relayed if needed) concurrently within a prefetch window
+    and flow to the sending stage in original order, so the first media group is sent
+    while the rest of media is still being prepared.
+    Media of unsupported type or size is sent as files after media groups.
+    Media which failed to be relayed is sent by URL, the rest of media isn't affected.
+    """
+    async with contextlib.AsyncExitStack() as relay_stack, media_prober.open_session() as session:
+        async def _prepare(media: ThirdPartyAPIMediaItem) -> tuple[MediaSendStrategy, str]:
+            probe = await media_prober.probe_item(media, session=session)
+            if probe.send_strategy == MediaSendStrategy.url:
+                return probe.send_strategy, media.media_url
+            try:
+                # relayed file is kept in cache until all media is sent
+                return probe.send_strategy, await relay_stack.enter_async_context(
+                    media_relay_cache.open(media.media_url, media_type=media.media_type))
+            except Exception as exc:
+                log.warning('Failed to relay %s, sending it by URL: %s', media.media_url, exc)
+                return MediaSendStrategy.url, media.media_url
+
+        # queue of preparation tasks, its size limits number of items prepared ahead
+        prepared: asyncio.Queue[Optional[tuple[ThirdPartyAPIMediaItem, asyncio.Task[tuple[MediaSendStrategy, str]]]]] = \
+            asyncio.Queue(maxsize=settings.MEDIA_PIPELINE_PREFETCH)
+        preparations: list[asyncio.Task[tuple[MediaSendStrategy, str]]] = []
+
+        async def _produce() -> None:
+            for media in items:
+                preparations.append(asyncio.create_task(_prepare(media)))
+                await prepared.put((media, preparations[-1]))
+            await prepared.put(None)
+
+        producer = asyncio.create_task(_produce())
+
         try:
-            # split to n-sized chunks
-            for media_groups in chunks(media_content, 10):
-                await message.reply_media_group(media=media_groups)
-                sent_counter += 10
-            # reply with result text
-            await message.reply_text(text=module.result_text)
-        except errors.exceptions.bad_request_400.MediaEmpty:
-            # if media contain unsupported video type for reply_media_group method
-            for i in range(sent_counter, len(helper_data.items)):
-                match helper_data.items[i].media_type:
-                    case 1:
-                        await message.reply_photo(
-                            photo=helper_data.items[i].media_url,
-                            reply_to_message_id=message.id if i == (len(helper_data.items) - 1) else None,
-                            reply_markup=module.keyboard if hasattr(module, 'keyboard') else None,
-                            caption=module.result_text if i == (len(helper_data.items) - 1) else None
-                        )
-                    case 2:
-                        await message.reply_video(
-                            video=helper_data.items[i].media_url,
-                            reply_to_message_id=message.id if i == (len(helper_data.items) - 1) else None,
-                            reply_markup=module.keyboard if hasattr(module, 'keyboard') else None,
-                            caption=module.result_text if i == (len(helper_data.items) - 1) else None
-                        )
+            media_group: list[tuple[ThirdPartyAPIMediaItem, InputMedia]] = []
+            documents: list[tuple[ThirdPartyAPIMediaItem, str]] = []  # (media, file path) pairs
+
+            while (next_item := await prepared.get()) is not None:
+                media, preparation = next_item
+                send_strategy, media_source = await preparation
+
+                if send_strategy == MediaSendStrategy.document:
+                    documents.append((media, media_source))
+                    continue
+
+                match media.media_type:
+                    case ThirdPartyAPIMediaType.photo:
+                        media_group.append((media, InputMediaPhoto(media=media_source)))
+                    case ThirdPartyAPIMediaType.video:
+                        media_group.append((media, InputMediaVideo(media=media_source)))
+                    case ThirdPartyAPIMediaType.audio:
+                        media_group.append((media, InputMediaAudio(media=media_source)))
 
+                if len(media_group) == 10:
+                    await _reply_media_group(message=message, media_group=media_group, module=module)
+                    media_group = []
+
+            if media_group:
+                await _reply_media_group(message=message, media_group=media_group, module=module)
+
+            for _, file_path in documents:
+                await message.reply_document(document=file_path)
+        finally:
+            # stop preparation of the rest items in case of error, and wait for it to stop
+            # before relayed files and HTTP session are closed
+            producer.cancel()
+            for preparation in preparations:
+                preparation.cancel()
+            await asyncio.gather(producer, *preparations, return_exceptions=True)
+
+
+async def _reply_media_group(message: Message, media_group: list[tuple[ThirdPartyAPIMediaItem, InputMedia]],
+                             module: BotModule) -> None:
+    try:
+        # hint of reply_media_group lacks audio, which send_media_group it calls accepts
+        await message.reply_media_group(media=[input_media for _, input_media in media_group])  # type: ignore[misc]
+    except errors.exceptions.bad_request_400.MediaEmpty:
+        # Telegram failed to fetch media by URL (e.g. unsupported video type for reply_media_group),
+        # so media of the group is relayed through disk and uploaded one by one
+        for media, _ in media_group:
+            try:
+                await _reply_single_media(message=message, media=media, send_strategy=MediaSendStrategy.relay,
+                                          reply_markup=module.keyboard if hasattr(module, 'keyboard') else None)
+            except errors.exceptions.bad_request_400.MediaEmpty:
+                # relay failed as well, the rest of media is still sent
+                log.warning('Failed to send %s', media.media_url)
 
+
+async def _reply_single_media(message: Message, media: ThirdPartyAPIMediaItem,
+                              send_strategy: MediaSendStrategy, **reply_params) -> None:
+    async with contextlib.AsyncExitStack() as relay_stack:
+        media_source = media.media_url
+        if send_strategy != MediaSendStrategy.url:
+            try:
+                media_source = await relay_stack.enter_async_context(
+                    media_relay_cache.open(media.media_url, media_type=media.media_type))
+            except Exception as exc:
+                log.warning('Failed to relay %s, sending it by URL: %s', media.media_url, exc)
+
+        if send_strategy == MediaSendStrategy.document:
+            await message.reply_document(document=media_source, **reply_params)
+            return
+
+        match media.media_type:
+            case ThirdPartyAPIMediaType.photo:
+                await message.reply_photo(photo=media_source, **reply_params)
+            case ThirdPartyAPIMediaType.video:
+                await message.reply_video(video=media_source, **reply_params)
+            case ThirdPartyAPIMediaType.audio:
+                await message.reply_audio(audio=media_source, **reply_params)
+
+
+@ReleaseAdmissionDecorator(tiktok_admission_controller)
 async def get_tiktok_media(
         client: Client,
         helper_class: BaseHelper,
@@ -130,20 +236,20 @@ async def get_tiktok_media(
     except exceptions.WrongInputException:
         await message.reply(text=module.wrong_input_text, reply_to_message_id=message.id)
     else:
-        for media in helper_data.items:
-            if media.media_type == ThirdPartyAPIMediaType.video:
-                text = module.result_text.format(media_type='видео')
-                await message.reply_video(
-                    video=media.media_url,
-                    reply_to_message_id=message.id,
-                    reply_markup=module.keyboard,
-                    caption=text
-                )
-            elif media.media_type == ThirdPartyAPIMediaType.audio:
-                text = module.result_text.format(media_type='музыку')
-                await message.reply_audio(
-                    audio=media.media_url,
-                    reply_to_message_id=message.id,
-                    reply_markup=module.keyboard,
-                    caption=text
-                )
+        for media, probe in zip(helper_data.items, await media_prober.probe_items(helper_data.items)):
+            match media.media_type:
+                case ThirdPartyAPIMediaType.video:
+                    text = module.result_text.format(media_type='видео')
+                case ThirdPartyAPIMediaType.audio:
+                    text = module.result_text.format(media_type='музыку')
+                case _:
+                    continue
+
+            await _reply_single_media(
+                message=message,
+                media=media,
+                send_strategy=probe.send_strategy,
+                reply_to_message_id=message.id,
+                reply_markup=module.keyboard,
+                caption=text,
+            )
@@ -1,11 +1,17 @@
 import datetime
 import logging
 
-from pyrogram import Client
 from rich.logging import RichHandler
 
 import settings
-from jobs import scheduler, send_user_stats
+from common.dispatcher import UserOrderedDispatcher
+from common.sender import ScheduledSendClient
+from helpers.cache import answer_cache
+from jobs import scheduler, send_service_stats, send_user_stats
+from plugins.Announce.jobs import resume_announce_jobs
+from plugins.Announce.worker import AnnounceWorker
+from plugins.Monitoring.core import migrate_monitoring_jobs, start_monitoring_jobs
+from plugins.Monitoring.delivery import monitoring_delivery
 
 
 def main() -> None:
@@ -23,13 +29,17 @@ def main() -> None:
         include=settings.PLUGINS,
     )
 
-    bot = Client(
+    # all outgoing messages share Telegram rate limits
+    bot = ScheduledSendClient(
         settings.BOT_NAME,
         api_id=settings.API_ID,
         api_hash=settings.API_HASH,
         bot_token=settings.BOT_TOKEN,
         plugins=plugins,
+        workers=settings.DISPATCHER_WORKERS,
     )
+    # handle updates of different users in parallel, keeping order within each user
+    bot.dispatcher = UserOrderedDispatcher(bot)
 
     # send stats
     start_time: datetime.datetime = datetime.datetime.now() + datetime.timedelta(seconds=30)
@@ -42,6 +52,62 @@ def main() -> None:
         seconds=settings.SEND_USER_STATS_INTERVAL_S,  # trigger argument
         replace_existing=True
     )
+    scheduler.add_job(
+        send_service_stats,
+        id='service_stats_telemetry',
+        trigger='interval',
+        next_run_time=start_time,
+        name='Service stats telemetry',
+        seconds=settings.SEND_SERVICE_STATS_INTERVAL_S,  # trigger argument
+        replace_existing=True
+    )
+
+    # refresh cached third-party API answers before their media URLs expire
+    scheduler.add_job(
+        answer_cache.refresh_expiring,
+        id='answer_cache_refresh',
+        trigger='interval',
+        name='Third-party API answers cache refresh',
+        seconds=settings.ANSWER_CACHE_REFRESH_INTERVAL_S,  # trigger argument
+        replace_existing=True
+    )
+
+    # resume announcements interrupted by restart, when the bot is started
+    scheduler.add_job(
+        resume_announce_jobs,
+        'date',
+        id='announce_resume',
+        run_date=start_time,
+        name='Resume interrupted announcements',
+        kwargs={'client': bot},
+        replace_existing=True
+    )
+
+    # monitoring results are sent by the bot client, its session is watched for them
+    monitoring_delivery.bind(bot)
+
+    # monitoring jobs of single subscriptions are replaced by jobs of watched accounts
+    scheduler.add_job(
+        migrate_monitoring_jobs,
+        'date',
+        id='monitoring_jobs_migration',
+        run_date=start_time,
+        name='Migrate monitoring jobs',
+        replace_existing=True
+    )
+
+    # the bot runs shards of announcements too, along with separate announce workers if any
+    scheduler.add_job(
+        AnnounceWorker(bot).run,
+        'date',
+        id='announce_worker',
+        run_date=start_time,
+        name='Announce worker',
+        replace_existing=True
+    )
+
+    # monitoring jobs stored before keep pickled objects, they're compacted before any of them is run
+    start_monitoring_jobs()
 
     # starting the bot
     logging.getLogger(__name__).info(
@@ -14,20 +14,21 @@ from pyrogram.types import (
 import settings  # type: ignore
 from addons.Permissions import restricted_method_decorator  # type: ignore
 from addons.Trottling import handle_trottling_decorator  # type: ignore
-from db.connector import database_connector  # type: ignore
 from common.filters import conversation_filter  # type: ignore
 from common.decorators import handle_common_exceptions_decorator  # type: ignore
 from common.models import (  # type: ignore
     AnnouncePreferences,
+    AnnounceJobState,
+    AnnounceSegment,
     AnnounceJobStats,
     UserRoleBit,
 )
 from helpers.state import redis_connector  # type: ignore
 from models import BotModule  # type: ignore
-from jobs import scheduler  # type: ignore
 
 from ..base import callback as base_callback  # type: ignore
-from .jobs import announce_to_all_users, announce_status_feedback  # type: ignore
+from .jobs import cancel_announce_job, start_announce_job  # type: ignore
+from .segments import announce_segment_counts, get_segment_description  # type: ignore
 from .utils import copy_message_with_preferences  # type: ignore
 
 
@@ -95,17 +96,45 @@ async def handle_message(client: Client, message: Message, helper_data: dict = {
         key=await _get_job_preferences_key(announce_message.id),
         data=preferences)
 
-    await announce_message.reply((
-            'Это сообщение будет разослано **всем** пользователям.\n\n'
-            '**Внимательно проверь, что текст и медиафайл (если есть) корректны!**\n'
-            'Если что-то неверно, пришли сообщение заново.\n\n'
-            '__сообщение выглядит так, как оно будет отправлено пользователю, '
-            'настройки можно изменить кнопками под сообщением__'
-        ),
+    await announce_message.reply(
+        await _get_start_text(preferences.segment),
         reply_to_message_id=announce_message.id,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton('Начать рассылку', callback_data='ANNOUNCE_START')],
-        ]))
+        reply_markup=await _get_start_keyboard(preferences.segment))
+
+
+@Client.on_callback_query(filters.regex('^ANNOUNCE_AUDIENCE$') & conversation_filter(module.name))
+@handle_common_exceptions_decorator
+@handle_trottling_decorator
+@restricted_method_decorator
+async def handle_choose_segment(client: Client, callback_query: CallbackQuery) -> None:
+    buttons = []
+    for segment in await announce_segment_counts.get_segments():
+        segment_count = await announce_segment_counts.get_count(segment)
+        buttons.append([InlineKeyboardButton(
+            f'{get_segment_description(segment)}: ~{segment_count}',
+            callback_data=f'ANNOUNCE_SEGMENT:{segment.code}',
+        )])
+    await callback_query.message.edit_reply_markup(InlineKeyboardMarkup(buttons))
+
+
+@Client.on_callback_query(filters.regex('^ANNOUNCE_SEGMENT:') & conversation_filter(module.name))
+@handle_common_exceptions_decorator
+@handle_trottling_decorator
+@restricted_method_decorator
+async def handle_edit_segment(client: Client, callback_query: CallbackQuery) -> None:
+    _, _, segment_code = callback_query.data.partition(':')
+
+    job_preferences_key = await _get_job_preferences_key(callback_query.message.reply_to_message.id)
+    preferences: AnnouncePreferences = AnnouncePreferences.from_dict(await redis_connector.get_data(job_preferences_key))
+    preferences.segment = AnnounceSegment.from_code(segment_code)
+    await redis_connector.save_data(
+        key=job_preferences_key,
+        data=preferences,
+    )
+
+    await callback_query.message.edit_text(
+        await _get_start_text(preferences.segment),
+        reply_markup=await _get_start_keyboard(preferences.segment))
 
 
 @Client.on_callback_query(filters.regex('^ANNOUNCE_EDIT') & conversation_filter(module.name))
@@ -116,7 +145,7 @@ async def handle_edit_settings(client: Client, callback_query: CallbackQuery) ->
     _, _, changed_setting = callback_query.data.split('_')
 
     job_preferences_key = await _get_job_preferences_key(callback_query.message.id)
-    preferences: AnnouncePreferences = AnnouncePreferences(**await redis_connector.get_data(job_preferences_key))
+    preferences: AnnouncePreferences = AnnouncePreferences.from_dict(await redis_connector.get_data(job_preferences_key))
 
     if changed_setting == 'MARKDOWN':
         preferences.markdown = not preferences.markdown
@@ -166,15 +195,14 @@ async def handle_announce_start(client: Client, callback_query: CallbackQuery) -
 
     job_id = await _get_job_id(announce_message.id)
     job_preferences_key = await _get_job_preferences_key(announce_message.id)
-    announce_preferences: AnnouncePreferences = AnnouncePreferences(
-        **await redis_connector.get_data(job_preferences_key))
+    announce_preferences: AnnouncePreferences = AnnouncePreferences.from_dict(
+        await redis_connector.get_data(job_preferences_key))
 
     start_time: datetime.datetime = datetime.datetime.now() + datetime.timedelta(seconds=settings.ANNOUNCE_DELAY_S)
-    chat_ids = await database_connector.get_user_ids_for_announce()
-
     job_stats: AnnounceJobStats = AnnounceJobStats(
         started_at=datetime.datetime.now().strftime(settings.DATE_FORMAT),
-        total=len(chat_ids))
+        # exact number is known when recipients are saved
+        total=await announce_segment_counts.get_count(announce_preferences.segment))
 
     announce_stats_message = await callback_query.message.edit_text((
             f'Рассылка **{job_stats.total}** пользователям будет начата через '
@@ -185,39 +213,18 @@ async def handle_announce_start(client: Client, callback_query: CallbackQuery) -
             [InlineKeyboardButton('Отменить рассылку', callback_data='ANNOUNCE_CANCEL')],
         ]))
 
-    # schedule announcement
-    scheduler.add_job(
-        announce_to_all_users,
-        'interval',
-        id=job_id,
-        next_run_time=start_time,
-        name=f'Announcement job {job_id} to all users',
-        max_instances=settings.ANNOUNCE_WORKERS,
-        misfire_grace_time=None,  # run job even if it's time is overdue
-        kwargs={
-            'announce_message': announce_message,
-            'announce_preferences': announce_preferences,
-            'client': client,
-            'ids': chat_ids,
-            'job_id': job_id,
-            'job_stats': job_stats,
-        },
-        seconds=settings.ANNOUNCE_INTERVAL_S,
-    )
-
-    # schedule job status notification update
-    scheduler.add_job(
-        announce_status_feedback,
-        'interval',
-        id=f'{job_id}-feedback',
-        next_run_time=start_time,
-        name=f'Announcement job {job_id} feedback',
-        kwargs={
-            'job_id': job_id,
-            'job_stats': job_stats,
-            'stats_message': announce_stats_message,
-        },
-        seconds=settings.ANNOUNCE_FEEDBACK_INTERVAL_S,
+    # schedule announcement, its state is persisted to resume after restart
+    await start_announce_job(
+        state=AnnounceJobState(
+            job_id=job_id,
+            chat_id=announce_message.chat.id,
+            message_id=announce_message.id,
+            stats_message_id=announce_stats_message.id,
+            preferences=announce_preferences,
+            stats=job_stats,
+        ),
+        stats_message=announce_stats_message,
+        start_time=start_time,
     )
 
 
@@ -228,9 +235,8 @@ async def handle_announce_cancel(client: Client, callback_query: CallbackQuery)
     job_id = await _get_job_id(callback_query.message.reply_to_message.id)
     log.warning('Aborting announcement %s...', job_id)
 
-    # stop announcement job, feedback job will be stopped by itself
-    if _scheduled_job := scheduler.get_job(job_id):
-        _scheduled_job.remove()
+    # stop announcement, feedback job will be stopped by itself
+    if await cancel_announce_job(job_id):
         await callback_query.message.edit_text(f'**Рассылка отстанавливается...**\n\n{callback_query.message.text}')
         log.warning('Announcement %s is manually aborted!', job_id)
 
@@ -257,6 +263,24 @@ async def _get_settings_keyboard(message: Message,
     return InlineKeyboardMarkup(buttons)
 
 
+async def _get_start_text(segment: AnnounceSegment) -> str:
+    return (
+        f'Это сообщение будет разослано **{await announce_segment_counts.get_count(segment)}** '
+        f'пользователям (аудитория: **{get_segment_description(segment)}**).\n\n'
+        '**Внимательно проверь, что текст и медиафайл (если есть) корректны!**\n'
+        'Если что-то неверно, пришли сообщение заново.\n\n'
+        '__сообщение выглядит так, как оно будет отправлено пользователю, '
+        'настройки можно изменить кнопками под сообщением__'
+    )
+
+
+async def _get_start_keyboard(segment: AnnounceSegment) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f'Аудитория: {get_segment_description(segment)}', callback_data='ANNOUNCE_AUDIENCE')],
+        [InlineKeyboardButton('Начать рассылку', callback_data='ANNOUNCE_START')],
+    ])
+
+
 async def _humanize_bool(value: bool) -> str:
     return 'вкл' if value else 'выкл'
 
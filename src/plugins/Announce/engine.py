@@ -0,0 +1,295 @@
+import asyncio
+import collections
+import enum
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional
+
+from pyrogram import errors
+
+import settings  # type: ignore
+from common.models import AnnounceJobStats  # type: ignore
+from common.sender import TokenBucket  # type: ignore
+
+from .rate import AdaptiveAnnounceRate  # type: ignore
+
+
+log = logging.getLogger(__name__)
+
+
+class AnnounceOutcome(str, enum.Enum):
+    success = 'success'
+    blocked = 'blocked'  # user blocked the bot or was deleted
+    failed = 'failed'
+
+
+@dataclass
+class AnnounceCheckpoint:
+    cursor: int  # all recipients up to this user_id are done
+    done_ids: list[int] = field(default_factory=list)  # done recipients after cursor
+    rate: float = field(default=0)  # current messages per second
+    best_rate: Optional[float] = field(default=None)
+
+
+class AnnounceEngine:
+    """
+    Sends announcement to a stream of recipients.
+
+    Recipients are read ahead into a bounded queue and handled by `senders` concurrent
+    tasks, which take turns by the shared rate limiter, so throughput is defined by
+    the rate (messages per second) rather than by latency of a single send.
+    The rate is adapted to flood errors by `rate_controller`, and may be limited further
+    by `rate_budget` shared with other engines, e.g. run by other processes.
+    Outcomes are counted in `job_stats` immediately and recorded (DB updates, etc.)
+    by batches in a separate task, off the send path.
+
+    Recipients must be ordered by user_id, so progress is described by a cursor
+    (all recipients up to it are done) and a few done recipients after it. Progress is
+    passed to `checkpoint` periodically, and the announce can be resumed with
+    `cursor` and `skip_ids` taken from the last checkpoint.
+    Besides, each recipient is passed to `on_done` as soon as it's done, so recipients
+    done after the last checkpoint can be skipped on resume as well. Delivery is
+    at least once: only sends in flight at the moment of crash may be repeated.
+    """
+
+    def __init__(self, job_id: str,
+                 recipients: AsyncIterable[int],
+                 send: Callable[[int], Awaitable[None]],
+                 record: Callable[[AnnounceOutcome, list[int]], Awaitable[None]],
+                 job_stats: AnnounceJobStats,
+                 rate_controller: Optional[AdaptiveAnnounceRate] = None,
+                 rate_budget: Optional[Callable[[], Awaitable[None]]] = None,
+                 on_finish: Optional[Callable[['AnnounceEngine'], Awaitable[None]]] = None,
+                 checkpoint: Optional[Callable[[AnnounceCheckpoint], Awaitable[None]]] = None,
+                 on_done: Optional[Callable[[int], Awaitable[None]]] = None,
+                 cursor: int = 0,
+                 skip_ids: Iterable[int] = (),
+                 senders: int = settings.ANNOUNCE_WORKERS,
+                 checkpoint_interval_s: float = settings.ANNOUNCE_CHECKPOINT_INTERVAL_S,
+                 bookkeeping_interval_s: float = settings.ANNOUNCE_BOOKKEEPING_INTERVAL_S,
+                 bookkeeping_batch_size: int = settings.ANNOUNCE_BOOKKEEPING_BATCH_SIZE):
+        self.job_id = job_id
+        self.job_stats = job_stats
+        self.rate_controller = rate_controller or AdaptiveAnnounceRate()
+        self.senders = senders
+        self.checkpoint_interval_s = checkpoint_interval_s
+        self.bookkeeping_interval_s = bookkeeping_interval_s
+        self.bookkeeping_batch_size = bookkeeping_batch_size
+
+        self.is_started = False
+        self.is_cancelled = False
+        self.is_finished = False
+
+        self._recipients = recipients
+        self._send = send
+        self._record = record
+        self._on_finish = on_finish
+        self._checkpoint = checkpoint
+        self._on_done = on_done
+
+        # progress
+        self._cursor = cursor
+        self._skip_ids = set(skip_ids)
+        # not done recipients and done ones after the first not done
+        self._fed_ids: collections.deque[int] = collections.deque()
+        self._done_ids = set(self._skip_ids)  # done recipients after cursor
+
+        self._rate_limiter = TokenBucket(rate=self.rate_controller.rate, capacity=1)
+        self._rate_budget = rate_budget
+        self._paused_until = 0.0  # monotonic time
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def rate(self) -> float:
+        return self.rate_controller.rate
+
+    async def run(self) -> None:
+        self.is_started = True
+        log.info('Starting announce %s with %s senders at %s msg/s', self.job_id, self.senders, self.rate)
+
+        queue: asyncio.Queue[Optional[int]] = asyncio.Queue(maxsize=self.senders * 2)
+        outcomes: asyncio.Queue[Optional[tuple[int, AnnounceOutcome]]] = asyncio.Queue()
+
+        bookkeeper = asyncio.create_task(self._keep_books(outcomes))
+        checkpointer = asyncio.create_task(self._make_checkpoints())
+        self._tasks = [
+            asyncio.create_task(self._feed(queue)),
+            *(asyncio.create_task(self._send_to_recipients(queue, outcomes)) for _ in range(self.senders)),
+        ]
+
+        is_interrupted = False
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            if not self.is_cancelled:
+                # stopped from outside, e.g. on shutdown, so the announce is resumed later
+                is_interrupted = True
+                await self._stop_tasks()
+                raise
+            log.warning('Announce %s is cancelled', self.job_id)
+        except Exception:
+            # gather doesn't cancel other tasks, so senders are stopped before outcomes are recorded
+            is_interrupted = True
+            await self._stop_tasks()
+            raise
+        finally:
+            checkpointer.cancel()
+            # record outcomes of all sent messages, even if announce is cancelled or interrupted
+            outcomes.put_nowait(None)
+            await bookkeeper
+            if is_interrupted:
+                # the announce isn't finished, so it can be resumed from the checkpoint
+                try:
+                    await self.save_checkpoint()
+                except Exception as exc:
+                    log.exception('Failed to save checkpoint of announce %s: %s', self.job_id, exc)
+                log.error('Announce %s is interrupted: %s', self.job_id, self.job_stats)
+            else:
+                await self.run_on_finish()
+                log.info('Announce %s is finished: %s', self.job_id, self.job_stats)
+
+    def cancel(self) -> None:
+        self.is_cancelled = True
+        for task in self._tasks:
+            task.cancel()
+
+    async def run_on_finish(self) -> None:
+        self.is_finished = True
+        await self.save_checkpoint()
+        if self._on_finish:
+            await self._on_finish(self)
+
+    async def save_checkpoint(self) -> None:
+        if self._checkpoint:
+            await self._checkpoint(self.get_checkpoint())
+
+    def pause(self, wait_s: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + wait_s)
+
+    def get_checkpoint(self) -> AnnounceCheckpoint:
+        return AnnounceCheckpoint(
+            cursor=self._cursor,
+            done_ids=sorted(user_id for user_id in self._done_ids if user_id > self._cursor),
+            rate=self.rate,
+            best_rate=self.rate_controller.best_rate,
+        )
+
+    async def _stop_tasks(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _feed(self, queue: asyncio.Queue[Optional[int]]) -> None:
+        async for user_id in self._recipients:
+            if user_id <= self._cursor or user_id in self._skip_ids:
+                # already done before resume
+                continue
+
+            self._fed_ids.append(user_id)
+            await queue.put(user_id)
+
+        for _ in range(self.senders):
+            await queue.put(None)
+
+    async def _send_to_recipients(self, queue: asyncio.Queue[Optional[int]],
+                                  outcomes: asyncio.Queue[Optional[tuple[int, AnnounceOutcome]]]) -> None:
+        while (user_id := await queue.get()) is not None:
+            outcome = await self._send_with_retries(user_id)
+
+            match outcome:
+                case AnnounceOutcome.success:
+                    self.job_stats.success += 1
+                case AnnounceOutcome.blocked:
+                    self.job_stats.blocked += 1
+                case AnnounceOutcome.failed:
+                    self.job_stats.failed += 1
+
+            outcomes.put_nowait((user_id, outcome))
+            if self._on_done:
+                try:
+                    await self._on_done(user_id)
+                except Exception as exc:
+                    # the recipient is still covered by the next checkpoint
+                    log.warning('Failed to mark user %s done in announce %s: %s', user_id, self.job_id, exc)
+            self._mark_done(user_id)
+
+    def _mark_done(self, user_id: int) -> None:
+        self._done_ids.add(user_id)
+        while self._fed_ids and self._fed_ids[0] in self._done_ids:
+            self._cursor = self._fed_ids.popleft()
+            self._done_ids.discard(self._cursor)
+
+    async def _send_with_retries(self, user_id: int) -> AnnounceOutcome:
+        while True:
+            await self._wait_for_turn()
+
+            try:
+                await self._send(user_id)
+                self.rate_controller.on_success()
+                return AnnounceOutcome.success
+            except (
+                errors.InputUserDeactivated,
+                errors.PeerIdInvalid,
+                errors.UserIsBlocked,
+                errors.UserIsBot,
+            ) as exc:
+                log.debug('Error happened for user %s: %s', user_id, exc)
+                return AnnounceOutcome.blocked
+            except errors.FloodWait as exc:
+                # send scheduler passes flood waits of announce through, stop all senders and retry
+                log.warning('Announce %s is paused for %s sec by flood control', self.job_id, exc.value)
+                self.rate_controller.on_flood(exc.value)
+                self.pause(exc.value)
+            except Exception as exc:
+                log.exception('Failed to announce %s to user %s: %s', self.job_id, user_id, exc)
+                return AnnounceOutcome.failed
+
+    async def _wait_for_turn(self) -> None:
+        if (pause_s := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(pause_s)
+
+        self._rate_limiter.rate = self.rate_controller.rate
+        if wait_s := self._rate_limiter.reserve(time.monotonic()):
+            await asyncio.sleep(wait_s)
+
+        if self._rate_budget:
+            await self._rate_budget()
+
+    async def _make_checkpoints(self) -> None:
+        if not self._checkpoint:
+            return
+
+        while True:
+            await asyncio.sleep(self.checkpoint_interval_s)
+            try:
+                await self._checkpoint(self.get_checkpoint())
+            except Exception as exc:
+                log.exception('Failed to save checkpoint of announce %s: %s', self.job_id, exc)
+
+    async def _keep_books(self, outcomes: asyncio.Queue[Optional[tuple[int, AnnounceOutcome]]]) -> None:
+        """
+        Outcomes are buffered and recorded by batches, one call per outcome type.
+        The rest is recorded when the announce is finished or cancelled.
+        """
+        is_finished = False
+
+        while not is_finished:
+            await asyncio.sleep(self.bookkeeping_interval_s)
+
+            batch = collections.defaultdict(list)
+            while not outcomes.empty():
+                if (next_outcome := outcomes.get_nowait()) is None:
+                    is_finished = True
+                    break
+                user_id, outcome = next_outcome
+                batch[outcome].append(user_id)
+
+            for outcome, user_ids in batch.items():
+                for offset in range(0, len(user_ids), self.bookkeeping_batch_size):
+                    user_ids_chunk = user_ids[offset:offset + self.bookkeeping_batch_size]
+                    try:
+                        await self._record(outcome, user_ids_chunk)
+                    except Exception as exc:
+                        log.exception('Failed to record %s announce outcome for %s users: %s',
+                                      outcome, len(user_ids_chunk), exc)
@@ -1,7 +1,11 @@
-import asyncio
+import datetime
 import logging
+import pathlib
+from dataclasses import asdict
+from typing import Optional
 # import re
 
+from asyncio_redis import ZScoreBoundary
 from pyrogram import Client, errors
 from pyrogram.enums import ParseMode
 from pyrogram.types import Message
@@ -9,136 +13,262 @@ from pyrogram.types import Message
 import settings  # type: ignore
 from db.connector import database_connector  # type: ignore
 from common.decorators import handle_common_exceptions_decorator  # type: ignore
-from common.models import AnnounceJobStats, AnnouncePreferences  # type: ignore
-from exceptions import UnrecognizedException  # type: ignore
+from common.models import AnnounceJobState, AnnounceJobStats, AnnounceShardState  # type: ignore
+from common.sender import sending_priority, SendPriority  # type: ignore
 from helpers.notify import notify_admin  # type: ignore
 from helpers.state import redis_connector  # type: ignore
 from jobs import scheduler  # type: ignore
 
+from .engine import AnnounceOutcome  # type: ignore
+from .payload import AnnouncePayload  # type: ignore
+from .progress import AnnounceProgressReporter  # type: ignore
+from .rate import AdaptiveAnnounceRate  # type: ignore
+from .recipients import RecipientSet  # type: ignore
+from .shards import is_shard_leased  # type: ignore
+
 
 log = logging.getLogger(__name__)
 
+ANNOUNCE_JOBS_KEY = 'announce_jobs'  # ids of announce jobs which are running or not cleaned up yet
+
 
-async def announce_to_all_users(
-    announce_message: Message,
-    client: Client,
-    ids: list,
-    job_id: str,
-    job_stats: AnnounceJobStats,
-    announce_preferences: AnnouncePreferences,
-) -> None:
+async def start_announce_job(state: AnnounceJobState, stats_message: Message,
+                             start_time: datetime.datetime) -> None:
+    """
+    Schedules announcement and its status feedback.
+    Announcement itself is sent by announce workers, see AnnounceWorker.
     """
-    This job supposed to be run in defined interval.
-    On each iteration some amount of users is picked up from ids list,
-    the amount is dynamic: in case of flood it is reduced.
+    await save_announce_state(state)
+    active_job_ids = await redis_connector.get_data(ANNOUNCE_JOBS_KEY) or []
+    if state.job_id not in active_job_ids:
+        await redis_connector.save_data(key=ANNOUNCE_JOBS_KEY, data=[*active_job_ids, state.job_id])
+
+    _schedule_announce_job(job_id=state.job_id, stats_message=stats_message, start_time=start_time)
+
 
-    There are two pauses:
-    - between job runs, defined by ANNOUNCE_INTERVAL_S
-    - between each user announce, defined by `1/announce_preferences.pack_length`
+async def cancel_announce_job(job_id: str) -> bool:
     """
+    Returns False if there's no running announce with given id.
+    Workers stop shards of cancelled announce by themselves.
+    """
+    if not (state := await load_announce_state(job_id)) or state.is_finished:
+        return False
 
-    # TODO multiply pack_length on seconds between job runs
-    for i in range(0, announce_preferences.pack_length):
-        if not ids:
-            log.debug('No users left, removing job...')
-            if _scheduled_job := scheduler.get_job(job_id):
-                _scheduled_job.remove()
-            return
+    if _scheduled_job := scheduler.get_job(job_id):
+        # announcement isn't started yet
+        _scheduled_job.remove()
 
-        user_id = ids.pop()
-        log.debug('Poped next user: %s', user_id)
+    state.is_finished = True
+    await save_announce_state(state)
+    return True
 
-        if not user_id:
-            return
 
-        # anti-flood delay
-        await asyncio.sleep(1/announce_preferences.pack_length)
+async def resume_announce_jobs(client: Client) -> None:
+    """
+    Resumes feedback of announces interrupted by restart,
+    their shards are resumed by workers from the last checkpoints.
+    """
+    for job_id in await redis_connector.get_data(ANNOUNCE_JOBS_KEY) or []:
+        if not (state := await load_announce_state(job_id)):
+            continue
 
+        log.warning('Resuming announcement %s...', job_id)
         try:
-            # send message to user
-            await _announce_user_with_error_handling_and_stats_count(
-                client=client,
-                job_stats=job_stats,
-                message=announce_message,
-                preferences=announce_preferences,
-                user_id=user_id,
+            stats_message = await client.get_messages(chat_id=state.chat_id, message_ids=state.stats_message_id)
+            _schedule_announce_job(
+                job_id=job_id,
+                stats_message=stats_message,
+                start_time=datetime.datetime.now() + datetime.timedelta(seconds=settings.ANNOUNCE_DELAY_S),
             )
-        except UnrecognizedException as exc:
-            # continue job, ignore exceptions
-            log.exception('Unhandled exception occured during announcement: %s', exc)
+        except Exception as exc:
+            log.exception('Failed to resume announcement %s: %s', job_id, exc)
+            await notify_admin(f'Не удалось возобновить рассылку {job_id}: {exc}')
 
 
-@handle_common_exceptions_decorator
-async def _announce_user_with_error_handling_and_stats_count(
-        user_id: int, client: Client,
-        job_stats: AnnounceJobStats, preferences: AnnouncePreferences, message: Message) -> None:
+def _schedule_announce_job(job_id: str, stats_message: Message, start_time: datetime.datetime) -> None:
+    scheduler.add_job(
+        _prepare_announce_job,
+        'date',
+        id=job_id,
+        run_date=start_time,
+        name=f'Announcement job {job_id} to users',
+        misfire_grace_time=None,  # run job even if it's time is overdue
+        kwargs={'job_id': job_id},
+        replace_existing=True,
+    )
+
+    # schedule job status notification update
+    scheduler.add_job(
+        announce_status_feedback,
+        'interval',
+        id=f'{job_id}-feedback',
+        next_run_time=start_time,
+        name=f'Announcement job {job_id} feedback',
+        kwargs={
+            'job_id': job_id,
+            'stats_message': stats_message,
+            # scheduler keeps jobs in memory, so reporter lives between ticks
+            'reporter': AnnounceProgressReporter(),
+        },
+        seconds=settings.ANNOUNCE_FEEDBACK_INTERVAL_S,
+        replace_existing=True,
+    )
+
+
+async def _prepare_announce_job(job_id: str) -> None:
+    """
+    Recipients are fixed when announce starts: their ids are streamed from DB
+    to a compact snapshot file, shared by workers, then the job is open for workers.
+    """
+    if not (state := await load_announce_state(job_id)) or state.is_finished or state.shards:
+        # cancelled or already prepared before restart
+        return
+
+    path = get_recipients_path(job_id)
+    snapshot = await RecipientSet.from_async_iterable(
+        database_connector.iterate_user_ids_for_announce(segment=state.preferences.segment))
+    snapshot.save(path)
+    log.info('Saved %s recipients of announcement %s to %s', len(snapshot), job_id, path)
+
+    state.stats.total = len(snapshot)
+    state.shards = settings.ANNOUNCE_SHARDS
+    await save_announce_state(state)
+
+
+async def announce_to_user(user_id: int, client: Client, payload: AnnouncePayload) -> None:
+    """
+    Sends announcement to one user, used by AnnounceEngine senders.
+    """
     try:
-        await _announce_user(client=client, user_id=user_id, preferences=preferences, message=message)
-        await database_connector.user_was_announced(user_id)
-        job_stats.success += 1
+        # send message to user, after replies and monitoring messages
+        with sending_priority(SendPriority.announce):
+            await payload.send(client=client, user_id=user_id)
     except (
+        errors.FloodWait,
         errors.InputUserDeactivated,
         errors.PeerIdInvalid,
         errors.UserIsBlocked,
         errors.UserIsBot,
-    ) as exc:
-        log.debug('Error happened for user %s: %s', user_id, exc)
-        await database_connector.user_toggle_block(user_id)
-        job_stats.blocked += 1
-    except errors.FloodWait as exc:
-        log.debug('Flood error: %s', exc)
-        # decrease pack per interval to avoid flood
-        preferences.pack_length = 1
-        raise exc  # pass exception to global handler
+    ):
+        raise  # handled by engine
     except Exception as exc:
-        log.debug('Unknown error: %s', exc)
-        job_stats.failed += 1
         await notify_admin(f'Необработанная ошибка рассылки: {exc}')
-        raise exc  # pass exception to global handler
-    else:
-        # bring back default interval between announcements
-        preferences.pack_length = settings.ANNOUNCE_PACK_LENGTH
-
-
-async def _announce_user(user_id: int, client: Client,
-                         preferences: AnnouncePreferences, message: Message) -> None:
-    """
-    Poll object must be preserved to allow users see votes of others.
-    However, `copy_message` creates new instance of Poll.
-    Possible solution is to use `sendMedia` from raw Telegram Bot API.
-    """
-    if hasattr(message, 'poll') and message.poll:
-        await message.forward(
-            chat_id=user_id,  # announce to tet-a-tet user chat
-            disable_notification=not preferences.notification,
-        )
-    elif hasattr(message, 'media') and message.media:
-        await message.copy(
-            chat_id=user_id,  # announce to tet-a-tet user chat
-            disable_notification=not preferences.notification,
-            parse_mode=ParseMode.MARKDOWN if preferences.markdown else ParseMode.DISABLED,
-            reply_markup=None,
-        )
-    else:
-        # re-create message for proper params preserving,
-        # message.copy() does not preserve .web_page
-        await client.send_message(
-            chat_id=user_id,
-            text=message.text.markdown,
-            disable_notification=not preferences.notification,
-            disable_web_page_preview=not preferences.link_preview,
-            parse_mode=ParseMode.MARKDOWN if preferences.markdown else ParseMode.DISABLED,
-            reply_markup=None,
-        )
+        raise
+
+
+async def record_announce_outcomes(outcome: AnnounceOutcome, user_ids: list[int]) -> None:
+    match outcome:
+        case AnnounceOutcome.success:
+            await database_connector.users_were_announced(user_ids)
+        case AnnounceOutcome.blocked:
+            await database_connector.users_toggle_block(user_ids)
+
+
+async def get_announce_rate_controller(shards: int = 1) -> AdaptiveAnnounceRate:
+    """
+    New announce starts near the best rate sustained by previous announces of the bot,
+    rates are divided equally between shards of the announce.
+    """
+    best_rate = await redis_connector.get_data(_get_best_rate_key())
+    return AdaptiveAnnounceRate(
+        best_rate=best_rate / shards if best_rate else None,
+        initial_rate=settings.ANNOUNCE_RATE / shards,
+        min_rate=settings.ANNOUNCE_MIN_RATE / shards,
+        max_rate=settings.ANNOUNCE_MAX_RATE / shards,
+    )
+
+
+async def save_announce_rate(best_rate: float) -> None:
+    if best_rate:
+        await redis_connector.save_data(key=_get_best_rate_key(), data=best_rate)
+
+
+def _get_best_rate_key() -> str:
+    # Telegram limits are applied per bot, bot id is the first part of its token
+    bot_id, _, _ = settings.BOT_TOKEN.partition(':')
+    return f'announce_best_rate_{bot_id}'
+
+
+def get_recipients_path(job_id: str) -> pathlib.Path:
+    return pathlib.Path(settings.ANNOUNCE_RECIPIENTS_DIR) / f'{job_id}.ids'
+
+
+async def load_announce_state(job_id: str) -> Optional[AnnounceJobState]:
+    if state_data := await redis_connector.get_data(_get_state_key(job_id)):
+        return AnnounceJobState(**state_data)
+
+
+async def save_announce_state(state: AnnounceJobState) -> None:
+    await redis_connector.save_data(key=_get_state_key(state.job_id), data=asdict(state))
+
+
+def _get_state_key(job_id: str) -> str:
+    return f'{job_id}-state'
+
+
+async def load_shard_state(job_id: str, shard: int) -> AnnounceShardState:
+    if state_data := await redis_connector.get_data(_get_shard_state_key(job_id, shard)):
+        return AnnounceShardState(**state_data)
+    return AnnounceShardState(job_id=job_id, shard=shard)
+
+
+async def save_shard_state(state: AnnounceShardState) -> None:
+    await redis_connector.save_data(key=_get_shard_state_key(state.job_id, state.shard), data=asdict(state))
+
+
+def _get_shard_state_key(job_id: str, shard: int) -> str:
+    return f'{job_id}-shard-{shard}-state'
+
+
+async def mark_recipient_done(job_id: str, shard: int, user_id: int) -> None:
+    """
+    Recipients done since the last checkpoint are kept in a sorted set scored by user_id,
+    so the ones up to the checkpoint cursor are dropped by range.
+    """
+    connection = await redis_connector.connection
+    await connection.zadd(_get_done_recipients_key(job_id, shard), {str(user_id): user_id})
+
+
+async def get_done_recipients(job_id: str, shard: int, cursor: int) -> list[int]:
+    connection = await redis_connector.connection
+    reply = await connection.zrangebyscore(_get_done_recipients_key(job_id, shard),
+                                           min=ZScoreBoundary(cursor, exclude_boundary=True))
+    return [int(user_id) for user_id in await reply.asdict()]
+
+
+async def forget_done_recipients(job_id: str, shard: int, cursor: int) -> None:
+    # recipients up to the cursor are covered by the checkpoint
+    connection = await redis_connector.connection
+    await connection.zremrangebyscore(_get_done_recipients_key(job_id, shard), max=ZScoreBoundary(cursor))
+
+
+def _get_done_recipients_key(job_id: str, shard: int) -> str:
+    return f'{job_id}-shard-{shard}-done'
 
 
 @handle_common_exceptions_decorator
-async def announce_status_feedback(job_id: str, job_stats: AnnounceJobStats,
-                                   stats_message: Message) -> None:
+async def announce_status_feedback(job_id: str, stats_message: Message, reporter: AnnounceProgressReporter) -> None:
     """
-    Report back to admin chat about announcement progress.
+    Report back to admin chat about announcement progress, summed up over all shards.
+    Progress is checked on every tick, but the message is edited only when reporter decides so.
     """
-    _status_text = await _get_status_message_text(job_stats)
+    if not (state := await load_announce_state(job_id)):
+        scheduler.remove_job(f'{job_id}-feedback')
+        return
+
+    shard_states = [await load_shard_state(job_id, shard) for shard in range(state.shards)]
+    job_stats = AnnounceJobStats(
+        started_at=state.stats.started_at,
+        total=state.stats.total,
+        success=sum(shard_state.stats.success for shard_state in shard_states),
+        blocked=sum(shard_state.stats.blocked for shard_state in shard_states),
+        failed=sum(shard_state.stats.failed for shard_state in shard_states),
+    )
+    reporter.total = job_stats.total
+    reporter.add_sample(job_stats.sent)
+
+    current_rate = sum(shard_state.rate for shard_state in shard_states if not shard_state.is_finished)
+    _status_text = await _get_status_message_text(job_stats, reporter=reporter, current_rate=current_rate)
 
     # TODO time
     '''
@@ -150,30 +280,67 @@ async def announce_status_feedback(job_id: str, job_stats: AnnounceJobStats,
     # Datetime: 2022-06-04 00:00:00-04:00, Timezone: EDT, TZ Info: America/New_York
     '''
 
-    if not scheduler.get_job(job_id):
-        await stats_message.edit_text(f'**Рассылка завершилась**{_status_text}')
+    # cancelled announce is finished when all workers have stopped its shards
+    if state.is_finished and not [shard for shard in range(state.shards) if await is_shard_leased(job_id, shard)]:
+        if not await _edit_status_message(stats_message, reporter, f'**Рассылка завершилась**{_status_text}'):
+            return  # try again on next tick
 
         # remove self from scheduler
         scheduler.remove_job(f'{job_id}-feedback')
         await redis_connector.delete_data(f'{job_id}-preferences')
+        await redis_connector.delete_data(_get_state_key(job_id))
+        for shard in range(state.shards):
+            await redis_connector.delete_data(_get_shard_state_key(job_id, shard))
+            await redis_connector.delete_data(_get_done_recipients_key(job_id, shard))
+        get_recipients_path(job_id).unlink(missing_ok=True)
+
+        active_job_ids = await redis_connector.get_data(ANNOUNCE_JOBS_KEY) or []
+        await redis_connector.save_data(
+            key=ANNOUNCE_JOBS_KEY,
+            data=[active_job_id for active_job_id in active_job_ids if active_job_id != job_id])
         return
 
-    await stats_message.edit_text((
-            f'Рассылка идет{_status_text}'
-            f'\n\nETA: ~**{job_stats.eta.strftime("%H:%M:%S")}**'
-        ),
-        reply_markup=stats_message.reply_markup,
-        parse_mode=ParseMode.MARKDOWN)
+    _eta_text = (
+        (datetime.datetime.now() + datetime.timedelta(seconds=reporter.eta_s)).strftime('%H:%M:%S')
+        if reporter.eta_s is not None else '?'
+    )
+    _progress_text = f'Рассылка идет{_status_text}\n\nETA: ~**{_eta_text}**'
+    if reporter.should_report(_progress_text):
+        await _edit_status_message(stats_message, reporter, _progress_text, reply_markup=stats_message.reply_markup)
+
+
+async def _edit_status_message(stats_message: Message, reporter: AnnounceProgressReporter,
+                               text: str, **kwargs) -> bool:
+    """
+    Returns False if the message isn't edited because of flood control.
+    """
+    try:
+        # flood wait of the edit pauses the reporter only, not the announce or other sends
+        with sending_priority(SendPriority.status):
+            await stats_message.edit_text(text, parse_mode=ParseMode.MARKDOWN, **kwargs)
+    except errors.MessageNotModified:
+        pass
+    except errors.FloodWait as exc:
+        # status is not worth waiting for, the announce itself uses the same limits
+        log.warning('Status of announce is not updated because of flood wait of %s sec', exc.value)
+        reporter.pause(exc.value)
+        return False
+
+    reporter.on_reported(text)
+    return True
 
 
-async def _get_status_message_text(stats: AnnounceJobStats) -> str:
+async def _get_status_message_text(stats: AnnounceJobStats, reporter: AnnounceProgressReporter,
+                                   current_rate: float = None) -> str:
+    _current_rate_text = f'\nТекущая скорость: ~{round(current_rate, 1)} сообщений/сек' if current_rate else ''
     return (
         '\n\n'
-        f'Всего: **{stats.sent}** из **{stats.total}**\n'
+        f'Всего: **{stats.sent}** из **{stats.total}** ({reporter.percent}%)\n'
         f'  успешно: **{stats.success}**\n'
         f'  бот заблокирован: **{stats.blocked}**\n'
         f'  другие ошибки: **{stats.failed}**\n\n'
         f'Время старта: **{stats.started_at}**\n'
         f'Прошло минут: ~{stats.spent_time_m}\n'
-        f'Скорость рассылки: ~{stats.rate} сообщений/мин'
+        f'Скорость рассылки: ~{round(reporter.rate * 60)} сообщений/мин'
+        f'{_current_rate_text}'
     )
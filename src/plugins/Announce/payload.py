@@ -0,0 +1,160 @@
+import enum
+from dataclasses import dataclass, field
+from typing import cast, Optional
+
+from pyrogram import Client, errors, raw, utils
+from pyrogram.enums import ParseMode
+from pyrogram.types import Message
+
+from common.models import AnnouncePreferences  # type: ignore
+
+
+class AnnouncePayloadKind(str, enum.Enum):
+    copy = 'copy'  # media without file (location, contact, etc.), copied as is
+    forward = 'forward'
+    media = 'media'
+    text = 'text'
+
+
+@dataclass(frozen=True)
+class AnnouncePayload:
+    """
+    Announce message rendered once for all recipients: text and entities are parsed,
+    media is resolved to its file_id and flags are set, so sending to a recipient
+    is a single pre-built API call.
+    """
+    kind: AnnouncePayloadKind
+    silent: bool = field(default=False)
+
+    # text message or media caption
+    text: str = field(default='')
+    entities: Optional[list] = field(default=None)
+    no_webpage: bool = field(default=False)
+
+    media: Optional[raw.base.InputMedia] = field(default=None)
+
+    # forwarded message
+    from_peer: Optional[raw.base.InputPeer] = field(default=None)
+    message_id: int = field(default=0)
+
+    # copied message
+    message: Optional[Message] = field(default=None)
+    parse_mode: ParseMode = field(default=ParseMode.DISABLED)
+
+    async def send(self, client: Client, user_id: int) -> None:
+        if self.kind == AnnouncePayloadKind.copy:
+            if not self.message:
+                raise ValueError(f'Announce payload {self.kind} is incomplete')
+            # the peer is resolved by Pyrogram
+            await self.message.copy(
+                chat_id=user_id,
+                disable_notification=self.silent,
+                parse_mode=self.parse_mode,
+                # None drops keyboard of the original message
+                reply_markup=None,  # type: ignore[arg-type]
+            )
+            return
+
+        # bots may address users with zero access hash, so the peer isn't resolved (resolve_peer
+        # would call users.GetUsers for each recipient, as workers don't keep peers in memory)
+        try:
+            await self._send_to_peer(client, raw.types.InputPeerUser(user_id=user_id, access_hash=0))
+        except errors.PeerIdInvalid:
+            # zero access hash isn't accepted for this user, the peer is resolved as usual
+            peer = cast(raw.base.InputPeer, await client.resolve_peer(user_id))
+            await self._send_to_peer(client, peer)
+
+    async def _send_to_peer(self, client: Client, peer: raw.base.InputPeer) -> None:
+        # fields of each kind are set by `prepare_announce_payload`
+        match self.kind:
+            case AnnouncePayloadKind.forward if self.from_peer:
+                await client.invoke(raw.functions.messages.ForwardMessages(
+                    from_peer=self.from_peer,
+                    id=[self.message_id],
+                    to_peer=peer,
+                    random_id=[_get_random_id(client)],
+                    silent=self.silent or None,
+                ))
+            case AnnouncePayloadKind.media if self.media:
+                await client.invoke(raw.functions.messages.SendMedia(
+                    peer=peer,
+                    media=self.media,
+                    message=self.text,
+                    entities=self.entities,
+                    random_id=_get_random_id(client),
+                    silent=self.silent or None,
+                ))
+            case AnnouncePayloadKind.text:
+                await client.invoke(raw.functions.messages.SendMessage(
+                    peer=peer,
+                    message=self.text,
+                    entities=self.entities,
+                    no_webpage=self.no_webpage or None,
+                    random_id=_get_random_id(client),
+                    silent=self.silent or None,
+                ))
+            case _:
+                raise ValueError(f'Announce payload {self.kind} is incomplete')
+
+
+def _get_random_id(client: Client) -> int:
+    # `rnd_id` is MsgId class, which returns int
+    return cast(int, client.rnd_id())
+
+
+async def _parse_text(client: Client, text: str, parse_mode: ParseMode,
+                      entities: Optional[list] = None) -> tuple[str, Optional[list]]:
+    parsed = await utils.parse_text_entities(client, text, parse_mode, entities or [])
+    return cast(str, parsed['message']), cast(Optional[list], parsed['entities'])
+
+
+async def prepare_announce_payload(client: Client, message: Message,
+                                   preferences: AnnouncePreferences) -> AnnouncePayload:
+    """
+    Poll object must be preserved to allow users see votes of others.
+    However, `copy_message` creates new instance of Poll, so polls are forwarded.
+
+    Text message is re-created from markdown for proper params preserving,
+    message.copy() does not preserve .web_page
+    """
+    parse_mode = ParseMode.MARKDOWN if preferences.markdown else ParseMode.DISABLED
+
+    if message.poll:
+        return AnnouncePayload(
+            kind=AnnouncePayloadKind.forward,
+            silent=not preferences.notification,
+            # peer of a chat is always InputPeer
+            from_peer=cast(raw.base.InputPeer, await client.resolve_peer(message.chat.id)),
+            message_id=message.id,
+        )
+
+    media_file = getattr(message, message.media.value, None) if message.media else None
+
+    if file_id := getattr(media_file, 'file_id', None):
+        # the same as message.copy() does
+        caption, caption_entities = await _parse_text(
+            client, message.caption or '', parse_mode, message.caption_entities)
+        return AnnouncePayload(
+            kind=AnnouncePayloadKind.media,
+            silent=not preferences.notification,
+            text=caption,
+            entities=caption_entities,
+            media=utils.get_input_media_from_file_id(file_id),
+        )
+
+    if not message.text:
+        return AnnouncePayload(
+            kind=AnnouncePayloadKind.copy,
+            silent=not preferences.notification,
+            message=message,
+            parse_mode=parse_mode,
+        )
+
+    text, entities = await _parse_text(client, message.text.markdown, parse_mode)
+    return AnnouncePayload(
+        kind=AnnouncePayloadKind.text,
+        silent=not preferences.notification,
+        text=text,
+        entities=entities,
+        no_webpage=not preferences.link_preview,
+    )
@@ -0,0 +1,111 @@
+import collections
+import time
+from typing import Optional
+
+import settings  # type: ignore
+
+
+class AnnounceProgressReporter:
+    """
+    Decides when announce progress is worth editing the status message.
+
+    Progress is sampled on every feedback tick, rate is computed over the last `window_s`
+    of samples, so it follows the current speed of announce rather than the average
+    since its start. The message is edited when progress crosses `percent_step`
+    or ETA shifts noticeably. Otherwise it's edited as a heartbeat, which interval
+    doubles up to `max_interval_s` while nothing changes, i.e. the slower the announce,
+    the rarer the edits. Edits are never more often than `min_interval_s`.
+    """
+
+    def __init__(self, total: int = 0,
+                 percent_step: int = settings.ANNOUNCE_PROGRESS_PERCENT_STEP,
+                 eta_shift_s: float = settings.ANNOUNCE_PROGRESS_ETA_SHIFT_S,
+                 eta_shift_share: float = 0.1,
+                 min_interval_s: float = settings.ANNOUNCE_FEEDBACK_INTERVAL_S,
+                 max_interval_s: float = settings.ANNOUNCE_PROGRESS_MAX_INTERVAL_S,
+                 window_s: float = settings.ANNOUNCE_PROGRESS_RATE_WINDOW_S):
+        self.total = total
+        self.percent_step = percent_step
+        self.eta_shift_s = eta_shift_s
+        self.eta_shift_share = eta_shift_share
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.window_s = window_s
+
+        self._samples: collections.deque[tuple[float, int]] = collections.deque()  # (monotonic time, sent)
+        self._heartbeat_interval_s = min_interval_s
+        self._reported_at: Optional[float] = None
+        self._reported_step = -1
+        self._reported_eta_s: Optional[float] = None
+        self._reported_text = ''
+        self._paused_until = 0.0
+
+    def add_sample(self, sent: int, now: Optional[float] = None) -> None:
+        now = now if now is not None else time.monotonic()
+        self._samples.append((now, sent))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window_s:
+            self._samples.popleft()
+
+    @property
+    def sent(self) -> int:
+        return self._samples[-1][1] if self._samples else 0
+
+    @property
+    def percent(self) -> int:
+        return min(100, self.sent * 100 // self.total) if self.total else 0
+
+    @property
+    def rate(self) -> float:
+        """
+        Messages per second over the window.
+        """
+        if len(self._samples) < 2:
+            return 0
+        (first_at, first_sent), (last_at, last_sent) = self._samples[0], self._samples[-1]
+        return (last_sent - first_sent) / (last_at - first_at) if last_at > first_at else 0
+
+    @property
+    def eta_s(self) -> Optional[float]:
+        if not (rate := self.rate):
+            return None
+        return max(0, self.total - self.sent) / rate
+
+    def should_report(self, text: str, now: Optional[float] = None) -> bool:
+        now = now if now is not None else time.monotonic()
+
+        if text == self._reported_text or now < self._paused_until:
+            return False
+        if self._reported_at is None:
+            return True
+        if now - self._reported_at < self.min_interval_s:
+            return False
+
+        if self.percent // self.percent_step != self._reported_step or self._is_eta_shifted(now):
+            return True
+
+        if now - self._reported_at >= self._heartbeat_interval_s:
+            # nothing meaningful changed since the last edit, back off
+            self._heartbeat_interval_s = min(self._heartbeat_interval_s * 2, self.max_interval_s)
+            return True
+
+        return False
+
+    def on_reported(self, text: str, now: Optional[float] = None) -> None:
+        self._reported_at = now if now is not None else time.monotonic()
+        self._reported_step = self.percent // self.percent_step
+        self._reported_eta_s = self.eta_s
+        self._reported_text = text
+
+    def pause(self, wait_s: float) -> None:
+        """
+        Edits are postponed on flood wait, to not compete with announce for Telegram limits.
+        """
+        self._paused_until = time.monotonic() + wait_s
+        self._heartbeat_interval_s = self.max_interval_s
+
+    def _is_eta_shifted(self, now: float) -> bool:
+        if (eta_s := self.eta_s) is None or self._reported_eta_s is None or self._reported_at is None:
+            return eta_s != self._reported_eta_s
+        # reported ETA is a moment of time, it's shifted when the remaining time isn't as expected
+        expected_eta_s = self._reported_eta_s - (now - self._reported_at)
+        return abs(eta_s - expected_eta_s) >= max(self.eta_shift_s, self.eta_shift_share * eta_s)
@@ -0,0 +1,75 @@
+import logging
+import time
+from typing import Optional
+
+import settings  # type: ignore
+
+
+log = logging.getLogger(__name__)
+
+
+class AdaptiveAnnounceRate:
+    """
+    AIMD (additive increase, multiplicative decrease) controller of announce rate.
+
+    Rate grows by `increase` messages per second after each `increase_interval_s`
+    without flood errors, and is multiplied by `decrease` on FloodWait, the longer
+    the wait Telegram asks for, the deeper the cut (one step per `decrease_step_s`).
+
+    The highest rate sustained for a whole interval is kept in `best_rate`,
+    so the next announce can start close to it.
+    """
+
+    def __init__(self, best_rate: Optional[float] = None,
+                 initial_rate: float = settings.ANNOUNCE_RATE,
+                 min_rate: float = settings.ANNOUNCE_MIN_RATE,
+                 max_rate: float = settings.ANNOUNCE_MAX_RATE,
+                 increase: float = settings.ANNOUNCE_RATE_INCREASE,
+                 increase_interval_s: float = settings.ANNOUNCE_RATE_INCREASE_INTERVAL_S,
+                 decrease: float = settings.ANNOUNCE_RATE_DECREASE,
+                 decrease_step_s: float = settings.ANNOUNCE_RATE_DECREASE_STEP_S,
+                 start_share: float = settings.ANNOUNCE_RATE_START_SHARE):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.increase_interval_s = increase_interval_s
+        self.decrease = decrease
+        self.decrease_step_s = decrease_step_s
+
+        self.best_rate = best_rate
+        self.flood_waits = 0
+
+        self.rate = self._clamp(best_rate * start_share if best_rate else initial_rate)
+        self._changed_at = time.monotonic()
+
+    def on_success(self) -> None:
+        now = time.monotonic()
+        if now - self._changed_at < self.increase_interval_s:
+            return
+
+        # current rate was held for the whole interval
+        self.best_rate = max(self.best_rate or 0, self.rate)
+        self.rate = self._clamp(self.rate + self.increase)
+        self._changed_at = now
+
+    def on_flood(self, wait_s: float) -> None:
+        self.flood_waits += 1
+
+        if time.monotonic() < self._changed_at:
+            # concurrent senders got the same flood, rate is already decreased
+            return
+
+        steps = 1 + int(wait_s // self.decrease_step_s)
+        rate = self._clamp(self.rate * self.decrease ** steps)
+        log.info('Announce rate is decreased from %.2f to %.2f msg/s by flood wait of %s sec',
+                 self.rate, rate, wait_s)
+
+        self.rate = rate
+        if self.best_rate:
+            # remembered rate turned out to be too high
+            self.best_rate = min(self.best_rate, rate)
+        # don't increase rate before the wait is over and the interval is passed
+        self._changed_at = time.monotonic() + wait_s
+
+    def _clamp(self, rate: float) -> float:
+        return min(max(rate, self.min_rate), self.max_rate)
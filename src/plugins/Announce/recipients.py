@@ -0,0 +1,109 @@
+import array
+import bisect
+import mmap
+import os
+import pathlib
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Union
+
+
+class RecipientSet:
+    """
+    Compact ordered list of announce recipients.
+
+    Ids are stored as int64 values: 8 bytes per user, while list of Python ints
+    takes ~36 bytes per user (pointer + int object). The set is either an array in memory
+    or a memory-mapped snapshot file, which is written and read as raw bytes,
+    so persisting doesn't need any serialization and opening it doesn't load it to memory.
+
+    Recipients are consumed from `cursor` (index of the next recipient), ids are
+    expected to be sorted, so `seek_after` can resume the set from user_id.
+    """
+    typecode = 'q'  # signed int64
+
+    def __init__(self, ids: Union[array.array, memoryview], cursor: int = 0, mapped: Optional[mmap.mmap] = None):
+        self.cursor = cursor
+        self._ids = ids
+        self._mapped = mapped
+
+    @classmethod
+    def from_iterable(cls, ids: Iterable[int]) -> 'RecipientSet':
+        return cls(array.array(cls.typecode, ids))
+
+    @classmethod
+    async def from_async_iterable(cls, ids: AsyncIterable[int]) -> 'RecipientSet':
+        recipients = array.array(cls.typecode)
+        async for user_id in ids:
+            recipients.append(user_id)
+        return cls(recipients)
+
+    @classmethod
+    def open(cls, path: Union[str, pathlib.Path]) -> 'RecipientSet':
+        with open(path, 'rb') as file:
+            if not os.fstat(file.fileno()).st_size:
+                return cls(array.array(cls.typecode))
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(memoryview(mapped).cast(cls.typecode), mapped=mapped)
+
+    def save(self, path: Union[str, pathlib.Path]) -> None:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        part_path = path.with_suffix(f'{path.suffix}.part')
+        with open(part_path, 'wb') as file:
+            file.write(memoryview(self._ids).cast('B'))
+        part_path.rename(path)
+
+    def close(self) -> None:
+        if self._mapped:
+            if isinstance(self._ids, memoryview):
+                # the map can't be closed while it's exported
+                self._ids.release()
+            self._mapped.close()
+            self._mapped = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[int, 'RecipientSet']:
+        if isinstance(index, slice):
+            # no copy, memory-mapped slice keeps the file mapped while it's used
+            return RecipientSet(self._ids[index])
+        return self._ids[index]
+
+    @property
+    def remaining(self) -> int:
+        return len(self._ids) - self.cursor
+
+    def pop(self) -> Optional[int]:
+        if self.cursor >= len(self._ids):
+            return None
+        user_id = self._ids[self.cursor]
+        self.cursor += 1
+        return user_id
+
+    def seek_after(self, user_id: int) -> None:
+        """
+        Moves cursor to the first recipient with id greater than `user_id`.
+        """
+        self.cursor = bisect.bisect_right(self._ids, user_id)
+
+    def shard(self, index: int, count: int) -> 'RecipientSet':
+        """
+        Returns part of recipients by hash of user_id, i.e. shards of one set
+        don't intersect and have close sizes. Order of ids is preserved.
+        """
+        return RecipientSet(array.array(self.typecode, (
+            user_id for user_id in self._ids if get_recipient_shard(user_id, count) == index
+        )))
+
+    def __iter__(self) -> Iterator[int]:
+        while (user_id := self.pop()) is not None:
+            yield user_id
+
+    async def __aiter__(self) -> AsyncIterator[int]:
+        for user_id in self:
+            yield user_id
+
+
+def get_recipient_shard(user_id: int, count: int) -> int:
+    return user_id % count
@@ -0,0 +1,73 @@
+import logging
+import time
+
+import settings  # type: ignore
+from common.models import AnnounceSegment, AnnounceSegmentKind  # type: ignore
+from db.connector import database_connector  # type: ignore
+
+
+log = logging.getLogger(__name__)
+
+REGISTERED_WITHIN_DAYS = (7, 30, 90)
+PAID_REQUESTS_TIERS = ('0-0', '1-9', '10-99', '100-')
+
+
+class AnnounceSegmentCounts:
+    """
+    Cached counts of announce segments for admin preview.
+
+    Counting is done by indexed queries, but it's still a DB round trip per segment,
+    while the preview is redrawn on each button press, so counts are kept for `ttl_s`.
+    Exact number of recipients is known when announce starts anyway.
+    """
+
+    def __init__(self, ttl_s: int = settings.ANNOUNCE_SEGMENT_COUNT_TTL_S):
+        self.ttl_s = ttl_s
+        self._counts: dict[str, tuple[int, float]] = {}  # segment code: (count, expires_at)
+        self._utm_campaigns: tuple[list[str], float] = ([], 0)
+
+    async def get_count(self, segment: AnnounceSegment) -> int:
+        count, expires_at = self._counts.get(segment.code, (0, 0))
+        if expires_at < time.time():
+            count = await database_connector.get_users_count_for_announce(segment=segment)
+            self._counts[segment.code] = (count, time.time() + self.ttl_s)
+        return count
+
+    async def get_segments(self) -> list[AnnounceSegment]:
+        """
+        Segments offered to admin: everyone, popular utm campaigns, registration periods, paid tiers.
+        """
+        utm_campaigns, expires_at = self._utm_campaigns
+        if expires_at < time.time():
+            utm_campaigns = await database_connector.get_utm_campaigns_for_announce(
+                limit=settings.ANNOUNCE_SEGMENT_UTM_LIMIT)
+            self._utm_campaigns = (utm_campaigns, time.time() + self.ttl_s)
+
+        return [
+            AnnounceSegment(),
+            *(AnnounceSegment(kind=AnnounceSegmentKind.utm.value, value=utm) for utm in utm_campaigns
+              # callback data is limited to 64 bytes
+              if len(utm.encode()) <= 40),
+            *(AnnounceSegment(kind=AnnounceSegmentKind.registered.value, value=str(days))
+              for days in REGISTERED_WITHIN_DAYS),
+            *(AnnounceSegment(kind=AnnounceSegmentKind.paid.value, value=tier) for tier in PAID_REQUESTS_TIERS),
+        ]
+
+
+def get_segment_description(segment: AnnounceSegment) -> str:
+    match AnnounceSegmentKind(segment.kind):
+        case AnnounceSegmentKind.utm:
+            return f'пришли по {segment.value}'
+        case AnnounceSegmentKind.registered:
+            return f'зарегистрировались за {segment.value} дн.'
+        case AnnounceSegmentKind.paid:
+            min_count, _, max_count = segment.value.partition('-')
+            if not max_count:
+                return f'платных запросов от {min_count}'
+            if min_count == max_count:
+                return f'платных запросов {min_count}'
+            return f'платных запросов {min_count}-{max_count}'
+    return 'все'
+
+
+announce_segment_counts = AnnounceSegmentCounts()
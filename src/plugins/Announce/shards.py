@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import settings  # type: ignore
+from helpers.state import redis_connector  # type: ignore
+
+
+log = logging.getLogger(__name__)
+
+# the lease is changed only by its owner
+RENEW_LEASE_SCRIPT = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+'''
+RELEASE_LEASE_SCRIPT = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+
+class ShardLease:
+    """
+    Exclusive claim of announce shard by a worker, kept in Redis with TTL.
+
+    Owner renews the lease while the shard is run, if the worker dies,
+    the lease expires and the shard is claimed by another worker.
+    """
+
+    def __init__(self, key: str, owner: str, ttl_s: float = settings.ANNOUNCE_LEASE_TTL_S):
+        self.key = key
+        self.owner = owner
+        self.ttl_s = ttl_s
+        self.is_held = False
+
+    async def acquire(self) -> bool:
+        connection = await redis_connector.connection
+        self.is_held = bool(await connection.set(
+            self.key, self.owner, pexpire=self._ttl_ms, only_if_not_exists=True))
+        return self.is_held
+
+    async def renew(self) -> bool:
+        self.is_held = bool(await self._run_script(RENEW_LEASE_SCRIPT, self._ttl_ms))
+        if not self.is_held:
+            log.warning('Lease %s of %s is lost', self.key, self.owner)
+        return self.is_held
+
+    async def release(self) -> None:
+        if self.is_held:
+            self.is_held = False
+            await self._run_script(RELEASE_LEASE_SCRIPT)
+
+    @property
+    def _ttl_ms(self) -> int:
+        return int(self.ttl_s * 1000)
+
+    async def _run_script(self, code: str, *args) -> int:
+        connection = await redis_connector.connection
+        script = await connection.register_script(code)
+        reply = await script.run(keys=[self.key], args=[self.owner, *map(str, args)])
+        return await reply.return_value()
+
+
+async def is_shard_leased(job_id: str, shard: int) -> bool:
+    connection = await redis_connector.connection
+    return await connection.get(get_shard_lease_key(job_id, shard)) is not None
+
+
+def get_shard_lease_key(job_id: str, shard: int) -> str:
+    return f'{job_id}-shard-{shard}-lease'
+
+
+class SharedRateBudget:
+    """
+    Messages per second shared by all workers, i.e. processes sending on behalf of the bot.
+
+    Sends are counted in Redis by one-second windows. To not go to Redis for every message,
+    the worker reserves `chunk` messages at once and spends them within the same window,
+    the rest of reservation is dropped when the window is over.
+    """
+
+    def __init__(self, key: str, rate: float = settings.ANNOUNCE_MAX_RATE,
+                 chunk: int = settings.ANNOUNCE_RATE_BUDGET_CHUNK):
+        self.key = key
+        self.rate = rate
+        self.chunk = chunk
+
+        self._window: Optional[int] = None
+        self._allowance = 0
+
+    async def acquire(self) -> None:
+        while True:
+            window = int(time.time())
+            if window != self._window:
+                self._window = window
+                self._allowance = 0
+
+            if self._allowance > 0:
+                self._allowance -= 1
+                return
+
+            if granted := await self._reserve(window):
+                self._allowance = granted - 1
+                return
+
+            # budget of this second is spent by workers
+            await asyncio.sleep(window + 1 - time.time())
+
+    async def _reserve(self, window: int) -> int:
+        connection = await redis_connector.connection
+        window_key = f'{self.key}-{window}'
+
+        reserved = await connection.incrby(window_key, self.chunk)
+        if reserved == self.chunk:
+            await connection.expire(window_key, 2)
+
+        # the last reservation in the window may be partial
+        return int(min(self.chunk, max(0, self.rate - (reserved - self.chunk))))
+
+
+def get_rate_budget_key() -> str:
+    # Telegram limits are applied per bot, bot id is the first part of its token
+    bot_id, _, _ = settings.BOT_TOKEN.partition(':')
+    return f'announce_rate_budget_{bot_id}'
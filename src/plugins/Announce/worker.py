@@ -0,0 +1,211 @@
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+
+from pyrogram import Client
+
+import settings  # type: ignore
+from common.models import AnnounceJobState, AnnounceShardState  # type: ignore
+from helpers.state import redis_connector  # type: ignore
+
+from .engine import AnnounceCheckpoint, AnnounceEngine  # type: ignore
+from .jobs import (  # type: ignore
+    ANNOUNCE_JOBS_KEY,
+    announce_to_user,
+    forget_done_recipients,
+    get_announce_rate_controller,
+    get_done_recipients,
+    get_recipients_path,
+    load_announce_state,
+    load_shard_state,
+    mark_recipient_done,
+    record_announce_outcomes,
+    save_announce_rate,
+    save_announce_state,
+    save_shard_state,
+)
+from .payload import prepare_announce_payload  # type: ignore
+from .recipients import RecipientSet  # type: ignore
+from .shards import get_rate_budget_key, get_shard_lease_key, ShardLease, SharedRateBudget  # type: ignore
+
+
+log = logging.getLogger(__name__)
+
+
+class AnnounceWorker:
+    """
+    Runs shards of announces: recipients of an announce are split by user_id hash
+    into `ANNOUNCE_SHARDS` shards, which are claimed by workers through Redis leases.
+
+    The bot process is a worker itself, more workers can be run as separate processes
+    (see announce_worker.py), each with its own connection to Telegram.
+    All workers send under the shared rate budget of the bot. If a worker dies,
+    its shards are resumed by other workers from their checkpoints once leases expire.
+    """
+
+    def __init__(self, client: Client,
+                 max_shards: int = settings.ANNOUNCE_WORKER_SHARDS,
+                 poll_interval_s: float = settings.ANNOUNCE_WORKER_POLL_INTERVAL_S):
+        self.client = client
+        self.max_shards = max_shards
+        self.poll_interval_s = poll_interval_s
+        self.owner = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+        self._rate_budget = SharedRateBudget(key=get_rate_budget_key())
+        self._running: dict[tuple[str, int], asyncio.Task] = {}
+
+    async def run(self) -> None:
+        log.info('Announce worker %s is started', self.owner)
+        while True:
+            try:
+                await self._claim_shards()
+            except Exception as exc:
+                log.exception('Announce worker %s failed to claim shards: %s', self.owner, exc)
+            await asyncio.sleep(self.poll_interval_s)
+
+    async def _claim_shards(self) -> None:
+        self._running = {key: task for key, task in self._running.items() if not task.done()}
+
+        for job_id in await redis_connector.get_data(ANNOUNCE_JOBS_KEY) or []:
+            if not (state := await load_announce_state(job_id)) or state.is_finished:
+                continue
+
+            # not prepared jobs have no shards yet
+            for shard in range(state.shards):
+                if len(self._running) >= self.max_shards:
+                    return
+                if (job_id, shard) in self._running:
+                    continue
+
+                lease = ShardLease(key=get_shard_lease_key(job_id, shard), owner=self.owner)
+                if not await lease.acquire():
+                    continue
+
+                # the state is read under the lease, so it's the last one saved by previous owner
+                if (shard_state := await load_shard_state(job_id, shard)).is_finished:
+                    await lease.release()
+                    continue
+
+                self._running[(job_id, shard)] = asyncio.create_task(
+                    self._run_shard(state=state, shard_state=shard_state, lease=lease))
+
+    async def _run_shard(self, state: AnnounceJobState, shard_state: AnnounceShardState, lease: ShardLease) -> None:
+        log.info('Announce worker %s runs shard %s of %s from user %s',
+                 self.owner, shard_state.shard, state.job_id, shard_state.cursor)
+        try:
+            announce_message = await self.client.get_messages(chat_id=state.chat_id, message_ids=state.message_id)
+
+            snapshot = RecipientSet.open(get_recipients_path(state.job_id))
+            try:
+                # the whole snapshot is scanned, off the event loop
+                recipients = await asyncio.to_thread(snapshot.shard, shard_state.shard, state.shards)
+            finally:
+                snapshot.close()
+            recipients.seek_after(shard_state.cursor)
+
+            engine = AnnounceEngine(
+                job_id=f'{state.job_id}/{shard_state.shard}',
+                recipients=recipients,
+                send=functools.partial(
+                    announce_to_user,
+                    client=self.client,
+                    # the message is rendered once for all recipients of the shard
+                    payload=await prepare_announce_payload(
+                        client=self.client, message=announce_message, preferences=state.preferences),
+                ),
+                record=record_announce_outcomes,
+                job_stats=shard_state.stats,
+                rate_controller=await get_announce_rate_controller(shards=state.shards),
+                rate_budget=self._rate_budget.acquire,
+                on_finish=functools.partial(self._finish_shard, state, shard_state, lease),
+                checkpoint=functools.partial(self._save_checkpoint, shard_state, lease),
+                on_done=functools.partial(mark_recipient_done, state.job_id, shard_state.shard),
+                cursor=shard_state.cursor,
+                # recipients done after the last checkpoint are skipped too
+                skip_ids=[*shard_state.done_ids,
+                          *await get_done_recipients(state.job_id, shard_state.shard, shard_state.cursor)],
+            )
+
+            engine_task = asyncio.create_task(engine.run())
+            lease_keeper = asyncio.create_task(self._keep_lease(engine, lease, state.job_id))
+            try:
+                await asyncio.wait([engine_task, lease_keeper], return_when=asyncio.FIRST_COMPLETED)
+                if lease_keeper.done() and (exc := lease_keeper.exception()):
+                    # the shard isn't sent without the lease, it's resumed from the checkpoint
+                    engine_task.cancel()
+                    await asyncio.gather(engine_task, return_exceptions=True)
+                    raise exc
+                await engine_task
+            finally:
+                # the engine saves its checkpoint before the lease is released
+                for task in (engine_task, lease_keeper):
+                    task.cancel()
+                await asyncio.gather(engine_task, lease_keeper, return_exceptions=True)
+        except Exception as exc:
+            log.exception('Failed to run shard %s of announce %s: %s', shard_state.shard, state.job_id, exc)
+        finally:
+            await lease.release()
+
+    async def _keep_lease(self, engine: AnnounceEngine, lease: ShardLease, job_id: str) -> None:
+        """
+        Renews the lease while the shard is run,
+        stops the shard if the lease is lost or the announce is cancelled.
+        Errors are retried until the lease expires, then it's considered lost and the error is raised.
+        """
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(min(lease.ttl_s / 3, self.poll_interval_s))
+
+            try:
+                if not await lease.renew():
+                    # the shard may be claimed by another worker already
+                    engine.cancel()
+                    return
+                renewed_at = time.monotonic()
+
+                if not (state := await load_announce_state(job_id)) or state.is_finished:
+                    engine.cancel()
+                    return
+            except Exception as exc:
+                if time.monotonic() - renewed_at >= lease.ttl_s:
+                    lease.is_held = False
+                    raise
+                log.warning('Announce worker %s failed to renew lease %s: %s', self.owner, lease.key, exc)
+
+    async def _save_checkpoint(self, shard_state: AnnounceShardState, lease: ShardLease,
+                               checkpoint: AnnounceCheckpoint) -> None:
+        if not lease.is_held:
+            # the shard may be run by another worker already
+            return
+
+        # stats are shared with engine, so they're up to date
+        shard_state.cursor = checkpoint.cursor
+        shard_state.done_ids = checkpoint.done_ids
+        shard_state.rate = checkpoint.rate
+        shard_state.best_rate = checkpoint.best_rate
+        await save_shard_state(shard_state)
+        await forget_done_recipients(shard_state.job_id, shard_state.shard, checkpoint.cursor)
+
+    async def _finish_shard(self, state: AnnounceJobState, shard_state: AnnounceShardState,
+                            lease: ShardLease, engine: AnnounceEngine) -> None:
+        if not lease.is_held:
+            return
+
+        # the last checkpoint is already saved by engine
+        shard_state.is_finished = True
+        await save_shard_state(shard_state)
+
+        shard_states = [await load_shard_state(state.job_id, shard) for shard in range(state.shards)]
+        if not all(other_state.is_finished for other_state in shard_states):
+            return
+
+        # the last shard finishes the job
+        if (job_state := await load_announce_state(state.job_id)) and not job_state.is_finished:
+            job_state.is_finished = True
+            await save_announce_state(job_state)
+
+        await save_announce_rate(sum(other_state.best_rate or 0 for other_state in shard_states))
@@ -10,6 +10,7 @@ from pyrogram.types import (
 )
 
 import settings
+from addons.Admission import instagram_admission_controller, HandleAdmissionDecorator
 from addons.Trottling import handle_trottling_decorator, handle_paid_requests_trottling_decorator
 from common.decorators import (
     inform_user_decorator, handle_common_exceptions_decorator,
@@ -69,6 +70,7 @@ async def callback(client: Client, update: CallbackQuery | Message) -> None:
 @handle_trottling_decorator
 @handle_common_exceptions_decorator
 @inform_user_decorator
+@HandleAdmissionDecorator(instagram_admission_controller)
 async def handle_instagram_request(client: Client, message: Message) -> None:
     start_time = datetime.datetime.now()
 
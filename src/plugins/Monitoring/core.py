@@ -1,4 +1,5 @@
 import datetime
+import functools
 import logging
 from dataclasses import dataclass, field
 
@@ -18,12 +19,22 @@ from common.decorators import (
 )
 from common.filters import conversation_filter
 from common.models import ThirdPartyAPISource, ThirdPartyAPIMediaType, ThirdPartyAPIClientAnswer
+from common.sender import sending_priority, SendPriority
 from helpers.state import redis_connector
 from helpers.utils import extract_username_from_link
 from models import BotModule
-from plugins.Monitoring.jobs import monitoring_scheduler
-from plugins.Monitoring.jobs import start_monitoring
-from plugins.Monitoring.utils import UserMonitoringDataDBConnector, UserMonitoringRequest, seconds_to_cron
+from plugins.Monitoring.delivery import monitoring_delivery
+from plugins.Monitoring.jobs import (
+    compact_account_jobs,
+    get_monitoring_job_id,
+    migrate_subscription_jobs,
+    monitoring_scheduler,
+    register_monitoring_handler,
+    schedule_account_monitoring,
+    spread_account_jobs,
+)
+from plugins.Monitoring.schemas import MonitoredAccount, MonitoringWatermark
+from plugins.Monitoring.utils import UserMonitoringDataDBConnector, UserMonitoringRequest
 from plugins.base import get_modules_buttons
 
 log = logging.getLogger(__name__)
@@ -31,10 +42,6 @@ log = logging.getLogger(__name__)
 
 @dataclass
 class MonitoringModule(BotModule):
-    # store client in memory for monitoring callback method
-    # (store as class attribute - so the module instance doesn't have it)
-    temp_client = None
-
     instagram_media_type_choice_text: str = field(init=False)
     subscribe_confirmation_text: str = field(init=False)
     subscribe_text: str = field(init=False)
@@ -208,17 +215,16 @@ async def restart_my_monitoring_request(client: Client, callback_query: Callback
         social_network=social_network)
 
     # activate monitoring in redis
-    await UserMonitoringDataDBConnector.activate_last_user_monitoring(callback_query.from_user.id)
+    await UserMonitoringDataDBConnector.toggle_user_monitoring(
+        callback_query.from_user.id, social_network=social_network, nickname=nickname, active=True)
 
-    # update last monitoring media date time in redis (to skip all media received after monitoring paused)
-    await UserMonitoringDataDBConnector.save_last_monitoring_media_data(
-        date=datetime.datetime.now(),
-        user_id=callback_query.from_user.id)
-
-    # pause monitoring job
-    monitoring_scheduler.resume_job(
-        job_id=f'monitoring-{callback_query.from_user.id}-{social_network}-{nickname}'
-    )
+    # move watermark of the subscription to now (to skip all media received after monitoring paused)
+    account = MonitoredAccount(social_network=social_network, nickname=nickname,
+                               media_type=monitoring.selected_media_type)
+    watermark = (await UserMonitoringDataDBConnector.get_monitoring_watermark(callback_query.from_user.id, account)
+                 or MonitoringWatermark(taken_at=monitoring.start_date))
+    watermark.taken_at = datetime.datetime.now()
+    await UserMonitoringDataDBConnector.save_monitoring_watermark(callback_query.from_user.id, account, watermark)
 
     # generate keyboard
     markup = InlineKeyboardMarkup(
@@ -240,13 +246,9 @@ async def pause_my_monitoring_request(client: Client, callback_query: CallbackQu
         nickname=nickname,
         social_network=social_network)
 
-    # pause monitoring in redis
-    await UserMonitoringDataDBConnector.deactivate_last_user_monitoring(callback_query.from_user.id)
-
-    # pause monitoring job
-    monitoring_scheduler.pause_job(
-        job_id=f'monitoring-{callback_query.from_user.id}-{social_network}-{nickname}'
-    )
+    # pause monitoring in redis, account job skips inactive subscriptions
+    await UserMonitoringDataDBConnector.toggle_user_monitoring(
+        callback_query.from_user.id, social_network=social_network, nickname=nickname, active=False)
 
     # generate keyboard
     markup = InlineKeyboardMarkup(
@@ -282,15 +284,25 @@ async def delete_my_monitoring_request(client: Client, callback_query: CallbackQ
     social_network = user_data[-1]
     nickname = '_'.join([_ for _ in user_data if _ != social_network])
 
+    monitoring = await UserMonitoringDataDBConnector.get_user_monitoring_by_nickname_and_social(
+        callback_query.from_user.id,
+        nickname=nickname,
+        social_network=social_network)
+
     # delete monitoring in redis
     await UserMonitoringDataDBConnector.delete_user_monitoring_by_nickname_and_social(callback_query.from_user.id,
                                                                                       nickname=nickname,
                                                                                       social_network=social_network)
 
-    # delete monitoring job
-    monitoring_scheduler.remove_job(
-        job_id=f'monitoring-{callback_query.from_user.id}-{social_network}-{nickname}'
-    )
+    # delete monitoring job, if nobody else watches the account
+    if monitoring:
+        account = MonitoredAccount(social_network=social_network, nickname=nickname,
+                                   media_type=monitoring.selected_media_type)
+        await UserMonitoringDataDBConnector.delete_monitoring_watermark(callback_query.from_user.id, account)
+        if not await UserMonitoringDataDBConnector.remove_account_subscriber(account, callback_query.from_user.id):
+            if monitoring_scheduler.get_job(get_monitoring_job_id(account)):
+                monitoring_scheduler.remove_job(job_id=get_monitoring_job_id(account))
+            await UserMonitoringDataDBConnector.delete_polling_state(account)
 
     text = module.delete_text.format(
         nickname=nickname, )
@@ -352,30 +364,11 @@ async def handle_subscribe(client: Client, callback_query: CallbackQuery) -> Non
     # made user monitoring request active
     await UserMonitoringDataDBConnector.activate_last_user_monitoring(callback_query.from_user.id)
 
-    start_time = datetime.datetime.now()
-    if current_jobs := monitoring_scheduler.get_jobs():
-        channel_stats_jobs = list(filter(lambda j: j.id.startswith('monitoring'), current_jobs))
-        if channel_stats_jobs:
-            last_job = channel_stats_jobs[-1]
-            start_time = last_job.next_run_time
-
-    start_time += datetime.timedelta(seconds=settings.PENDING_DELAY)
-
-    monitoring_scheduler.add_job(
-        start_monitoring,
-        trigger=seconds_to_cron(settings.SEND_MONITORING_INTERVAL_SECONDS),
-        id=f'monitoring-{user_data.user_id}-{user_data.social_network}-{user_data.nickname}',
-        name=f'Monitoring for {user_data.nickname} by {user_data.user_id}',
-        misfire_grace_time=None,
-        kwargs={
-            'message_handler': send_monitoring_message_to_user,
-            'module': module,
-            'message': callback_query.message,
-            'social_network': user_data.social_network,
-            'nickname': user_data.nickname,
-            'media_type': user_data.selected_media_type
-        },
-    )
+    # one job per watched account, shared by all its subscribers
+    account = MonitoredAccount(social_network=user_data.social_network, nickname=user_data.nickname,
+                               media_type=user_data.selected_media_type)
+    await UserMonitoringDataDBConnector.add_account_subscriber(account, user_id=user_data.user_id)
+    schedule_account_monitoring(account, handler=module.name)
 
     text = module.subscribe_text.format(
         social_network=user_data.social_network.capitalize(),
@@ -494,7 +487,8 @@ async def handle_user_link_input(client: Client, message: Message) -> None:
             UserMonitoringRequest(user_id=message.from_user.id,
                                   nickname=nickname,
                                   selected_media_type='Видео',
-                                  social_network=social_network),
+                                  social_network=social_network,
+                                  start_date=datetime.datetime.now()),
             new=True)
 
     else:
@@ -506,40 +500,52 @@ async def handle_user_link_input(client: Client, message: Message) -> None:
         await UserMonitoringDataDBConnector.save_user_monitoring(
             UserMonitoringRequest(user_id=message.from_user.id,
                                   nickname=nickname,
-                                  social_network=social_network),
+                                  social_network=social_network,
+                                  start_date=datetime.datetime.now()),
             new=True)
 
 
 async def send_monitoring_message_to_user(chat_id: int, message: str, media: ThirdPartyAPIClientAnswer = None) -> None:
-    try:
-        if not MonitoringModule.temp_client or not MonitoringModule.temp_client.is_connected:
-            MonitoringModule.temp_client = Client(
-                'monitoring_client',
-                api_id=settings.API_ID,
-                api_hash=settings.API_HASH,
-                bot_token=settings.BOT_TOKEN,
-            )
-            await MonitoringModule.temp_client.start()
-        if media:
-            for item in media.items:
-                match item.media_type:
-                    case ThirdPartyAPIMediaType.photo:
-                        await MonitoringModule.temp_client.send_photo(
-                            chat_id=chat_id,
-                            caption=message,
-                            photo=item.media_url,
-                            reply_markup=module.result_keyboard,
-                        )
-                    case ThirdPartyAPIMediaType.video:
-                        await MonitoringModule.temp_client.send_video(
-                            chat_id=chat_id,
-                            caption=message,
-                            video=item.media_url,
-                            reply_markup=module.result_keyboard,
-                        )
-        else:
-            await MonitoringModule.temp_client.send_message(chat_id=chat_id, text=message)
-    except ConnectionError as exc:
-        log.warning('Failed to connect temp tg client: %s', exc)
-        if MonitoringModule.temp_client.is_connected:
-            await MonitoringModule.temp_client.stop()
+    with sending_priority(SendPriority.monitoring):
+        await monitoring_delivery.send(
+            functools.partial(_send_monitoring_message, chat_id=chat_id, message=message, media=media))
+
+
+async def _send_monitoring_message(client: Client, chat_id: int, message: str,
+                                   media: ThirdPartyAPIClientAnswer = None) -> None:
+    if media:
+        for item in media.items:
+            match item.media_type:
+                case ThirdPartyAPIMediaType.photo:
+                    await client.send_photo(
+                        chat_id=chat_id,
+                        caption=message,
+                        photo=item.media_url,
+                        reply_markup=module.result_keyboard,
+                    )
+                case ThirdPartyAPIMediaType.video:
+                    await client.send_video(
+                        chat_id=chat_id,
+                        caption=message,
+                        video=item.media_url,
+                        reply_markup=module.result_keyboard,
+                    )
+    else:
+        await client.send_message(chat_id=chat_id, text=message)
+
+
+register_monitoring_handler(module, message_handler=send_monitoring_message_to_user)
+
+
+def start_monitoring_jobs() -> None:
+    """
+    Monitoring jobs are kept in Redis and run by the bot process only, so the scheduler
+    isn't started on import. Jobs stored before are compacted before any of them is run.
+    """
+    monitoring_scheduler.start()
+    compact_account_jobs(handler=module.name)
+
+
+async def migrate_monitoring_jobs() -> None:
+    await migrate_subscription_jobs(handler=module.name)
+    await spread_account_jobs()
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from pyrogram import Client
+from pyrogram.handlers import DisconnectHandler
+
+import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
+
+log = logging.getLogger(__name__)
+
+
+class MonitoringDelivery:
+    """
+    Sends monitoring results through the running bot client.
+
+    Monitoring used to start its own client with a separate MTProto session, which was
+    created again (with full handshake) each time its connection dropped. The bot client
+    is connected anyway, and Pyrogram restarts its session by itself when connection drops,
+    so monitoring only waits until the session is up again, for `connect_timeout_s` at most.
+    Session restarts are counted by the disconnect handler of the client, as Pyrogram
+    calls it each time the session is stopped.
+    Sends go through `outbound_scheduler` as all other sends of the bot client do.
+    """
+
+    def __init__(self, connect_timeout_s: float = settings.MONITORING_CONNECT_TIMEOUT_S):
+        self.connect_timeout_s = connect_timeout_s
+        self.client: Client | None = None
+
+        # stats
+        self.session_restarts = 0
+        self._deliveries = 0
+        self._delivery_s = 0.0
+        self._max_delivery_s = 0.0
+
+        register_measurement_source(self.get_measurements)
+
+    def bind(self, client: Client) -> None:
+        self.client = client
+        client.add_handler(DisconnectHandler(self._on_disconnect))
+
+    @property
+    def is_healthy(self) -> bool:
+        if not self.client or not self.client.is_connected:
+            return False
+        # session is stopped while Pyrogram restarts it
+        return self.client.session.is_started.is_set()
+
+    async def _on_disconnect(self, client: Client) -> None:
+        self.session_restarts += 1
+        log.warning('Bot session is stopped, monitoring sends wait for it')
+
+    async def send(self, func: Callable[[Client], Awaitable[None]]) -> None:
+        """
+        Performs `func` (sends to a subscriber) with the bot client, once it's connected.
+        """
+        started_at = time.monotonic()
+        while not self.is_healthy:
+            if time.monotonic() - started_at >= self.connect_timeout_s:
+                raise ConnectionError('Bot client is not connected')
+            await asyncio.sleep(1)
+        if self.client is None:
+            raise ConnectionError('Bot client is not bound')
+
+        await func(self.client)
+
+        delivery_s = time.monotonic() - started_at
+        self._deliveries += 1
+        self._delivery_s += delivery_s
+        self._max_delivery_s = max(self._max_delivery_s, delivery_s)
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        measurements = get_service_measurements('monitoring-delivery', {
+            MeasurementLabelTypeValue.monitoring_avg_delivery_ms: (
+                1000 * self._delivery_s / self._deliveries if self._deliveries else 0),
+            MeasurementLabelTypeValue.monitoring_max_delivery_ms: 1000 * self._max_delivery_s,
+            MeasurementLabelTypeValue.monitoring_session_restarts: self.session_restarts,
+        })
+        self._deliveries = 0
+        self._delivery_s = 0.0
+        self._max_delivery_s = 0.0
+        return measurements
+
+
+monitoring_delivery = MonitoringDelivery()
@@ -1,14 +1,24 @@
+import dataclasses
 import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from pyrogram.types import (
-    Message,
-)
+from apscheduler.triggers.interval import IntervalTrigger
 
 import exceptions
 import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
 from helpers.base import api_adapter_module
 from models import BotModule
+from plugins.Monitoring.polling import monitoring_polling
+from plugins.Monitoring.scheduler import monitoring_check_scheduler
+from plugins.Monitoring.schemas import MonitoredAccount, MonitoringPollingState, MonitoringWatermark
 from plugins.Monitoring.utils import get_monitoring_media_handler_func, UserMonitoringDataDBConnector
 
 log = logging.getLogger(__name__)
@@ -21,44 +31,246 @@ monitoring_scheduler.add_jobstore(
     host=settings.REDIS_HOST,
     port=settings.REDIS_PORT,
 )
-monitoring_scheduler.start()
+
+
+@dataclass
+class MonitoringDeliveryStats:
+    delivered: int = field(default=0)  # media items sent to subscribers
+    duplicates: int = field(default=0)  # already sent items returned by API again, which were skipped
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        return get_service_measurements('monitoring', {
+            MeasurementLabelTypeValue.monitoring_delivered_items: self.delivered,
+            MeasurementLabelTypeValue.monitoring_duplicate_items: self.duplicates,
+        })
+
+
+monitoring_delivery_stats = MonitoringDeliveryStats()
+register_measurement_source(monitoring_delivery_stats.get_measurements)
+
+
+# message handlers and modules of monitoring jobs by module name, jobs keep only the name,
+# so nothing but a few strings is pickled to the job store
+MessageHandler = Callable[..., Awaitable[None]]
+monitoring_handlers: dict[str, tuple[MessageHandler, BotModule]] = {}
+
+
+def register_monitoring_handler(module: BotModule, message_handler: MessageHandler) -> None:
+    monitoring_handlers[module.name] = (message_handler, module)
+
+
+def get_monitoring_job_id(account: MonitoredAccount) -> str:
+    return f'monitoring-{account.key}'
 
 
 async def start_monitoring(
-        message_handler: callable,
-        message: Message,
-        module: BotModule,
+        handler: str,
         social_network: str,
         nickname: str,
         media_type: str,
 ) -> None:
+    """
+    Checks watched account for new media and sends them to all its subscribers.
+
+    Media are fetched once per tick for all subscribers of the account, from the earliest
+    watermark among them, then each subscriber gets items which their own watermark hasn't seen.
+    So third-party API calls scale with watched accounts, not with subscriptions.
+
+    After each check the interval of the account is adapted, see `AdaptiveMonitoringPolling`.
+    """
+    message_handler, module = monitoring_handlers[handler]
+
+    account = MonitoredAccount(social_network=social_network, nickname=nickname, media_type=media_type)
+    if not (subscriptions := await UserMonitoringDataDBConnector.get_active_account_subscriptions(account)):
+        # all subscriptions are paused
+        return
+
+    watermarks = {}
+    for subscription in subscriptions:
+        # what was sent of the account, nothing before subscription start
+        watermark = (await UserMonitoringDataDBConnector.get_monitoring_watermark(subscription.user_id, account)
+                     or MonitoringWatermark(taken_at=subscription.start_date))
+        watermark.taken_at = max(watermark.taken_at, subscription.start_date)
+        watermarks[subscription.user_id] = watermark
+
+    polling_state = (await UserMonitoringDataDBConnector.get_polling_state(account)
+                     or monitoring_polling.get_initial_state())
+
+    # checks are let through within provider quota
+    await monitoring_check_scheduler.acquire(account, interval_s=polling_state.interval_s)
+
     custom_error_message: str = getattr(module, 'error_text', api_adapter_module.unhandled_error_text)
     try:
-        # get job start time
-        monitoring_start_date = (
-            await UserMonitoringDataDBConnector.get_last_user_monitoring(user_id=message.chat.id)).start_date
-        # get last monitoring media date from storage
-        last_monitoring_media_date = await UserMonitoringDataDBConnector.get_last_monitoring_media_date(
-            message.chat.id)
         # get last media from api source
         new_data = await get_monitoring_media_handler_func(module=module, social_network=social_network,
-                                                           media_type=media_type)(nickname,
-                                                                                  start_from=last_monitoring_media_date
-                                                                                  if last_monitoring_media_date else monitoring_start_date)
-        if new_data.items:
-            result_message = module.result_text.format(media_type=media_type, nickname=nickname)
-            await message_handler(chat_id=message.chat.id, message=result_message, media=new_data)
-            # save last monitoring media date to storage
-            await UserMonitoringDataDBConnector.save_last_monitoring_media_data(
-                date=new_data.items[-1].taken_at,
-                user_id=message.chat.id)
+                                                           media_type=media_type)(
+            nickname, start_from=min(watermark.taken_at for watermark in watermarks.values()))
     except exceptions.AccountIsPrivate:
-        await message_handler(chat_id=message.chat.id, message=api_adapter_module.error_text_account_private)
+        # subscribers are told once, then the account is checked less and less often until it's public again
+        if not polling_state.is_private_notified:
+            await _notify_subscribers(message_handler, watermarks, api_adapter_module.error_text_account_private)
+            polling_state.is_private_notified = True
+        monitoring_polling.on_private(polling_state)
+        await _save_polling_state(account, polling_state)
+        return
     except exceptions.AccountNotExist:
-        await message_handler(chat_id=message.chat.id, message=api_adapter_module.error_text_account_not_found)
-        monitoring_scheduler.remove_job(job_id=f'monitoring-{message.chat.id}-{social_network}-{nickname}')
+        await _notify_subscribers(message_handler, watermarks, api_adapter_module.error_text_account_not_found)
+        monitoring_scheduler.remove_job(job_id=get_monitoring_job_id(account))
+        await UserMonitoringDataDBConnector.delete_polling_state(account)
+        return
     except exceptions.EmptyResultsException:
-        await message_handler(chat_id=message.chat.id, message=custom_error_message)
+        await _notify_subscribers(message_handler, watermarks, custom_error_message)
+        monitoring_polling.on_checked(polling_state, taken_at=[])
+        await _save_polling_state(account, polling_state)
+        return
     except exceptions.ThirdPartyApiException:
-        await message_handler(chat_id=message.chat.id, message=module.unhandled_error_text)
+        await _notify_subscribers(message_handler, watermarks, module.unhandled_error_text)
         raise
+
+    monitoring_polling.on_checked(polling_state, taken_at=[item.taken_at for item in new_data.items])
+    await _save_polling_state(account, polling_state)
+
+    result_message = module.result_text.format(media_type=media_type, nickname=nickname)
+    for user_id, watermark in watermarks.items():
+        items, duplicates = watermark.get_new_items(new_data.items)
+        monitoring_delivery_stats.duplicates += duplicates
+        if not items:
+            continue
+        try:
+            await message_handler(chat_id=user_id, message=result_message,
+                                  media=dataclasses.replace(new_data, items=items))
+            monitoring_delivery_stats.delivered += len(items)
+
+            watermark.add(items, max_seen_ids=settings.MONITORING_SEEN_MEDIA_IDS)
+            await UserMonitoringDataDBConnector.save_monitoring_watermark(user_id, account, watermark)
+        except Exception as exc:
+            # other subscribers should get their media anyway
+            log.exception('Failed to send monitoring of %s to %s: %s', account.key, user_id, exc)
+
+
+async def _save_polling_state(account: MonitoredAccount, polling_state: MonitoringPollingState) -> None:
+    await UserMonitoringDataDBConnector.save_polling_state(account, polling_state)
+
+    # the job is moved to the new interval, at the account's phase of it
+    job_id = get_monitoring_job_id(account)
+    if (job := monitoring_scheduler.get_job(job_id)) and not monitoring_check_scheduler.is_spread(
+            job.trigger, account, interval_s=polling_state.interval_s):
+        job.reschedule(trigger=monitoring_check_scheduler.get_trigger(account, interval_s=polling_state.interval_s))
+        log.info('Monitoring of %s is checked each %s s now', account.key, polling_state.interval_s)
+
+
+async def _notify_subscribers(message_handler: MessageHandler, watermarks: dict[int, MonitoringWatermark],
+                              message: str) -> None:
+    for user_id in watermarks:
+        try:
+            await message_handler(chat_id=user_id, message=message)
+        except Exception as exc:
+            # other subscribers should be notified anyway, and polling state saved after that
+            log.exception('Failed to notify %s about monitoring: %s', user_id, exc)
+
+
+def schedule_account_monitoring(account: MonitoredAccount, handler: str) -> None:
+    """
+    Adds monitoring job of the account, if it isn't monitored yet.
+    The job runs at the account's own phase of its interval, see `MonitoringCheckScheduler`.
+    """
+    job_id = get_monitoring_job_id(account)
+    if monitoring_scheduler.get_job(job_id):
+        return
+
+    monitoring_scheduler.add_job(
+        start_monitoring,
+        trigger=monitoring_check_scheduler.get_trigger(account),
+        id=job_id,
+        name=f'Monitoring for {account.key}',
+        misfire_grace_time=None,
+        kwargs={
+            'handler': handler,
+            'social_network': account.social_network,
+            'nickname': account.nickname,
+            'media_type': account.media_type,
+        },
+    )
+
+
+def compact_account_jobs(handler: str) -> None:
+    """
+    Replaces kwargs of jobs stored before with compact ones. Pickled bot module, message handler
+    and Pyrogram message made each job a large blob, which was unpickled on each run of the job
+    and by each `get_jobs()`. Jobs of single subscriptions are moved to `start_subscription_monitoring`,
+    which accepts their subscriber, and paused until they're replaced by `migrate_subscription_jobs`.
+
+    It's run before the bot is started, so no job is run with old kwargs.
+    """
+    for job in monitoring_scheduler.get_jobs():
+        if not job.id.startswith('monitoring-') or 'module' not in job.kwargs:
+            continue
+
+        kwargs = {
+            'handler': handler,
+            'social_network': job.kwargs['social_network'],
+            'nickname': job.kwargs['nickname'],
+            'media_type': job.kwargs['media_type'],
+        }
+        if message := job.kwargs.get('message'):
+            job.modify(func=start_subscription_monitoring, kwargs={**kwargs, 'user_id': message.chat.id},
+                       next_run_time=None)
+        else:
+            job.modify(kwargs=kwargs)
+        log.info('Monitoring job %s is compacted', job.id)
+
+
+async def start_subscription_monitoring(handler: str, social_network: str, nickname: str, media_type: str,
+                                        user_id: int) -> None:
+    """
+    Job function of compacted jobs of single subscriptions. Such jobs are paused and replaced
+    by `migrate_subscription_jobs`, if one is run anyway, the subscription is moved to its account job.
+    """
+    account = MonitoredAccount(social_network=social_network, nickname=nickname, media_type=media_type)
+    await UserMonitoringDataDBConnector.add_account_subscriber(account, user_id=user_id)
+    schedule_account_monitoring(account, handler=handler)
+
+
+async def migrate_subscription_jobs(handler: str) -> None:
+    """
+    Replaces jobs of single subscriptions, which were used before, with jobs of watched accounts.
+    """
+    for job in monitoring_scheduler.get_jobs():
+        if 'user_id' not in job.kwargs:
+            continue
+
+        account = MonitoredAccount(
+            social_network=job.kwargs['social_network'],
+            nickname=job.kwargs['nickname'],
+            media_type=job.kwargs['media_type'],
+        )
+        await UserMonitoringDataDBConnector.add_account_subscriber(account, user_id=job.kwargs['user_id'])
+        schedule_account_monitoring(account, handler=handler)
+        job.remove()
+        log.info('Monitoring job %s is replaced by job of %s', job.id, account.key)
+
+
+async def spread_account_jobs() -> None:
+    """
+    Moves jobs of watched accounts with cron triggers, which were used before, to their phases
+    of their intervals. Jobs with interval triggers are already spread, they're moved to a new
+    interval by their own run, e.g. after bounds of intervals are changed.
+    """
+    for job in monitoring_scheduler.get_jobs():
+        if not job.id.startswith('monitoring-') or isinstance(job.trigger, IntervalTrigger):
+            continue
+
+        account = MonitoredAccount(
+            social_network=job.kwargs['social_network'],
+            nickname=job.kwargs['nickname'],
+            media_type=job.kwargs['media_type'],
+        )
+        polling_state = (await UserMonitoringDataDBConnector.get_polling_state(account)
+                         or monitoring_polling.get_initial_state())
+        if polling_state.interval_s != (interval_s := monitoring_polling.get_interval_s(polling_state)):
+            polling_state.interval_s = interval_s
+            await UserMonitoringDataDBConnector.save_polling_state(account, polling_state)
+
+        if not monitoring_check_scheduler.is_spread(job.trigger, account, interval_s=interval_s):
+            job.reschedule(trigger=monitoring_check_scheduler.get_trigger(account, interval_s=interval_s))
+            log.info('Monitoring job %s is moved to %s', job.id, job.next_run_time)
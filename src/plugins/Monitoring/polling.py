@@ -0,0 +1,83 @@
+import datetime
+import math
+import statistics
+import time
+from typing import Optional
+
+import settings
+from plugins.Monitoring.schemas import MonitoringPollingState
+
+
+class AdaptiveMonitoringPolling:
+    """
+    Interval of checks of watched account, adapted to how often the account posts.
+
+    Posting cadence is the median time between the latest media of the account, the account
+    is checked `cadence_share` of it, i.e. active accounts are checked more often.
+    Checks without new media back off exponentially once the account is quieter than usual
+    (or right away, if its cadence isn't known yet), so do checks of private accounts.
+    Until anything is learned the account is checked each `default_interval_s`.
+
+    Intervals are rounded to `default_interval_s * backoff ** n` within bounds, so accounts
+    share a few intervals and their checks are still spread by `MonitoringCheckScheduler`.
+    """
+
+    def __init__(self, default_interval_s: int = settings.SEND_MONITORING_INTERVAL_SECONDS,
+                 min_interval_s: int = settings.MONITORING_MIN_INTERVAL_S,
+                 max_interval_s: int = settings.MONITORING_MAX_INTERVAL_S,
+                 backoff: float = settings.MONITORING_POLLING_BACKOFF,
+                 cadence_share: float = settings.MONITORING_CADENCE_SHARE,
+                 history: int = settings.MONITORING_CADENCE_HISTORY):
+        self.default_interval_s = default_interval_s
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.backoff = backoff
+        self.cadence_share = cadence_share
+        self.history = history
+
+    def get_initial_state(self) -> MonitoringPollingState:
+        return MonitoringPollingState(interval_s=self._round_interval_s(self.default_interval_s))
+
+    def get_cadence_s(self, state: MonitoringPollingState) -> Optional[float]:
+        if len(state.posted_at) < 2:
+            return None
+        return statistics.median(later - earlier for earlier, later in zip(state.posted_at, state.posted_at[1:]))
+
+    def on_checked(self, state: MonitoringPollingState, taken_at: list[datetime.datetime]) -> None:
+        """
+        Account is checked successfully, `taken_at` are dates of all fetched media, if any.
+        """
+        last_posted_at = state.posted_at[-1] if state.posted_at else 0
+        if new_posted_at := sorted(date.timestamp() for date in taken_at if date.timestamp() > last_posted_at):
+            state.posted_at = [*state.posted_at, *new_posted_at][-self.history:]
+            state.quiet_checks = 0
+        elif not (cadence_s := self.get_cadence_s(state)) or time.time() - last_posted_at > cadence_s:
+            state.quiet_checks += 1
+
+        state.failed_checks = 0
+        state.is_private_notified = False
+        state.interval_s = self.get_interval_s(state)
+
+    def on_private(self, state: MonitoringPollingState) -> None:
+        state.failed_checks += 1
+        state.interval_s = self.get_interval_s(state)
+
+    def get_interval_s(self, state: MonitoringPollingState) -> int:
+        if state.failed_checks:
+            return self._round_interval_s(self.default_interval_s * self._get_backoff(state.failed_checks))
+
+        cadence_s = self.get_cadence_s(state)
+        interval_s = cadence_s * self.cadence_share if cadence_s else self.default_interval_s
+        return self._round_interval_s(interval_s * self._get_backoff(state.quiet_checks))
+
+    def _get_backoff(self, checks: int) -> float:
+        # no need to grow further than bounds allow
+        return self.backoff ** min(checks, 64)
+
+    def _round_interval_s(self, interval_s: float) -> int:
+        steps = round(math.log(max(interval_s, 1) / self.default_interval_s, self.backoff))
+        interval_s = self.default_interval_s * self.backoff ** steps
+        return round(min(max(interval_s, self.min_interval_s), self.max_interval_s))
+
+
+monitoring_polling = AdaptiveMonitoringPolling()
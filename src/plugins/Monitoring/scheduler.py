@@ -0,0 +1,146 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+import zlib
+from typing import Optional
+
+from apscheduler.triggers.interval import IntervalTrigger
+
+import settings
+from addons.Telemetry import (
+    get_service_measurements,
+    register_measurement_source,
+    MeasurementLabelTypeValue,
+    TelemetryMeasurement,
+)
+from common.sender import TokenBucket
+from plugins.Monitoring.schemas import MonitoredAccount
+
+# phases of all accounts are counted from the same moment
+PHASE_EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class MonitoringCheckScheduler:
+    """
+    Spreads checks of watched accounts over their intervals and smooths them to provider quota.
+
+    Each account is checked at its own phase within its interval, the phase is taken from the hash
+    of account key. So it's the same after restarts, and checks of many accounts are spread uniformly
+    instead of firing at the same wall-clock instants, as cron triggers did.
+
+    Checks which are due at once anyway (e.g. missed runs caught up after downtime) wait in a heap
+    ordered by due time and are let through at `rate` per second, the most overdue first.
+    Lag of a check is time from when it was due to when it actually started.
+    """
+
+    def __init__(self, interval_s: int = settings.SEND_MONITORING_INTERVAL_SECONDS,
+                 rate: float = settings.MONITORING_CHECK_RATE,
+                 burst: int = settings.MONITORING_CHECK_BURST):
+        self.interval_s = interval_s
+        self.rate = rate
+
+        # stats since last measurement
+        self.checks = 0
+        self._lag_s = 0.0
+        self._max_lag_s = 0.0
+
+        self._bucket = TokenBucket(rate=rate, capacity=burst)
+        self._waiters: list[tuple[float, int, asyncio.Future]] = []  # heap of (due time, seq, future)
+        self._waiters_seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task: asyncio.Task[None] | None = None
+
+        register_measurement_source(self.get_measurements)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def expected_lag_s(self) -> float:
+        """
+        Time a check which is due now is expected to wait for its turn under the quota.
+        """
+        return self.queue_depth / self.rate
+
+    def get_phase_s(self, account: MonitoredAccount, interval_s: Optional[int] = None) -> float:
+        # deterministic jitter, unlike hash() it doesn't change between processes
+        return zlib.crc32(account.key.encode()) / 2 ** 32 * (interval_s or self.interval_s)
+
+    def get_trigger(self, account: MonitoredAccount, interval_s: Optional[int] = None) -> IntervalTrigger:
+        return IntervalTrigger(
+            seconds=interval_s or self.interval_s,
+            start_date=PHASE_EPOCH + datetime.timedelta(seconds=self.get_phase_s(account, interval_s)),
+        )
+
+    def is_spread(self, trigger, account: MonitoredAccount, interval_s: Optional[int] = None) -> bool:
+        """
+        Checks that job trigger is the one of the account, i.e. has the same interval and phase.
+        """
+        expected_trigger = self.get_trigger(account, interval_s)
+        return (isinstance(trigger, IntervalTrigger)
+                and trigger.interval == expected_trigger.interval
+                and trigger.start_date == expected_trigger.start_date)
+
+    def get_due_time(self, account: MonitoredAccount, now: float, interval_s: Optional[int] = None) -> float:
+        """
+        The last moment, not later than `now`, when the account check was due.
+        """
+        start_at = PHASE_EPOCH.timestamp() + self.get_phase_s(account, interval_s)
+        return now - (now - start_at) % (interval_s or self.interval_s)
+
+    async def acquire(self, account: MonitoredAccount, interval_s: Optional[int] = None) -> None:
+        """
+        Waits for the turn of the account check.
+        """
+        due_at = self.get_due_time(account, time.time(), interval_s)
+
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (due_at, next(self._waiters_seq), future))
+        self._wakeup.set()
+        await future
+
+        lag_s = max(0.0, time.time() - due_at)
+        self.checks += 1
+        self._lag_s += lag_s
+        self._max_lag_s = max(self._max_lag_s, lag_s)
+
+    async def _pump(self) -> None:
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if wait_s := self._bucket.get_wait_s(time.monotonic()):
+                await asyncio.sleep(wait_s)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # waiting check was cancelled
+                continue
+
+            self._bucket.tokens -= 1
+            future.set_result(None)
+
+    def get_measurements(self) -> list[TelemetryMeasurement]:
+        measurements = get_service_measurements('monitoring', {
+            MeasurementLabelTypeValue.monitoring_avg_lag_ms: 1000 * self._lag_s / self.checks if self.checks else 0,
+            MeasurementLabelTypeValue.monitoring_checks: self.checks,
+            MeasurementLabelTypeValue.monitoring_expected_lag_ms: 1000 * self.expected_lag_s,
+            MeasurementLabelTypeValue.monitoring_max_lag_ms: 1000 * self._max_lag_s,
+            MeasurementLabelTypeValue.monitoring_queue_depth: self.queue_depth,
+        })
+        self.checks = 0
+        self._lag_s = 0.0
+        self._max_lag_s = 0.0
+        return measurements
+
+
+monitoring_check_scheduler = MonitoringCheckScheduler()
@@ -9,5 +9,66 @@ class UserMonitoringRequest:
     social_network: str = None
     active: bool = None
     selected_media_type: str | None = None
-    start_date: datetime.datetime = field(default=datetime.datetime.now())
-    is_confirmed: bool = None
\ No newline at end of file
+    start_date: datetime.datetime = field(default_factory=datetime.datetime.now)
+    is_confirmed: bool = None
+
+@dataclass(frozen=True)
+class MonitoredAccount:
+    """
+    Account watched by monitoring, shared by all its subscribers.
+    """
+    social_network: str
+    nickname: str
+    media_type: str
+
+    @property
+    def key(self) -> str:
+        return f'{self.social_network}-{self.nickname}-{self.media_type}'
+
+
+@dataclass
+class MonitoringWatermark:
+    """
+    What subscriber has already got from watched account: date of the last sent media
+    and ids of recently sent media, so the same media isn't sent twice,
+    e.g. when media of the same date are returned again.
+    """
+    taken_at: datetime.datetime
+    seen_ids: list[str] = field(default_factory=list)  # the most recent last
+
+    def get_new_items(self, items: list) -> tuple[list, int]:
+        """
+        Returns items not sent yet, and number of skipped items which were already sent.
+        """
+        seen_ids = set(self.seen_ids)
+        new_items = []
+        duplicates = 0
+        for item in items:
+            if not item.media_id:
+                # nothing to deduplicate by
+                if item.taken_at > self.taken_at:
+                    new_items.append(item)
+            elif item.taken_at >= self.taken_at:
+                if item.media_id in seen_ids:
+                    duplicates += 1
+                else:
+                    new_items.append(item)
+        return new_items, duplicates
+
+    def add(self, items: list, max_seen_ids: int) -> None:
+        self.taken_at = max(self.taken_at, *(item.taken_at for item in items))
+        # ids of the newest media are kept, they are the ones which may come again
+        sent_ids = [item.media_id for item in sorted(items, key=lambda item: item.taken_at) if item.media_id]
+        self.seen_ids = [*self.seen_ids, *sent_ids][-max_seen_ids:]
+
+
+@dataclass
+class MonitoringPollingState:
+    """
+    How often watched account is checked, learned from its posting history.
+    """
+    interval_s: int
+    posted_at: list[float] = field(default_factory=list)  # timestamps of the latest media, the most recent last
+    quiet_checks: int = 0  # checks without new media, since the account was expected to post
+    failed_checks: int = 0  # checks of private account in a row
+    is_private_notified: bool = False  # subscribers are told once that account became private
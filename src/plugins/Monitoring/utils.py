@@ -1,63 +1,115 @@
 import datetime
 from dataclasses import asdict
 
-from apscheduler.triggers.cron import CronTrigger
 from pyrogram import filters
 
-from common.models import ThirdPartyAPISource, ThirdPartyAPIMediaItem
+from common.models import ThirdPartyAPISource
 from helpers.clients import InstagramRapidAPIClient, TikTokRapidAPIClient
 from helpers.state import redis_connector
 from models import BotModule
-from plugins.Monitoring.schemas import UserMonitoringRequest
+from plugins.Monitoring.schemas import (
+    MonitoredAccount,
+    MonitoringPollingState,
+    MonitoringWatermark,
+    UserMonitoringRequest,
+)
 from plugins.base import get_modules_buttons, get_modules_commands
 
 
 class UserMonitoringDataDBConnector:
     """
     Handle user's monitoring requests using redis.
+
+    Each subscription is a keyed record `{user_id}_monitoring_{social_network}:{nickname}`, whose fields
+    are updated one by one, so a read or an update touches only the subscription it's about.
+    Keys of user's subscriptions are kept in a set, as well as ids of subscribers of each watched account.
     """
 
+    @staticmethod
+    def get_subscription_key(social_network: str, nickname: str) -> str:
+        return f'{social_network}:{nickname}'
+
+    @staticmethod
+    async def _get_subscription(user_id: int, subscription_key: str) -> UserMonitoringRequest | None:
+        if fields := await redis_connector.get_fields(f'{user_id}_monitoring_{subscription_key}'):
+            monitoring = UserMonitoringRequest(**fields)
+            monitoring.start_date = parse_monitoring_date(fields['start_date'])
+            return monitoring
+        return None
+
+    @staticmethod
+    async def _save_subscription_fields(user_id: int, subscription_key: str, fields: dict) -> None:
+        await redis_connector.save_fields(f'{user_id}_monitoring_{subscription_key}', fields)
+
+    @staticmethod
+    async def _delete_subscription(user_id: int, subscription_key: str) -> None:
+        await redis_connector.delete_data(f'{user_id}_monitoring_{subscription_key}')
+        await redis_connector.remove_members(f'{user_id}_monitoring_subscriptions', [subscription_key])
+
+    @staticmethod
+    async def _get_subscription_keys(user_id: int) -> set[str]:
+        if subscription_keys := await redis_connector.get_members(f'{user_id}_monitoring_subscriptions'):
+            return subscription_keys
+        return await UserMonitoringDataDBConnector._migrate_user_monitorings(user_id)
+
+    @staticmethod
+    async def _migrate_user_monitorings(user_id: int) -> set[str]:
+        """
+        Moves subscriptions saved as JSON list of user to keyed records. Returns their keys.
+        """
+        subscription_keys = set()
+        for monitoring_request in await redis_connector.get_user_data(key='monitoring_data', user_id=user_id) or []:
+            subscription_key = UserMonitoringDataDBConnector.get_subscription_key(
+                monitoring_request['social_network'], monitoring_request['nickname'])
+            await UserMonitoringDataDBConnector._save_subscription_fields(user_id, subscription_key,
+                                                                          monitoring_request)
+            subscription_keys.add(subscription_key)
+            # the last one in the list is the last one user started
+            await redis_connector.save_user_data(key='monitoring_last', data=subscription_key, user_id=user_id)
+
+        if subscription_keys:
+            await redis_connector.add_members(f'{user_id}_monitoring_subscriptions', list(subscription_keys))
+            await redis_connector.delete_user_data(key='monitoring_data', user_id=user_id)
+        return subscription_keys
+
     @staticmethod
     async def save_user_monitoring(user_request: UserMonitoringRequest, new=False) -> None:
+        user_id = user_request.user_id
+        subscription_key: str | None
         if new:
             # delete old not confirmed monitorings
-            if monitoring_requests := await redis_connector.get_user_data(key='monitoring_data',
-                                                                          user_id=user_request.user_id, ):
-                for i in monitoring_requests:
-                    user_request = UserMonitoringRequest(**i)
-                    if not user_request.is_confirmed:
-                        await UserMonitoringDataDBConnector.delete_user_monitoring_by_nickname_and_social(
-                            user_request.user_id,
-                            nickname=user_request.nickname,
-                            social_network=user_request.social_network
-                        )
-
-            if not monitoring_requests:
-                await redis_connector.save_user_data(key='monitoring_data',
-                                                     user_id=user_request.user_id,
-                                                     data=[asdict(user_request)])
-            else:
-                monitoring_requests.append(asdict(user_request))
-                await redis_connector.save_user_data(key='monitoring_data',
-                                                     user_id=user_request.user_id,
-                                                     data=monitoring_requests)
-        else:
-            monitoring_requests = await redis_connector.get_user_data(key='monitoring_data',
-                                                                      user_id=user_request.user_id, )
-            monitoring_requests[-1].update((k, v) for k, v in asdict(user_request).items() if v is not None)
-            await redis_connector.save_user_data(key='monitoring_data',
-                                                 user_id=user_request.user_id,
-                                                 data=monitoring_requests)
+            for subscription_key in await UserMonitoringDataDBConnector._get_subscription_keys(user_id):
+                subscription = await UserMonitoringDataDBConnector._get_subscription(user_id, subscription_key)
+                if not subscription or not subscription.is_confirmed:
+                    await UserMonitoringDataDBConnector._delete_subscription(user_id, subscription_key)
+
+            subscription_key = UserMonitoringDataDBConnector.get_subscription_key(user_request.social_network,
+                                                                                  user_request.nickname)
+            await redis_connector.delete_data(f'{user_id}_monitoring_{subscription_key}')
+            await UserMonitoringDataDBConnector._save_subscription_fields(user_id, subscription_key,
+                                                                          asdict(user_request))
+            await redis_connector.add_members(f'{user_id}_monitoring_subscriptions', [subscription_key])
+            await redis_connector.save_user_data(key='monitoring_last', data=subscription_key, user_id=user_id)
+        elif subscription_key := await UserMonitoringDataDBConnector._get_last_subscription_key(user_id):
+            # subscriber and start date are set once, when subscription is created
+            await UserMonitoringDataDBConnector._save_subscription_fields(
+                user_id, subscription_key, {k: v for k, v in asdict(user_request).items()
+                                            if v is not None and k not in ('user_id', 'start_date')})
+
+    @staticmethod
+    async def _get_last_subscription_key(user_id: int) -> str | None:
+        if subscription_key := await redis_connector.get_user_data(key='monitoring_last', user_id=user_id):
+            return subscription_key
+        # subscriptions may still be saved as JSON list
+        if await UserMonitoringDataDBConnector._migrate_user_monitorings(user_id):
+            return await redis_connector.get_user_data(key='monitoring_last', user_id=user_id)
+        return None
 
     @staticmethod
     async def get_last_user_monitoring(user_id: int) -> UserMonitoringRequest | None:
-        requests = await redis_connector.get_user_data(key='monitoring_data',
-                                                       user_id=user_id, )
-        if requests:
-            monitoring = UserMonitoringRequest(**requests[-1])
-            monitoring.start_date = datetime.datetime.strptime(requests[-1]['start_date'].split('.')[0],
-                                                               '%Y-%m-%d %H:%M:%S')
-            return monitoring
+        if subscription_key := await UserMonitoringDataDBConnector._get_last_subscription_key(user_id):
+            return await UserMonitoringDataDBConnector._get_subscription(user_id, subscription_key)
+        return None
 
     @staticmethod
     async def confirm_last_user_monitoring(user_id: int):
@@ -74,63 +126,115 @@ class UserMonitoringDataDBConnector:
             ))
 
     @staticmethod
-    async def deactivate_last_user_monitoring(user_id: int):
-        await UserMonitoringDataDBConnector.save_user_monitoring(
-            UserMonitoringRequest(
-                user_id=user_id,
-                active=False
-            ))
+    async def toggle_user_monitoring(user_id: int, social_network: str, nickname: str, active: bool) -> None:
+        if await UserMonitoringDataDBConnector.get_user_monitoring_by_nickname_and_social(
+                user_id, social_network=social_network, nickname=nickname):
+            await UserMonitoringDataDBConnector._save_subscription_fields(
+                user_id, UserMonitoringDataDBConnector.get_subscription_key(social_network, nickname),
+                {'active': active})
 
     @staticmethod
     async def get_all_user_monitorings(user_id: int) -> list[UserMonitoringRequest]:
         actual_monitorings = []
-        if monitoring_requests := await redis_connector.get_user_data(key='monitoring_data',
-                                                                      user_id=user_id, ):
-            for i in monitoring_requests:
-                user_request = UserMonitoringRequest(**i)
-                user_request.start_date = datetime.datetime.strptime(i['start_date'].split('.')[0],
-                                                                     '%Y-%m-%d %H:%M:%S')
-                if user_request.is_confirmed:
-                    actual_monitorings.append(user_request)
-        return actual_monitorings
+        for subscription_key in await UserMonitoringDataDBConnector._get_subscription_keys(user_id):
+            user_request = await UserMonitoringDataDBConnector._get_subscription(user_id, subscription_key)
+            if user_request and user_request.is_confirmed:
+                actual_monitorings.append(user_request)
+        # set of keys is unordered, subscriptions are shown in order they were started
+        return sorted(actual_monitorings, key=lambda monitoring: monitoring.start_date)
 
     @staticmethod
     async def get_user_monitoring_by_nickname_and_social(user_id: int, social_network: str,
                                                          nickname: str) -> UserMonitoringRequest | None:
-        requests = await UserMonitoringDataDBConnector.get_all_user_monitorings(user_id)
-        for _ in requests:
-            if _.social_network == social_network and _.nickname == nickname:
-                return _
+        subscription_key = UserMonitoringDataDBConnector.get_subscription_key(social_network, nickname)
+        user_request = await UserMonitoringDataDBConnector._get_subscription(user_id, subscription_key)
+        if not user_request and await UserMonitoringDataDBConnector._migrate_user_monitorings(user_id):
+            user_request = await UserMonitoringDataDBConnector._get_subscription(user_id, subscription_key)
+        if user_request and user_request.is_confirmed:
+            return user_request
+        return None
 
     @staticmethod
     async def delete_user_monitoring_by_nickname_and_social(user_id: int, social_network: str, nickname: str) -> None:
-        requests = await UserMonitoringDataDBConnector.get_all_user_monitorings(user_id)
-        for _ in requests:
-            if _.social_network == social_network and _.nickname == nickname:
-                requests.remove(_)
-        await redis_connector.save_user_data(key='monitoring_data', user_id=user_id, data=[asdict(_) for _ in requests])
-
-    @staticmethod
-    async def get_last_monitoring_media_date(user_id: int) -> ThirdPartyAPIMediaItem:
-        # get last media data from storage
-        monitoring_date = await redis_connector.get_user_data(
-            key='monitoring_last_media_date',
-            user_id=user_id,
-        )
-        # convert str time to datetime
-        if monitoring_date:
-            monitoring_date = datetime.datetime.strptime(monitoring_date.split('.')[0],
-                                                         '%Y-%m-%d %H:%M:%S')
-        return monitoring_date
-
-    @staticmethod
-    async def save_last_monitoring_media_data(date: datetime.datetime, user_id: int):
-        # save media data
-        await redis_connector.save_user_data(
-            key='monitoring_last_media_date',
-            data=date,
-            user_id=user_id,
-        )
+        await UserMonitoringDataDBConnector._delete_subscription(
+            user_id, UserMonitoringDataDBConnector.get_subscription_key(social_network, nickname))
+
+    @staticmethod
+    async def get_account_subscribers(account: MonitoredAccount) -> list[int]:
+        if subscribers := await redis_connector.get_members(f'monitoring_account_subscribers_{account.key}'):
+            return [int(subscriber) for subscriber in subscribers]
+
+        # before sets subscribers of account were saved as JSON list
+        if subscribers := await redis_connector.get_data(f'monitoring_subscribers_{account.key}'):
+            await redis_connector.add_members(f'monitoring_account_subscribers_{account.key}',
+                                              [str(subscriber) for subscriber in subscribers])
+            await redis_connector.delete_data(f'monitoring_subscribers_{account.key}')
+        return subscribers or []
+
+    @staticmethod
+    async def add_account_subscriber(account: MonitoredAccount, user_id: int) -> None:
+        # subscribers saved as JSON list are moved to set first
+        await UserMonitoringDataDBConnector.get_account_subscribers(account)
+        await redis_connector.add_members(f'monitoring_account_subscribers_{account.key}', [str(user_id)])
+
+    @staticmethod
+    async def remove_account_subscriber(account: MonitoredAccount, user_id: int) -> list[int]:
+        """
+        Returns the rest of subscribers.
+        """
+        await UserMonitoringDataDBConnector.get_account_subscribers(account)
+        await redis_connector.remove_members(f'monitoring_account_subscribers_{account.key}', [str(user_id)])
+        return await UserMonitoringDataDBConnector.get_account_subscribers(account)
+
+    @staticmethod
+    async def get_active_account_subscriptions(account: MonitoredAccount) -> list[UserMonitoringRequest]:
+        subscriptions = []
+        for user_id in await UserMonitoringDataDBConnector.get_account_subscribers(account):
+            subscription = await UserMonitoringDataDBConnector.get_user_monitoring_by_nickname_and_social(
+                user_id, social_network=account.social_network, nickname=account.nickname)
+            if subscription and subscription.active and subscription.selected_media_type == account.media_type:
+                subscriptions.append(subscription)
+        return subscriptions
+
+    @staticmethod
+    async def get_monitoring_watermark(user_id: int, account: MonitoredAccount) -> MonitoringWatermark | None:
+        if watermark := await redis_connector.get_user_data(key=f'monitoring_watermark_{account.key}',
+                                                            user_id=user_id):
+            return MonitoringWatermark(taken_at=parse_monitoring_date(watermark['taken_at']),
+                                       seen_ids=watermark['seen_ids'])
+
+        # before watermarks there was one last media date for all subscriptions of user
+        if monitoring_date := await redis_connector.get_user_data(key='monitoring_last_media_date', user_id=user_id):
+            return MonitoringWatermark(taken_at=parse_monitoring_date(monitoring_date))
+        return None
+
+    @staticmethod
+    async def save_monitoring_watermark(user_id: int, account: MonitoredAccount,
+                                        watermark: MonitoringWatermark) -> None:
+        await redis_connector.save_user_data(key=f'monitoring_watermark_{account.key}', data=watermark,
+                                             user_id=user_id)
+
+    @staticmethod
+    async def delete_monitoring_watermark(user_id: int, account: MonitoredAccount) -> None:
+        await redis_connector.delete_user_data(key=f'monitoring_watermark_{account.key}', user_id=user_id)
+
+    @staticmethod
+    async def get_polling_state(account: MonitoredAccount) -> MonitoringPollingState | None:
+        if polling_state := await redis_connector.get_data(f'monitoring_polling_{account.key}'):
+            return MonitoringPollingState(**polling_state)
+        return None
+
+    @staticmethod
+    async def save_polling_state(account: MonitoredAccount, polling_state: MonitoringPollingState) -> None:
+        await redis_connector.save_data(key=f'monitoring_polling_{account.key}', data=polling_state)
+
+    @staticmethod
+    async def delete_polling_state(account: MonitoredAccount) -> None:
+        await redis_connector.delete_data(f'monitoring_polling_{account.key}')
+
+
+def parse_monitoring_date(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value.split('.')[0], '%Y-%m-%d %H:%M:%S')
 
 
 def get_monitoring_media_handler_func(module: BotModule, social_network: str, media_type: str) -> callable:
@@ -146,31 +250,6 @@ def get_monitoring_media_handler_func(module: BotModule, social_network: str, me
         return TikTokRapidAPIClient().get_tiktok_user_videos_by_username
 
 
-def seconds_to_cron(interval_seconds: int) -> CronTrigger:
-    # Calculate time components
-    minutes, seconds = divmod(interval_seconds, 60)
-    hours, minutes = divmod(minutes, 60)
-    if hours > 0:
-        if minutes > 1:
-            return CronTrigger(
-                minute='*/{}'.format(minutes),
-                hour='*/{}'.format(hours) if hours > 1 else '*',
-            )
-        return CronTrigger(
-            hour='*/{}'.format(hours) if hours > 1 else '*',
-        )
-    elif minutes > 0:
-        if seconds > 1:
-            return CronTrigger(
-                second='*/{}'.format(seconds),
-                minute='*/{}'.format(minutes) if minutes > 1 else '*',
-            )
-        return CronTrigger(
-            minute='*/{}'.format(minutes) if minutes > 1 else '*',
-        )
-    return CronTrigger(second='*/{}'.format(seconds) if seconds > 1 else '*')
-
-
 def current_message_filter():
     async def filter_by_conversation(filter_, client, update) -> bool:
 
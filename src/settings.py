@@ -23,6 +23,7 @@ env = environ.FileAwareEnv(
     REDIS_PORT=(int, 6379),
 
     SEND_PLATFORM_METRICS_DATA=(bool, True),
+    SEND_SERVICE_STATS_INTERVAL_S=(int, 60),
     SEND_USER_STATS_INTERVAL_S=(int, 1800),
 
     # SMP
@@ -43,7 +44,16 @@ env = environ.FileAwareEnv(
 
     # Monitoring
     FREE_MONITORING_REQUESTS_COUNT=(int, 1),
-    SEND_MONITORING_INTERVAL_SECONDS=(int, 12 * 60 * 60),
+    MONITORING_CADENCE_HISTORY=(int, 10),  # posting times remembered per watched account to learn its cadence
+    MONITORING_CADENCE_SHARE=(float, 0.5),  # account is checked this share of its usual time between posts
+    MONITORING_CHECK_BURST=(int, 5),
+    MONITORING_CHECK_RATE=(float, 1),  # checks of watched accounts per second, keep it within provider quota
+    MONITORING_CONNECT_TIMEOUT_S=(int, 60),  # how long monitoring sends wait for bot session to be restored
+    MONITORING_MAX_INTERVAL_S=(int, 7 * 24 * 60 * 60),  # bounds of adaptive interval of account checks
+    MONITORING_MIN_INTERVAL_S=(int, 30 * 60),
+    MONITORING_POLLING_BACKOFF=(float, 2),  # interval multiplier for checks of quiet or private accounts
+    MONITORING_SEEN_MEDIA_IDS=(int, 100),  # ids of sent media remembered per subscription to not send them twice
+    SEND_MONITORING_INTERVAL_SECONDS=(int, 12 * 60 * 60),  # interval of checks until cadence of account is learned
 
     DISCORD_WEBHOOK=(str, ''),
     SUPPORT_CHAT_URL=(str),
@@ -53,14 +63,80 @@ env = environ.FileAwareEnv(
     TROTTLING_WAIT_BETWEEN_PAID_REQUESTS_S=(int, 10),
     TROTTLING_WAIT_BETWEEN_REQUESTS_S=(float, 0.5),
 
+    ANNOUNCE_BOOKKEEPING_BATCH_SIZE=(int, 5000),  # max users per DB update of announce outcomes
+    ANNOUNCE_BOOKKEEPING_INTERVAL_S=(int, 5),  # how often announce outcomes are saved to DB
+    ANNOUNCE_CHECKPOINT_INTERVAL_S=(int, 5),  # how often announcement progress is saved
     ANNOUNCE_DELAY_S=(int, 60),  # delay before announcement start
     ANNOUNCE_DELAY_BETWEEN_ANNOUNCES_H=(int, 48),
     ANNOUNCE_FEEDBACK_INTERVAL_S=(int, 10),  # delay between feedback job tics
-    ANNOUNCE_INTERVAL_S=(float, 2),  # delay between job tics
-    ANNOUNCE_PACK_LENGTH=(int, 30),  # users per one job tick
-    ANNOUNCE_WORKERS=(int, 10),
-
-    PENDING_DELAY=(int, 3)
+    ANNOUNCE_LEASE_TTL_S=(int, 30),  # announce shard is taken over by another worker after it
+    ANNOUNCE_PROGRESS_ETA_SHIFT_S=(int, 60),  # announce status is updated when ETA shifts more
+    ANNOUNCE_PROGRESS_MAX_INTERVAL_S=(int, 300),  # max delay between announce status updates
+    ANNOUNCE_PROGRESS_PERCENT_STEP=(int, 5),  # announce status is updated on each step of progress
+    ANNOUNCE_PROGRESS_RATE_WINDOW_S=(int, 60),  # announce rate and ETA are computed over the last seconds
+    ANNOUNCE_RECIPIENTS_BATCH_SIZE=(int, 1000),  # user ids fetched from DB at once
+    ANNOUNCE_RECIPIENTS_DIR=(str, '.data/announce'),  # snapshots of announce recipients
+    ANNOUNCE_RATE=(float, 25),  # initial messages per second, some of Telegram limit is left for replies
+    ANNOUNCE_RATE_BUDGET_CHUNK=(int, 5),  # messages reserved from the shared rate budget at once
+    # adaptive announce rate
+    ANNOUNCE_MAX_RATE=(float, 30),
+    ANNOUNCE_MIN_RATE=(float, 1),
+    ANNOUNCE_RATE_DECREASE=(float, 0.5),  # rate multiplier on flood wait
+    ANNOUNCE_RATE_DECREASE_STEP_S=(int, 30),  # one more decrease for each such part of flood wait
+    ANNOUNCE_RATE_INCREASE=(float, 1),
+    ANNOUNCE_RATE_INCREASE_INTERVAL_S=(int, 10),
+    ANNOUNCE_RATE_START_SHARE=(float, 0.9),  # share of the best known rate to start announce with
+    ANNOUNCE_SEGMENT_COUNT_TTL_S=(int, 300),  # how long counts of announce segments are cached for preview
+    ANNOUNCE_SEGMENT_UTM_LIMIT=(int, 10),  # max utm campaigns offered as announce segments
+    ANNOUNCE_SHARDS=(int, 4),  # parts of announce recipients, which are run by workers in parallel
+    ANNOUNCE_WORKER_POLL_INTERVAL_S=(int, 5),  # how often worker looks for unclaimed announce shards
+    ANNOUNCE_WORKER_SHARDS=(int, 4),  # max announce shards run by one worker process, incl. the bot itself
+    ANNOUNCE_WORKERS=(int, 10),  # concurrent senders
+
+    PENDING_DELAY=(int, 3),
+
+    # cache of third-party API answers
+    ANSWER_CACHE_DEFAULT_TTL_S=(int, 60 * 60),  # for answers without media URLs expiration
+    ANSWER_CACHE_FEED_MAX_TTL_S=(int, 5 * 60),  # for frequently changed results, e.g. stories
+    ANSWER_CACHE_MAX_TTL_S=(int, 24 * 60 * 60),
+    ANSWER_CACHE_REFRESH_AHEAD_S=(int, 15 * 60),
+    ANSWER_CACHE_REFRESH_CONCURRENCY=(int, 5),  # max answers re-requested at once
+    ANSWER_CACHE_REFRESH_INTERVAL_S=(int, 60),
+    ANSWER_CACHE_SIZE=(int, 5000),
+    CDN_URL_EXPIRY_MARGIN_S=(int, 10 * 60),  # media URL is treated as expired this time before real expiration
+
+    # disk cache to relay media which Telegram can't fetch by URL
+    MEDIA_RELAY_CACHE_DIR=(str, '.data/media-relay'),
+    MEDIA_RELAY_CACHE_MAX_MB=(int, 2048),
+    MEDIA_RELAY_CHUNK_SIZE_KB=(int, 256),
+    MEDIA_RELAY_MAX_FILE_MB=(int, 500),
+
+    # media sending
+    MEDIA_PIPELINE_PREFETCH=(int, 20),  # max number of media prepared ahead of sending
+    # media probing before sending
+    MEDIA_PROBE_CACHE_SIZE=(int, 10000),
+    MEDIA_PROBE_CACHE_TTL_S=(int, 10 * 60),
+    MEDIA_PROBE_CONCURRENCY=(int, 10),
+    MEDIA_PROBE_TIMEOUT_S=(float, 5),
+
+    # updates dispatcher
+    DISPATCHER_MAILBOX_SIZE=(int, 20),  # max pending updates per user
+    DISPATCHER_WORKERS=(int, 16),
+
+    # outbound messages scheduler, Telegram limits are ~30 msg/s in total and ~1 msg/s per chat
+    SEND_CHAT_BURST=(int, 3),
+    SEND_CHAT_RATE=(float, 1),
+    SEND_FLOOD_RETRIES=(int, 2),
+    SEND_GLOBAL_BURST=(int, 30),
+    SEND_GLOBAL_RATE=(float, 30),
+    SEND_MAX_CHAT_BUCKETS=(int, 10000),
+    SEND_MAX_FLOOD_WAIT_S=(int, 60),  # longer flood waits are not retried
+
+    # admission control for media requests
+    ADMISSION_DRAIN_WINDOW_S=(int, 120),  # window to calculate rate of completed requests
+    ADMISSION_MAX_QUEUE_DEPTH=(int, 100),
+    ADMISSION_MAX_USER_QUEUED=(int, 3),
+    ADMISSION_MAX_WAIT_S=(int, 180),
 )
 
 # read .env file
@@ -109,33 +185,103 @@ DISCORD_WEBHOOK = env('DISCORD_WEBHOOK')
 SUPPORT_CHAT_URL = env('SUPPORT_CHAT_URL')
 
 TELEGRAM_MAX_INLINE_BUTTON_ROWS = 30
+TELEGRAM_MAX_PHOTO_SIZE_MB = 10  # bigger photos can be sent only as documents
+TELEGRAM_MAX_URL_FILE_SIZE_MB = 20  # max size of non-photo media sent by URL
+TELEGRAM_MAX_URL_PHOTO_SIZE_MB = 5
 TELEGRAM_FLOOD_CONTROL_PAUSE_S = env('TELEGRAM_FLOOD_CONTROL_PAUSE_S')
 
 SEND_PLATFORM_METRICS_DATA = env('SEND_PLATFORM_METRICS_DATA')
+SEND_SERVICE_STATS_INTERVAL_S = env('SEND_SERVICE_STATS_INTERVAL_S')
 SEND_USER_STATS_INTERVAL_S = env('SEND_USER_STATS_INTERVAL_S')
 
 TROTTLING_WAIT_BETWEEN_PAID_REQUESTS_S = env('TROTTLING_WAIT_BETWEEN_PAID_REQUESTS_S')
 TROTTLING_WAIT_BETWEEN_REQUESTS_S = env('TROTTLING_WAIT_BETWEEN_REQUESTS_S')
 
+ANNOUNCE_BOOKKEEPING_BATCH_SIZE = env('ANNOUNCE_BOOKKEEPING_BATCH_SIZE')
+ANNOUNCE_BOOKKEEPING_INTERVAL_S = env('ANNOUNCE_BOOKKEEPING_INTERVAL_S')
+ANNOUNCE_CHECKPOINT_INTERVAL_S = env('ANNOUNCE_CHECKPOINT_INTERVAL_S')
 ANNOUNCE_DELAY_S = env('ANNOUNCE_DELAY_S')
-ANNOUNCE_INTERVAL_S = env('ANNOUNCE_INTERVAL_S')
 ANNOUNCE_FEEDBACK_INTERVAL_S = env('ANNOUNCE_FEEDBACK_INTERVAL_S')
-ANNOUNCE_PACK_LENGTH = env('ANNOUNCE_PACK_LENGTH')
 ANNOUNCE_DELAY_BETWEEN_ANNOUNCES_H = env('ANNOUNCE_DELAY_BETWEEN_ANNOUNCES_H')
+ANNOUNCE_LEASE_TTL_S = env('ANNOUNCE_LEASE_TTL_S')
+ANNOUNCE_PROGRESS_ETA_SHIFT_S = env('ANNOUNCE_PROGRESS_ETA_SHIFT_S')
+ANNOUNCE_PROGRESS_MAX_INTERVAL_S = env('ANNOUNCE_PROGRESS_MAX_INTERVAL_S')
+ANNOUNCE_PROGRESS_PERCENT_STEP = env('ANNOUNCE_PROGRESS_PERCENT_STEP')
+ANNOUNCE_PROGRESS_RATE_WINDOW_S = env('ANNOUNCE_PROGRESS_RATE_WINDOW_S')
+ANNOUNCE_MAX_RATE = env('ANNOUNCE_MAX_RATE')
+ANNOUNCE_MIN_RATE = env('ANNOUNCE_MIN_RATE')
+ANNOUNCE_RATE = env('ANNOUNCE_RATE')
+ANNOUNCE_RATE_BUDGET_CHUNK = env('ANNOUNCE_RATE_BUDGET_CHUNK')
+ANNOUNCE_RECIPIENTS_BATCH_SIZE = env('ANNOUNCE_RECIPIENTS_BATCH_SIZE')
+ANNOUNCE_RECIPIENTS_DIR = env('ANNOUNCE_RECIPIENTS_DIR')
+ANNOUNCE_RATE_DECREASE = env('ANNOUNCE_RATE_DECREASE')
+ANNOUNCE_RATE_DECREASE_STEP_S = env('ANNOUNCE_RATE_DECREASE_STEP_S')
+ANNOUNCE_RATE_INCREASE = env('ANNOUNCE_RATE_INCREASE')
+ANNOUNCE_RATE_INCREASE_INTERVAL_S = env('ANNOUNCE_RATE_INCREASE_INTERVAL_S')
+ANNOUNCE_RATE_START_SHARE = env('ANNOUNCE_RATE_START_SHARE')
+ANNOUNCE_SEGMENT_COUNT_TTL_S = env('ANNOUNCE_SEGMENT_COUNT_TTL_S')
+ANNOUNCE_SEGMENT_UTM_LIMIT = env('ANNOUNCE_SEGMENT_UTM_LIMIT')
+ANNOUNCE_SHARDS = env('ANNOUNCE_SHARDS')
+ANNOUNCE_WORKER_POLL_INTERVAL_S = env('ANNOUNCE_WORKER_POLL_INTERVAL_S')
+ANNOUNCE_WORKER_SHARDS = env('ANNOUNCE_WORKER_SHARDS')
 ANNOUNCE_WORKERS = env('ANNOUNCE_WORKERS')
 
 SEND_MONITORING_INTERVAL_SECONDS = env('SEND_MONITORING_INTERVAL_SECONDS')
 FREE_MONITORING_REQUESTS_COUNT = env('FREE_MONITORING_REQUESTS_COUNT')
+MONITORING_CADENCE_HISTORY = env('MONITORING_CADENCE_HISTORY')
+MONITORING_CADENCE_SHARE = env('MONITORING_CADENCE_SHARE')
+MONITORING_CHECK_BURST = env('MONITORING_CHECK_BURST')
+MONITORING_CHECK_RATE = env('MONITORING_CHECK_RATE')
+MONITORING_CONNECT_TIMEOUT_S = env('MONITORING_CONNECT_TIMEOUT_S')
+MONITORING_MAX_INTERVAL_S = env('MONITORING_MAX_INTERVAL_S')
+MONITORING_MIN_INTERVAL_S = env('MONITORING_MIN_INTERVAL_S')
+MONITORING_POLLING_BACKOFF = env('MONITORING_POLLING_BACKOFF')
+MONITORING_SEEN_MEDIA_IDS = env('MONITORING_SEEN_MEDIA_IDS')
 
 PENDING_DELAY = env('PENDING_DELAY')
 
+ANSWER_CACHE_DEFAULT_TTL_S = env('ANSWER_CACHE_DEFAULT_TTL_S')
+ANSWER_CACHE_FEED_MAX_TTL_S = env('ANSWER_CACHE_FEED_MAX_TTL_S')
+ANSWER_CACHE_MAX_TTL_S = env('ANSWER_CACHE_MAX_TTL_S')
+ANSWER_CACHE_REFRESH_AHEAD_S = env('ANSWER_CACHE_REFRESH_AHEAD_S')
+ANSWER_CACHE_REFRESH_CONCURRENCY = env('ANSWER_CACHE_REFRESH_CONCURRENCY')
+ANSWER_CACHE_REFRESH_INTERVAL_S = env('ANSWER_CACHE_REFRESH_INTERVAL_S')
+ANSWER_CACHE_SIZE = env('ANSWER_CACHE_SIZE')
+CDN_URL_EXPIRY_MARGIN_S = env('CDN_URL_EXPIRY_MARGIN_S')
+
+MEDIA_RELAY_CACHE_DIR = env('MEDIA_RELAY_CACHE_DIR')
+MEDIA_RELAY_CACHE_MAX_MB = env('MEDIA_RELAY_CACHE_MAX_MB')
+MEDIA_RELAY_CHUNK_SIZE_KB = env('MEDIA_RELAY_CHUNK_SIZE_KB')
+MEDIA_RELAY_MAX_FILE_MB = env('MEDIA_RELAY_MAX_FILE_MB')
+
+MEDIA_PIPELINE_PREFETCH = env('MEDIA_PIPELINE_PREFETCH')
+
+MEDIA_PROBE_CACHE_SIZE = env('MEDIA_PROBE_CACHE_SIZE')
+MEDIA_PROBE_CACHE_TTL_S = env('MEDIA_PROBE_CACHE_TTL_S')
+MEDIA_PROBE_CONCURRENCY = env('MEDIA_PROBE_CONCURRENCY')
+MEDIA_PROBE_TIMEOUT_S = env('MEDIA_PROBE_TIMEOUT_S')
+
+DISPATCHER_MAILBOX_SIZE = env('DISPATCHER_MAILBOX_SIZE')
+DISPATCHER_WORKERS = env('DISPATCHER_WORKERS')
+
+SEND_CHAT_BURST = env('SEND_CHAT_BURST')
+SEND_CHAT_RATE = env('SEND_CHAT_RATE')
+SEND_FLOOD_RETRIES = env('SEND_FLOOD_RETRIES')
+SEND_GLOBAL_BURST = env('SEND_GLOBAL_BURST')
+SEND_GLOBAL_RATE = env('SEND_GLOBAL_RATE')
+SEND_MAX_CHAT_BUCKETS = env('SEND_MAX_CHAT_BUCKETS')
+SEND_MAX_FLOOD_WAIT_S = env('SEND_MAX_FLOOD_WAIT_S')
+
+ADMISSION_DRAIN_WINDOW_S = env('ADMISSION_DRAIN_WINDOW_S')
+ADMISSION_MAX_QUEUE_DEPTH = env('ADMISSION_MAX_QUEUE_DEPTH')
+ADMISSION_MAX_USER_QUEUED = env('ADMISSION_MAX_USER_QUEUED')
+ADMISSION_MAX_WAIT_S = env('ADMISSION_MAX_WAIT_S')
+
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 SECONDS_BETWEEN_ADMIN_NOTIFICATIONS = 60 * 10  # 10 minutes
 DAY_BORDER_HOUR = 14
 
-ANNOUNCE_PACK_LENGTH = 20
-
 CONFIG_PATH = 'configs/creoscan.yaml'
 PLUGINS = [
     'Introduction.core',
@@ -0,0 +1,31 @@
+import os
+import pathlib
+import sys
+import tempfile
+
+SRC_PATH = pathlib.Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_PATH))
+
+# settings are read from environment on import, mandatory ones aren't used by tests
+MANDATORY_ENVS = {
+    'API_ID': '0',
+    'API_HASH': 'test',
+    'BOT_TOKEN': '0:test',
+    'DB_PASSWORD': 'test',
+    'SMP_APP_ID': 'test',
+    'SMP_APP_SECRET': 'test',
+    'SUPPORT_CHAT_URL': 'test',
+}
+for name, value in MANDATORY_ENVS.items():
+    os.environ.setdefault(name, value)
+
+# module-level caches keep their files out of the working tree
+os.environ.setdefault('MEDIA_RELAY_CACHE_DIR', tempfile.mkdtemp(prefix='media-relay-'))
+
+# bot config is kept in a separate repository, modules are configured with empty one
+config_path = pathlib.Path(tempfile.mkdtemp(prefix='configs-')) / 'creoscan.yaml'
+config_path.write_text('')
+
+import settings  # noqa: E402
+
+settings.CONFIG_PATH = str(config_path)
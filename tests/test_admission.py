@@ -0,0 +1,85 @@
+import types
+
+import pytest
+
+from addons import Admission
+from addons.Admission import AdmissionController
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(Admission, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def make_controller(**limits):
+    return AdmissionController('test', **{
+        'max_queue_depth': 100,
+        'max_wait_s': 10 ** 6,
+        'max_user_queued': 100,
+        'drain_window_s': 120,
+        **limits,
+    })
+
+
+def test_requests_are_rejected_when_queue_is_full(clock):
+    controller = make_controller(max_queue_depth=3)
+
+    assert [controller.admit(user_id, request_key=user_id) for user_id in range(3)] == [None] * 3
+    retry_after_s = controller.admit(user_id=3, request_key=3)
+
+    assert retry_after_s and retry_after_s > 0
+    assert controller.queue_depth == 3
+    assert (controller.accepted, controller.rejected) == (3, 1)
+
+
+def test_requests_of_user_are_limited(clock):
+    controller = make_controller(max_user_queued=2)
+
+    assert controller.admit(user_id=1, request_key=1) is None
+    assert controller.admit(user_id=1, request_key=2) is None
+    assert controller.admit(user_id=1, request_key=3) is not None
+    # other users aren't affected
+    assert controller.admit(user_id=2, request_key=4) is None
+
+
+def test_request_is_released_once(clock):
+    controller = make_controller(max_user_queued=1)
+    controller.admit(user_id=1, request_key=1)
+    controller.admit(user_id=2, request_key=2)
+
+    # both the handler and the job release the request
+    controller.release(request_key=1)
+    controller.release(request_key=1)
+
+    assert controller.queue_depth == 1
+    assert controller.admit(user_id=1, request_key=3) is None
+    assert controller.admit(user_id=2, request_key=4) is not None
+
+
+def test_stalled_queue_rejects_requests(clock):
+    controller = make_controller(max_wait_s=180)
+    assert controller.admit(user_id=1, request_key=1) is None
+
+    # nothing is completed for longer than the drain window
+    clock.now += 1000
+    retry_after_s = controller.admit(user_id=2, request_key=2)
+
+    assert controller.drain_rate == 1 / 1000
+    assert retry_after_s and retry_after_s >= 1000
+
+    controller.release(request_key=1)
+    assert controller.admit(user_id=2, request_key=2) is None
+
+
+def test_failed_requests_are_not_taken_for_drain(clock):
+    controller = make_controller()
+    controller.admit(user_id=1, request_key=1)
+    controller.admit(user_id=2, request_key=2)
+
+    clock.now += 60
+    controller.release(request_key=1, completed=False)
+
+    assert controller.queue_depth == 1
+    assert controller.drain_rate == 1 / 60
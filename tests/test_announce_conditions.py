@@ -0,0 +1,40 @@
+import datetime
+
+from common.models import AnnounceSegment
+from db.conditions import get_announce_conditions
+
+
+def test_all_users_conditions():
+    conditions, values = get_announce_conditions()
+
+    assert conditions == ('blocked = false AND announce_allowed = true '
+                          'AND (last_announced IS NULL OR last_announced < $1)')
+    assert len(values) == 1
+
+
+def test_utm_segment_conditions():
+    conditions, values = get_announce_conditions(AnnounceSegment('utm', 'x'))
+
+    assert conditions.endswith(' AND utm @> $2::text[]')
+    assert values[1:] == [['x']]
+
+
+def test_registered_segment_conditions():
+    conditions, values = get_announce_conditions(AnnounceSegment('registered', '7'))
+
+    assert conditions.endswith(' AND created_at >= $2')
+    assert datetime.datetime.now() - values[1] >= datetime.timedelta(days=7)
+
+
+def test_paid_segment_conditions():
+    conditions, values = get_announce_conditions(AnnounceSegment('paid', '1-9'))
+
+    assert conditions.endswith(' AND paid_requests_count >= $2 AND paid_requests_count <= $3')
+    assert values[1:] == [1, 9]
+
+
+def test_open_paid_segment_conditions():
+    conditions, values = get_announce_conditions(AnnounceSegment('paid', '100-'))
+
+    assert conditions.endswith(' AND paid_requests_count >= $2')
+    assert values[1:] == [100]
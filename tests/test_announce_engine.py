@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from common.models import AnnounceJobStats
+from plugins.Announce.engine import AnnounceEngine
+from plugins.Announce.rate import AdaptiveAnnounceRate
+
+
+async def iterate(user_ids):
+    for user_id in user_ids:
+        yield user_id
+
+
+def test_failed_announce_is_not_finished():
+    sent, recorded, checkpoints, finished = [], [], [], []
+
+    async def send(user_id):
+        sent.append(user_id)
+
+    async def record(outcome, user_ids):
+        recorded.extend(user_ids)
+
+    async def checkpoint(announce_checkpoint):
+        checkpoints.append(announce_checkpoint)
+
+    async def on_finish(engine):
+        finished.append(engine)
+
+    async def rate_budget():
+        if len(sent) >= 3:
+            raise ConnectionError('Redis is not available')
+
+    engine = AnnounceEngine(
+        job_id='test',
+        recipients=iterate(range(1, 101)),
+        send=send,
+        record=record,
+        job_stats=AnnounceJobStats(),
+        rate_controller=AdaptiveAnnounceRate(initial_rate=10 ** 6, max_rate=10 ** 6),
+        rate_budget=rate_budget,
+        on_finish=on_finish,
+        checkpoint=checkpoint,
+        senders=4,
+        bookkeeping_interval_s=0,
+    )
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(engine.run())
+
+    # other senders are stopped, and all sent messages are recorded
+    assert len(sent) == 3
+    assert sorted(recorded) == sorted(sent)
+    # progress is saved, but the announce is left to be resumed
+    assert checkpoints[-1].cursor == 3
+    assert not engine.is_finished
+    assert not finished
+
+
+def test_announce_cancelled_from_outside_is_not_finished():
+    sent, checkpoints, finished = [], [], []
+
+    async def send(user_id):
+        sent.append(user_id)
+        await asyncio.sleep(0.01)
+
+    async def record(outcome, user_ids):
+        pass
+
+    async def checkpoint(announce_checkpoint):
+        checkpoints.append(announce_checkpoint)
+
+    async def on_finish(engine):
+        finished.append(engine)
+
+    engine = AnnounceEngine(
+        job_id='test',
+        recipients=iterate(range(1, 101)),
+        send=send,
+        record=record,
+        job_stats=AnnounceJobStats(),
+        rate_controller=AdaptiveAnnounceRate(initial_rate=10 ** 6, max_rate=10 ** 6),
+        on_finish=on_finish,
+        checkpoint=checkpoint,
+        senders=4,
+        bookkeeping_interval_s=0,
+    )
+
+    async def run_and_shutdown():
+        task = asyncio.create_task(engine.run())
+        while len(sent) < 10:
+            await asyncio.sleep(0)
+        # e.g. the worker is stopped on shutdown
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(run_and_shutdown())
+
+    assert len(sent) < 100
+    assert checkpoints and checkpoints[-1].cursor < 100
+    assert not engine.is_finished
+    assert not finished
+
+
+def test_cancelled_announce_is_finished():
+    finished = []
+
+    async def send(user_id):
+        await asyncio.sleep(0.01)
+
+    async def record(outcome, user_ids):
+        pass
+
+    async def on_finish(engine):
+        finished.append(engine)
+
+    engine = AnnounceEngine(
+        job_id='test',
+        recipients=iterate(range(1, 101)),
+        send=send,
+        record=record,
+        job_stats=AnnounceJobStats(),
+        rate_controller=AdaptiveAnnounceRate(initial_rate=10 ** 6, max_rate=10 ** 6),
+        on_finish=on_finish,
+        senders=4,
+        bookkeeping_interval_s=0,
+    )
+
+    async def run_and_cancel():
+        task = asyncio.create_task(engine.run())
+        await asyncio.sleep(0.05)
+        # e.g. the announce is cancelled by admin
+        engine.cancel()
+        await task
+
+    asyncio.run(run_and_cancel())
+
+    assert engine.is_finished
+    assert finished == [engine]
@@ -0,0 +1,51 @@
+import asyncio
+import itertools
+
+from pyrogram import errors, raw
+
+from plugins.Announce.payload import AnnouncePayload, AnnouncePayloadKind
+
+
+class FakeClient:
+    """
+    Accepts zero access hash only for users in `zero_hash_user_ids`, like Telegram
+    accepts it for users who have started the bot.
+    """
+
+    def __init__(self, zero_hash_user_ids: set[int]):
+        self.zero_hash_user_ids = zero_hash_user_ids
+        self.sent_to: list[raw.types.InputPeerUser] = []
+        self.resolved: list[int] = []
+        self._random_ids = itertools.count(1)
+
+    def rnd_id(self) -> int:
+        return next(self._random_ids)
+
+    async def resolve_peer(self, peer_id: int) -> raw.types.InputPeerUser:
+        self.resolved.append(peer_id)
+        return raw.types.InputPeerUser(user_id=peer_id, access_hash=42)
+
+    async def invoke(self, query: raw.functions.messages.SendMessage) -> None:
+        if not query.peer.access_hash and query.peer.user_id not in self.zero_hash_user_ids:
+            raise errors.PeerIdInvalid()
+        self.sent_to.append(query.peer)
+
+
+def test_text_is_sent_with_zero_access_hash():
+    client = FakeClient(zero_hash_user_ids={1})
+    payload = AnnouncePayload(kind=AnnouncePayloadKind.text, text='Hello')
+
+    asyncio.run(payload.send(client=client, user_id=1))
+
+    assert client.sent_to == [raw.types.InputPeerUser(user_id=1, access_hash=0)]
+    assert not client.resolved
+
+
+def test_peer_is_resolved_when_zero_access_hash_is_rejected():
+    client = FakeClient(zero_hash_user_ids=set())
+    payload = AnnouncePayload(kind=AnnouncePayloadKind.text, text='Hello')
+
+    asyncio.run(payload.send(client=client, user_id=2))
+
+    assert client.sent_to == [raw.types.InputPeerUser(user_id=2, access_hash=42)]
+    assert client.resolved == [2]
@@ -0,0 +1,42 @@
+import asyncio
+
+from common.models import ThirdPartyAPIClientAnswer, ThirdPartyAPIMediaItem, ThirdPartyAPISource
+from helpers.cache import ThirdPartyAPIAnswerCache
+
+
+def make_answer(media_url: str) -> ThirdPartyAPIClientAnswer:
+    return ThirdPartyAPIClientAnswer(
+        source=ThirdPartyAPISource.instagram, items=[ThirdPartyAPIMediaItem(media_url=media_url)])
+
+
+def test_expiring_answers_are_refreshed_concurrently_within_limit():
+    # answers without URL expiration are kept for default TTL, which is within refresh window
+    cache = ThirdPartyAPIAnswerCache(default_ttl_s=60, refresh_ahead_s=120, refresh_concurrency=3)
+    running, max_running = set(), 0
+
+    def make_refresh(key):
+        async def refresh():
+            nonlocal max_running
+            running.add(key)
+            max_running = max(max_running, len(running))
+            await asyncio.sleep(0.01)
+            running.discard(key)
+            if key == 'failing':
+                raise ConnectionError('API is not available')
+            return make_answer(f'https://cdn.example/{key}-refreshed.jpg')
+        return refresh
+
+    keys = [f'user{i}' for i in range(9)] + ['failing', 'not-used']
+    for key in keys:
+        cache.save(key, make_answer(f'https://cdn.example/{key}.jpg'), refresh=make_refresh(key), max_ttl_s=3600)
+        if key != 'not-used':
+            cache.get(key)
+
+    asyncio.run(cache.refresh_expiring())
+
+    assert max_running == 3
+    assert cache.refreshed == 9
+    assert cache.get('user0').items[0].media_url == 'https://cdn.example/user0-refreshed.jpg'
+    # old answers are kept until they expire
+    assert cache.get('failing').items[0].media_url == 'https://cdn.example/failing.jpg'
+    assert cache.get('not-used').items[0].media_url == 'https://cdn.example/not-used.jpg'
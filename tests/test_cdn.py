@@ -0,0 +1,74 @@
+import datetime
+import time
+
+import pytest
+
+from common.models import ThirdPartyAPIClientAnswer, ThirdPartyAPIMediaItem, ThirdPartyAPISource
+from helpers.cdn import get_answer_ttl_s, get_url_expires_at, get_url_ttl_s
+
+INSTAGRAM_URL = (
+    'https://scontent-ams2-1.cdninstagram.com/v/t51.2885-15/357391178_1002651750744373_6316279183126357744_n.jpg'
+    '?stp=dst-jpg_e35_p1080x1080&_nc_ht=scontent-ams2-1.cdninstagram.com&_nc_cat=1&_nc_ohc=qoFYPQgSmaEAX_0cn3t'
+    '&edm=ACWDqb8BAAAA&ccb=7-5&ig_cache_key=MzEzNTk4NDUxMzQ4OTI0MzY0NQ%3D%3D.2-ccb7-5'
+    '&oh=00_AfBV5zcwXW7V1T4RVIbDLZmsXqVOP5H3SvKl4wK4K4DOHg&oe=64A7C53F&_nc_sid=ee9879'
+)
+TIKTOK_WEBAPP_URL = (
+    'https://v16-webapp-prime.tiktok.com/video/tos/useast2a/tos-useast2a-pve-0068/oQbAnDeAIE2nfgRBQhEPAfzQlQ7SbKbB/'
+    '?a=1988&ch=0&cr=0&dr=0&lr=tiktok_m&cd=0%7C0%7C1%7C0&cv=1&br=2536&bt=1268&cs=0&ds=3&ft=_RwJrBZZq8ZmoJ~1Hc_vjQYGTA'
+    '&mime_type=video_mp4&qs=0&rc=ZjY5OGdnPDY3aTw3NmVkNkBpM3hrbjw6ZnZvbDMzNzczM0BfLy4xMy8uNjYxMTYuYjEtYSMuZW5kcjRfbjZgLS1'
+    'kMTZzcw%3D%3D&btag=e00088000&expire=1688644151&l=2023070605482913E2BA5B1A1D2BE4CB47&ply_type=2&policy=2'
+    '&signature=0c7bb2e1bd7b2b4a48ac1a1d0e0b5a1c&tk=tt_chain_token'
+)
+TIKTOK_API_URL = (
+    'https://v16m.tiktokcdn.com/2f3c9bd8a9f2d3bb9e0bba4c4c2b49e1/64a6f6b7/video/tos/useast2a/tos-useast2a-pve-0068'
+    '/o0Vg5ID7BnQgAzeflRcC0yQAfEhGqMbBAeFLMx/?a=1233&ch=0&cr=0&dr=0&er=0&lr=all&net=0&cd=0%7C0%7C0%7C0&cv=1&br=2230'
+    '&bt=1115&cs=0&ds=6&ft=iJOG.y7oZoi0PD1qRJdXg9wcFdi7aJEeC~&mime_type=video_mp4&qs=0&rc=OTlpOmY8OzlnZDg0aWdkOkBpM'
+    '3F3NHI6ZjVkbDMzNzczM0BjXjAtMWE2XjAxNTIzYjE0YSNjLmVjcjRvbzFgLS1kMTZzcw%3D%3D&l=2023070605482913E2BA5B1A1D2BE4CB47'
+    '&btag=e00088000&cc=3&x-expires=1688644151&x-signature=Y2Hh4l8Q2Bz2cYqH5NG%2FhNqkFo8%3D'
+)
+
+
+def with_expiration(url: str, key: str, value: str) -> str:
+    query_start = url.index(f'&{key}=') + len(key) + 2
+    query_end = url.find('&', query_start)
+    return url[:query_start] + value + (url[query_end:] if query_end != -1 else '')
+
+
+def test_instagram_expiration_is_parsed_from_hex_timestamp():
+    assert get_url_expires_at(INSTAGRAM_URL) == datetime.datetime.fromtimestamp(0x64A7C53F)
+
+
+@pytest.mark.parametrize('url', [TIKTOK_WEBAPP_URL, TIKTOK_API_URL])
+def test_tiktok_expiration_is_parsed_from_timestamp(url):
+    assert get_url_expires_at(url) == datetime.datetime.fromtimestamp(1688644151)
+
+
+@pytest.mark.parametrize('url', [
+    'https://scontent-ams2-1.cdninstagram.com/v/t51.2885-19/44884218_345707102882519_2446069589734326272_n.jpg',
+    with_expiration(INSTAGRAM_URL, 'oe', 'not-hex'),
+    with_expiration(TIKTOK_WEBAPP_URL, 'expire', ''),
+    with_expiration(TIKTOK_API_URL, 'x-expires', '9' * 30),
+])
+def test_url_without_valid_expiration_is_not_expiring(url):
+    assert get_url_expires_at(url) is None
+    assert get_url_ttl_s(url, default_ttl_s=3600) == 3600
+
+
+def test_url_is_cached_until_expiration_minus_margin():
+    url = with_expiration(INSTAGRAM_URL, 'oe', format(int(time.time()) + 3600, 'X'))
+
+    assert get_url_ttl_s(url, default_ttl_s=60, margin_s=600) == pytest.approx(3000, abs=2)
+    # expired URL isn't cached at all
+    assert get_url_ttl_s(INSTAGRAM_URL, default_ttl_s=60, margin_s=600) == 0
+
+
+def test_answer_is_cached_until_its_first_url_expires():
+    now = int(time.time())
+    answer = ThirdPartyAPIClientAnswer(source=ThirdPartyAPISource.instagram, items=[
+        ThirdPartyAPIMediaItem(media_url=with_expiration(INSTAGRAM_URL, 'oe', format(now + 7200, 'X'))),
+        ThirdPartyAPIMediaItem(media_url=with_expiration(TIKTOK_API_URL, 'x-expires', str(now + 3600))),
+    ])
+
+    assert get_answer_ttl_s(answer, default_ttl_s=60) == pytest.approx(3600 - 600, abs=2)
+    assert get_answer_ttl_s(
+        ThirdPartyAPIClientAnswer(source=ThirdPartyAPISource.tiktok), default_ttl_s=60) == 60
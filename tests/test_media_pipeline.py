@@ -0,0 +1,127 @@
+import asyncio
+import contextlib
+import sys
+import types
+
+import pytest
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from pyrogram.types import InputMediaPhoto, InputMediaVideo
+
+from common.models import MediaSendStrategy, ThirdPartyAPIMediaItem, ThirdPartyAPIMediaType
+from helpers.probe import MediaProbe
+
+
+class FakeMessage:
+    def __init__(self):
+        self.media_groups = []
+        self.documents = []
+        self.media_group_sent = asyncio.Event()
+
+    async def reply_media_group(self, media):
+        self.media_groups.append(media)
+        self.media_group_sent.set()
+
+    async def reply_document(self, document):
+        self.documents.append(document)
+
+
+class FakeRelayCache:
+    """
+    Relays media to `/cache/<file name>`, fails to relay URLs from `failing_urls`.
+    """
+
+    def __init__(self, failing_urls=()):
+        self.failing_urls = set(failing_urls)
+        self.opened = []
+        self.closed = []
+
+    @contextlib.asynccontextmanager
+    async def open(self, url, media_type):
+        if url in self.failing_urls:
+            raise ConnectionError('CDN is not available')
+        file_path = '/cache/' + url.rsplit('/', 1)[-1]
+        self.opened.append(file_path)
+        try:
+            yield file_path
+        finally:
+            self.closed.append(file_path)
+
+
+def make_items(count):
+    return [ThirdPartyAPIMediaItem(media_type=ThirdPartyAPIMediaType.photo, media_url=f'https://cdn.example/{i}.jpg')
+            for i in range(count)]
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    # DB is connected on import of its connector, which isn't used by the pipeline
+    monkeypatch.setitem(sys.modules, 'db.connector', types.SimpleNamespace(database_connector=None))
+    # scheduler of user jobs is started on import, it isn't used by the pipeline either
+    monkeypatch.setattr(AsyncIOScheduler, 'start', lambda self: None)
+    import jobs
+
+    return jobs
+
+
+def test_media_failed_to_relay_is_sent_by_url(jobs, monkeypatch):
+    photo = ThirdPartyAPIMediaItem(media_type=ThirdPartyAPIMediaType.photo, media_url='https://cdn.example/photo.jpg')
+    video = ThirdPartyAPIMediaItem(media_type=ThirdPartyAPIMediaType.video, media_url='https://cdn.example/video.mp4')
+    relay_cache = FakeRelayCache(failing_urls=[video.media_url])
+
+    async def probe_item(item, session):
+        return MediaProbe(send_strategy=MediaSendStrategy.relay)
+
+    monkeypatch.setattr(jobs.media_prober, 'probe_item', probe_item)
+    monkeypatch.setattr(jobs, 'media_relay_cache', relay_cache)
+
+    async def reply():
+        message = FakeMessage()
+        await jobs._reply_media_pipeline(message=message, items=[photo, video], module=types.SimpleNamespace())
+        return message
+
+    message = asyncio.run(reply())
+
+    [media_group] = message.media_groups
+    assert isinstance(media_group[0], InputMediaPhoto) and media_group[0].media == '/cache/photo.jpg'
+    # the rest of media isn't affected by the failed relay
+    assert isinstance(media_group[1], InputMediaVideo) and media_group[1].media == video.media_url
+    # relayed file is kept until media is sent
+    assert relay_cache.closed == ['/cache/photo.jpg']
+
+
+def test_cancelled_pipeline_stops_preparations_and_closes_relayed_files(jobs, monkeypatch):
+    items = make_items(25)
+    relay_cache = FakeRelayCache()
+    cancelled_probes = []
+
+    async def probe_item(item, session):
+        if items.index(item) >= 10:
+            # CDN hangs after the first media group
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled_probes.append(item)
+                raise
+        return MediaProbe(send_strategy=MediaSendStrategy.relay)
+
+    monkeypatch.setattr(jobs.media_prober, 'probe_item', probe_item)
+    monkeypatch.setattr(jobs, 'media_relay_cache', relay_cache)
+
+    async def reply_and_cancel():
+        message = FakeMessage()
+        task = asyncio.create_task(
+            jobs._reply_media_pipeline(message=message, items=items, module=types.SimpleNamespace()))
+        await asyncio.wait_for(message.media_group_sent.wait(), timeout=1)
+        # e.g. the request handler is stopped on shutdown
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return message
+
+    message = asyncio.run(reply_and_cancel())
+
+    assert len(message.media_groups) == 1 and len(message.media_groups[0]) == 10
+    # items prepared ahead are stopped, the rest aren't prepared at all
+    assert cancelled_probes
+    assert len(cancelled_probes) <= jobs.settings.MEDIA_PIPELINE_PREFETCH
+    assert sorted(relay_cache.closed) == sorted(relay_cache.opened)
@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from helpers.relay import MediaRelayCache
+
+FILE_SIZE = 400 * 1024
+
+
+async def serve_media(downloads: list) -> TestServer:
+    async def get_media(request: web.Request) -> web.Response:
+        downloads.append(request.path)
+        await asyncio.sleep(0.05)
+        return web.Response(body=b'x' * FILE_SIZE)
+
+    app = web.Application()
+    app.router.add_get('/{name}', get_media)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_concurrent_opens_share_download(tmp_path):
+    downloads = []
+
+    async def open_concurrently():
+        server = await serve_media(downloads)
+        cache = MediaRelayCache(path=str(tmp_path), max_size_mb=10)
+
+        async def open_media(query: str) -> int:
+            # re-signed URLs of the same media
+            async with cache.open(str(server.make_url(f'/media.jpg?sig={query}'))) as path:
+                return os.path.getsize(path)
+
+        try:
+            return cache, await asyncio.gather(*(open_media(str(ind)) for ind in range(5)))
+        finally:
+            await server.close()
+
+    cache, sizes = asyncio.run(open_concurrently())
+
+    assert downloads == ['/media.jpg']
+    assert sizes == [FILE_SIZE] * 5
+    assert cache.misses == 1
+    assert cache.shared_downloads == 4
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    downloads = []
+
+    async def open_one_by_one():
+        server = await serve_media(downloads)
+        # fits two files
+        cache = MediaRelayCache(path=str(tmp_path), max_size_mb=1)
+        try:
+            for name in ('first', 'second', 'first', 'third', 'first'):
+                async with cache.open(str(server.make_url(f'/{name}.jpg'))):
+                    pass
+        finally:
+            await server.close()
+        return cache
+
+    cache = asyncio.run(open_one_by_one())
+
+    # `second` is evicted by `third`, `first` is used more recently
+    assert downloads == ['/first.jpg', '/second.jpg', '/third.jpg']
+    assert cache.hits == 2
+    assert cache.size == 2 * FILE_SIZE
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_pinned_files_exceed_cache_size(tmp_path):
+    downloads = []
+
+    async def open_nested():
+        server = await serve_media(downloads)
+        # fits one file
+        cache = MediaRelayCache(path=str(tmp_path), max_size_mb=0.5)
+        async def open_second(first_path: str) -> None:
+            async with cache.open(str(server.make_url('/second.jpg'))) as second_path:
+                assert os.path.exists(first_path)
+                assert os.path.exists(second_path)
+                assert cache.size == 2 * FILE_SIZE
+
+        try:
+            async with cache.open(str(server.make_url('/first.jpg'))) as first_path:
+                # the new file isn't evicted right after download, while the cache is over its size
+                await asyncio.wait_for(open_second(first_path), timeout=1)
+        finally:
+            await server.close()
+        return cache
+
+    cache = asyncio.run(open_nested())
+
+    assert downloads == ['/first.jpg', '/second.jpg']
+    # the cache is back within its size once files are released
+    assert cache.size == FILE_SIZE
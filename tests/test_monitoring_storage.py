@@ -0,0 +1,108 @@
+import asyncio
+import json
+import sys
+import types
+from typing import Any, Optional
+
+import pytest
+
+from helpers.state import RedisConnector
+
+LEGACY_MONITORINGS = [
+    {'user_id': 1, 'nickname': 'first', 'social_network': 'instagram', 'active': True,
+     'selected_media_type': 'Посты', 'start_date': '2023-01-01 10:00:00.123456', 'is_confirmed': True},
+    {'user_id': 1, 'nickname': 'second', 'social_network': 'tiktok', 'active': False,
+     'selected_media_type': 'Видео', 'start_date': '2023-02-01 10:00:00', 'is_confirmed': True},
+]
+
+
+class InMemoryRedisConnector(RedisConnector):
+    """
+    Keeps values as Redis does: strings and hash fields as JSON, sets as strings.
+    """
+
+    def __init__(self):
+        self.values: dict[str, str] = {}
+        self.hashes: dict[str, dict[str, str]] = {}
+        self.sets: dict[str, set[str]] = {}
+
+    async def delete_data(self, key: str) -> None:
+        for store in (self.values, self.hashes, self.sets):
+            store.pop(key, None)
+
+    async def get_data(self, key: str) -> Optional[Any]:
+        if saved_state := self.values.get(key):
+            return json.loads(saved_state)
+        return None
+
+    async def save_data(self, key: str, data: Any) -> None:
+        self.values[key] = json.dumps(data, default=str)
+
+    async def get_fields(self, key: str) -> dict[str, Any]:
+        return {name: json.loads(value) for name, value in self.hashes.get(key, {}).items()}
+
+    async def save_fields(self, key: str, fields: dict[str, Any]) -> None:
+        self.hashes.setdefault(key, {}).update(
+            {name: json.dumps(value, default=str) for name, value in fields.items()})
+
+    async def get_members(self, key: str) -> set[str]:
+        return set(self.sets.get(key, set()))
+
+    async def add_members(self, key: str, members: list[str]) -> None:
+        self.sets.setdefault(key, set()).update(members)
+
+    async def remove_members(self, key: str, members: list[str]) -> None:
+        self.sets.get(key, set()).difference_update(members)
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    # DB is connected on import of its connector, which isn't used by monitoring storage
+    monkeypatch.setitem(sys.modules, 'db.connector', types.SimpleNamespace(database_connector=None))
+    from plugins.Monitoring import utils
+
+    redis = InMemoryRedisConnector()
+    monkeypatch.setattr(utils, 'redis_connector', redis)
+    return utils.UserMonitoringDataDBConnector, redis
+
+
+def test_legacy_monitorings_are_moved_to_keyed_records(storage):
+    connector, redis = storage
+    asyncio.run(redis.save_user_data(key='monitoring_data', data=LEGACY_MONITORINGS, user_id=1))
+
+    monitorings = asyncio.run(connector.get_all_user_monitorings(user_id=1))
+
+    assert [monitoring.nickname for monitoring in monitorings] == ['first', 'second']
+    assert monitorings[0].active and not monitorings[1].active
+    assert redis.sets['1_monitoring_subscriptions'] == {'instagram:first', 'tiktok:second'}
+    assert redis.hashes['1_monitoring_instagram:first']
+    assert redis.hashes['1_monitoring_tiktok:second']
+    assert '1_monitoring_data' not in redis.values
+    # the last one in the list is the last one user started
+    assert asyncio.run(connector.get_last_user_monitoring(user_id=1)).nickname == 'second'
+
+
+def test_legacy_monitoring_is_found_by_nickname(storage):
+    connector, redis = storage
+    asyncio.run(redis.save_user_data(key='monitoring_data', data=LEGACY_MONITORINGS, user_id=1))
+
+    monitoring = asyncio.run(connector.get_user_monitoring_by_nickname_and_social(
+        user_id=1, social_network='tiktok', nickname='second'))
+
+    assert monitoring.selected_media_type == 'Видео'
+    assert '1_monitoring_data' not in redis.values
+
+
+def test_legacy_account_subscribers_are_moved_to_set(storage):
+    connector, redis = storage
+    from plugins.Monitoring.schemas import MonitoredAccount
+
+    account = MonitoredAccount(social_network='instagram', nickname='first', media_type='Посты')
+    asyncio.run(redis.save_data(key=f'monitoring_subscribers_{account.key}', data=[1, 2]))
+
+    assert sorted(asyncio.run(connector.get_account_subscribers(account))) == [1, 2]
+    assert redis.sets[f'monitoring_account_subscribers_{account.key}'] == {'1', '2'}
+    assert f'monitoring_subscribers_{account.key}' not in redis.values
+
+    asyncio.run(connector.add_account_subscriber(account, user_id=3))
+    assert sorted(asyncio.run(connector.get_account_subscribers(account))) == [1, 2, 3]
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+from pyrogram import errors
+
+from common.sender import OutboundSendScheduler, SendPriority
+
+
+def test_status_flood_wait_is_not_retried_and_does_not_pause_sends():
+    scheduler = OutboundSendScheduler(global_rate=100, global_burst=10, chat_rate=100, chat_burst=10)
+    calls = []
+
+    async def edit_status():
+        calls.append('status')
+        raise errors.FloodWait(value=30)
+
+    async def reply():
+        calls.append('reply')
+
+    async def send():
+        with pytest.raises(errors.FloodWait):
+            await scheduler.send(chat_id=1, func=edit_status, priority=SendPriority.status)
+        # other sends of the bot aren't held back by the flood wait of status edit
+        await asyncio.wait_for(scheduler.send(chat_id=2, func=reply), timeout=1)
+
+    asyncio.run(send())
+
+    assert calls == ['status', 'reply']
+    assert scheduler.flood_wait_s == 0
+    assert scheduler.flood_waits == 1
+
+
+def test_announce_flood_wait_is_not_retried_and_does_not_pause_sends():
+    scheduler = OutboundSendScheduler(global_rate=100, global_burst=10, chat_rate=100, chat_burst=10)
+    calls = []
+
+    async def announce():
+        calls.append('announce')
+        raise errors.FloodWait(value=30)
+
+    async def reply():
+        calls.append('reply')
+
+    async def send():
+        with pytest.raises(errors.FloodWait):
+            await scheduler.send(chat_id=1, func=announce, priority=SendPriority.announce)
+        # announce engine pauses itself, replies aren't held back
+        await asyncio.wait_for(scheduler.send(chat_id=2, func=reply), timeout=1)
+
+    asyncio.run(send())
+
+    assert calls == ['announce', 'reply']
+    assert scheduler.flood_wait_s == 0
+
+
+def test_monitoring_flood_wait_pauses_monitoring_sends_only():
+    scheduler = OutboundSendScheduler(global_rate=100, global_burst=10, chat_rate=100, chat_burst=10)
+    calls = []
+
+    async def notify():
+        calls.append(('monitoring', time.monotonic()))
+        if len(calls) == 1:
+            raise errors.FloodWait(value=1)
+
+    async def reply():
+        calls.append(('reply', time.monotonic()))
+
+    async def send():
+        notification = asyncio.create_task(
+            scheduler.send(chat_id=1, func=notify, priority=SendPriority.monitoring))
+        while not calls:
+            await asyncio.sleep(0)
+        await asyncio.wait_for(scheduler.send(chat_id=2, func=reply), timeout=0.1)
+        await notification
+
+    asyncio.run(send())
+
+    # reply is sent during the flood wait, monitoring is retried after it
+    assert [name for name, _ in calls] == ['monitoring', 'reply', 'monitoring']
+    assert calls[2][1] - calls[0][1] >= 1
+    assert scheduler.flood_wait_s == 0
+
+
+def test_interactive_flood_wait_pauses_sends():
+    scheduler = OutboundSendScheduler(flood_retries=0)
+
+    async def reply():
+        raise errors.FloodWait(value=30)
+
+    async def send():
+        with pytest.raises(errors.FloodWait):
+            await scheduler.send(chat_id=1, func=reply)
+
+    asyncio.run(send())
+
+    assert scheduler.flood_wait_s > 0